@@ -0,0 +1,345 @@
+"""Bertsekas' auction algorithm with epsilon scaling, an assignment solver for student_matcher.
+
+The solution is within a chosen epsilon of the optimal total cost. Bids of one round are computed as NumPy array
+operations, split over threads for large rounds.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import colorlog as logging
+from scipy.optimize import linear_sum_assignment
+
+# The most the total cost of an assignment may exceed the optimum, by default
+DEFAULT_AUCTION_EPSILON: float = 1.0
+
+# Factor epsilon is divided by between the scaling phases
+AUCTION_SCALING_FACTOR: float = 5.0
+
+# Bidders whose bids are computed together, and the fewest bidders worth splitting over threads
+AUCTION_CHUNK_ROWS: int = 1024
+
+# Bidding rounds a phase may take per object before the assignment is solved with SciPy instead
+AUCTION_ROUNDS_PER_OBJECT: int = 100
+
+
+def group_identical_columns(cost_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Groups the columns of cost_matrix that are exactly equal, such as the capacity slots of one local student.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The (rows x classes) matrix of the distinct columns, and the class of every
+        column.
+    """
+    columns = np.ascontiguousarray(cost_matrix.T)
+    classes: Dict[bytes, int] = {}
+    column_classes = np.array([classes.setdefault(column.tobytes(), len(classes)) for column in columns], dtype=np.int64)
+    first_columns = np.unique(column_classes, return_index=True)[1]
+    return cost_matrix[:, first_columns], column_classes
+
+
+def _class_prices(prices: np.ndarray, class_starts: np.ndarray, class_sizes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The prices of the cheapest and the second cheapest object of every class, inf for classes of one object.
+
+    Objects are ordered by class.
+    """
+    cheapest = np.minimum.reduceat(prices, class_starts)
+    is_cheapest = prices == np.repeat(cheapest, class_sizes)
+    others = np.minimum.reduceat(np.where(is_cheapest, np.inf, prices), class_starts)
+    second = np.where(np.add.reduceat(is_cheapest, class_starts) > 1, cheapest, others)
+    return cheapest, second
+
+
+def _best_bids(
+    class_costs: np.ndarray,
+    class_prices: np.ndarray,
+    second_prices: np.ndarray,
+    bidders: np.ndarray,
+    epsilon: float) -> Tuple[np.ndarray, np.ndarray]:
+    """The class every bidder bids for and its bid, with values -cost - price of the cheapest object of a class.
+
+    A bidder bids the price at which its best object is epsilon worse than its second best object, which is the
+    cheapest object of another class or the second cheapest object of the same class.
+    """
+    values = -class_costs[bidders] - class_prices
+    rows = np.arange(len(bidders))
+    best_classes = np.argmax(values, axis=1)
+    best_values = values[rows, best_classes]
+    same_class_values = -class_costs[bidders, best_classes] - second_prices[best_classes]
+    # two passes of max are cheaper than a partition for the second best value
+    values[rows, best_classes] = -np.inf
+    second_values = np.maximum(values.max(axis=1), same_class_values) if values.shape[1] > 1 else same_class_values
+    # a bidder that has no other object keeps its class at any price, it outbids the others by epsilon
+    second_values = np.where(np.isfinite(second_values), second_values, best_values)
+    return best_classes, class_prices[best_classes] + (best_values - second_values) + epsilon
+
+
+def _place_class_bids(
+    bid_classes: np.ndarray,
+    bid_prices: np.ndarray,
+    bidders: np.ndarray,
+    prices: np.ndarray,
+    class_starts: np.ndarray,
+    class_sizes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Turns bids for classes into bids for objects: the r-th highest bid for a class goes to its r-th cheapest
+    object when it is above that object's price. Only the objects of the classes bid for are sorted.
+
+    No bid is dropped: a bid left without an object it outbids goes to the cheapest object of its class, where
+    it loses to the highest bid and its bidder bids again in the next round. As bids are at most epsilon above
+    the second cheapest object of their class, this only happens once the objects of a class are more than
+    epsilon apart in price, and the bidder would not want the pricier ones.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The object every bid is for, the bids and the bidders, in
+        order of the highest bid for every class.
+    """
+    order = np.lexsort((-bid_prices, bid_classes))
+    sorted_classes = bid_classes[order]
+    group_starts = np.flatnonzero(np.concatenate([[True], sorted_classes[1:] != sorted_classes[:-1]]))
+    group_lengths = np.diff(np.append(group_starts, len(order)))
+    ranks = np.arange(len(order)) - np.repeat(group_starts, group_lengths)
+    bid_groups = np.repeat(np.arange(len(group_starts)), group_lengths)
+
+    # the objects of every class bid for, from cheap to expensive
+    classes = sorted_classes[group_starts]
+    sizes = class_sizes[classes]
+    segment_starts = np.cumsum(sizes) - sizes
+    candidates = np.repeat(class_starts[classes] - segment_starts, sizes) + np.arange(sizes.sum())
+    by_price = candidates[np.lexsort((prices[candidates], np.repeat(np.arange(len(classes)), sizes)))]
+
+    cheapest = by_price[segment_starts[bid_groups]]
+    spilled = by_price[segment_starts[bid_groups] + np.minimum(ranks, sizes[bid_groups] - 1)]
+    amounts = bid_prices[order]
+    targets = np.where((ranks < sizes[bid_groups]) & (amounts > prices[spilled]), spilled, cheapest)
+    return targets, amounts, bidders[order]
+
+
+def _run_phase(
+    class_costs: np.ndarray,
+    object_classes: np.ndarray,
+    prices: np.ndarray,
+    epsilon: float,
+    executor: Optional[ThreadPoolExecutor],
+    previous_owners: Optional[np.ndarray] = None,
+    max_rounds: Optional[int] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Runs one auction phase from the given prices until every object is assigned, updating prices in place.
+
+    The pairs of the previous phase that are still within epsilon of their person's best object are kept, so
+    later phases only rebid the persons whose objects became too expensive.
+
+    Objects are grouped in classes of identical columns, ordered by class. A person bids for its best class and
+    the highest bids for a class win its cheapest objects, so persons competing for one local student's slots do
+    not outbid each other one epsilon at a time.
+
+    There are no more persons than objects. The problem is solved as the square one in which dummy persons,
+    valuing every object at 0, take the objects left over. Dummies are interchangeable, so they are not stored:
+    the k unassigned dummies bid together for the k cheapest objects no dummy holds, at the price of the next one.
+
+    Returns:
+        Optional[Tuple[np.ndarray, np.ndarray]]: The object assigned to every person, and the owner of every
+        object with dummies numbered len(class_costs). None when the phase took more than max_rounds rounds.
+    """
+    persons = class_costs.shape[0]
+    objects = len(object_classes)
+    class_sizes = np.bincount(object_classes, minlength=class_costs.shape[1])
+    class_starts = np.cumsum(class_sizes) - class_sizes
+    similar_objects = bool((class_sizes > 1).any())
+    dummy = persons
+    assigned = np.full(persons, -1, dtype=np.int64)
+    owners = np.full(objects, -1, dtype=np.int64)
+
+    if previous_owners is not None:
+        class_prices = np.minimum.reduceat(prices, class_starts) if similar_objects else prices
+        held = np.flatnonzero((previous_owners >= 0) & (previous_owners < dummy))
+        for start in range(0, len(held), AUCTION_CHUNK_ROWS):
+            chunk = held[start:start + AUCTION_CHUNK_ROWS]
+            holders = previous_owners[chunk]
+            values = -class_costs[holders, object_classes[chunk]] - prices[chunk]
+            best_values = (-class_costs[holders] - class_prices).max(axis=1)
+            kept = values >= best_values - epsilon
+            owners[chunk[kept]] = holders[kept]
+            assigned[holders[kept]] = chunk[kept]
+        held_by_dummies = np.flatnonzero(previous_owners == dummy)
+        owners[held_by_dummies[prices[held_by_dummies] <= prices.min() + epsilon]] = dummy
+    idle_dummies = objects - persons - int(np.count_nonzero(owners == dummy))
+
+    rounds = 0
+    while True:
+        bidders = np.flatnonzero(assigned < 0)
+        if len(bidders) == 0 and idle_dummies == 0:
+            return assigned, owners
+        if max_rounds is not None and rounds >= max_rounds:
+            return None
+        rounds += 1
+
+        # a class is as cheap as its cheapest object, objects are ordered by class
+        if similar_objects:
+            class_prices, second_prices = _class_prices(prices, class_starts, class_sizes)
+        else:
+            class_prices, second_prices = prices, np.full(objects, np.inf)
+
+        # Jacobi auction: every unassigned person bids at the same time, on the prices of the previous round
+        chunks = [bidders[start:start + AUCTION_CHUNK_ROWS] for start in range(0, len(bidders), AUCTION_CHUNK_ROWS)]
+        if executor is not None and len(chunks) > 1:
+            bids = list(executor.map(lambda chunk: _best_bids(class_costs, class_prices, second_prices, chunk, epsilon), chunks))
+        else:
+            bids = [_best_bids(class_costs, class_prices, second_prices, chunk, epsilon) for chunk in chunks]
+        bid_objects = [chunk_bids[0] for chunk_bids in bids]
+        bid_amounts = [chunk_bids[1] for chunk_bids in bids]
+        bid_owners = list(chunks)
+        if similar_objects and bids:
+            bid_objects, bid_amounts, bid_owners = (
+                [array] for array in _place_class_bids(
+                    np.concatenate(bid_objects), np.concatenate(bid_amounts), bidders, prices, class_starts, class_sizes))
+
+        if idle_dummies:
+            # idle dummies bid for the cheapest objects no dummy holds, of which there are at least idle_dummies + 1
+            held_by_dummies = owners == dummy
+            open_objects = np.flatnonzero(~held_by_dummies)
+            cheapest = open_objects[np.argpartition(prices[open_objects], idle_dummies)[:idle_dummies + 1]]
+            cheapest = cheapest[np.argsort(prices[cheapest], kind='stable')]
+            next_price = prices[cheapest[-1]]
+            # dummies outbidding each other would raise the cheaper objects they hold to next_price, one epsilon at a time
+            np.maximum(prices, next_price, out=prices, where=held_by_dummies)
+            bid_objects.append(cheapest[:idle_dummies])
+            bid_amounts.append(np.full(idle_dummies, next_price + epsilon))
+            bid_owners.append(np.full(idle_dummies, dummy, dtype=np.int64))
+
+        bid_objects_array = np.concatenate(bid_objects)
+        bid_amounts_array = np.concatenate(bid_amounts)
+        bid_owners_array = np.concatenate(bid_owners)
+
+        # the highest bid for every object wins it
+        order = np.lexsort((-bid_amounts_array, bid_objects_array))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = bid_objects_array[order][1:] != bid_objects_array[order][:-1]
+        winners = order[first]
+        won_objects, winning_owners = bid_objects_array[winners], bid_owners_array[winners]
+
+        outbid = owners[won_objects]
+        assigned[outbid[(outbid >= 0) & (outbid < dummy)]] = -1
+        idle_dummies += int(np.count_nonzero(outbid == dummy)) - int(np.count_nonzero(winning_owners == dummy))
+        owners[won_objects] = winning_owners
+        prices[won_objects] = bid_amounts_array[winners]
+        real_winners = winning_owners < dummy
+        assigned[winning_owners[real_winners]] = won_objects[real_winners]
+
+
+def _satisfies_complementary_slackness(
+    class_costs: np.ndarray,
+    object_classes: np.ndarray,
+    prices: np.ndarray,
+    assigned: np.ndarray,
+    owners: np.ndarray,
+    epsilon: float) -> bool:
+    """Whether every person, dummies included, holds an object within epsilon of its best one at the final prices.
+
+    This certifies that the assignment is within epsilon times the number of objects of the optimal total cost.
+    """
+    class_sizes = np.bincount(object_classes, minlength=class_costs.shape[1])
+    class_prices = np.minimum.reduceat(prices, np.cumsum(class_sizes) - class_sizes)
+    # rounding of the prices, which are sums of many bids
+    tolerance = epsilon + 1e-9 * max(float(np.abs(prices).max()), 1.0)
+    for start in range(0, len(assigned), AUCTION_CHUNK_ROWS):
+        persons = np.arange(start, min(start + AUCTION_CHUNK_ROWS, len(assigned)))
+        values = -class_costs[persons, object_classes[assigned[persons]]] - prices[assigned[persons]]
+        best_values = (-class_costs[persons] - class_prices).max(axis=1)
+        if (values < best_values - tolerance).any():
+            return False
+    # dummies value every object at 0, they must hold the cheapest objects
+    held_by_dummies = owners == len(assigned)
+    return not held_by_dummies.any() or bool(prices[held_by_dummies].max() <= prices.min() + tolerance)
+
+
+def solve_with_auction(
+    cost_matrix: np.ndarray,
+    epsilon: float = DEFAULT_AUCTION_EPSILON,
+    workers: int = 1) -> List[Tuple[int, int]]:
+    """Solves the rectangular assignment problem with Bertsekas' auction algorithm and epsilon scaling.
+
+    Persons bid for objects, raising their prices, until every person holds an object within epsilon of its best
+    one. Phases start with a large epsilon and divide it by AUCTION_SCALING_FACTOR, keeping the prices, so most of
+    the bidding happens while increments are large. The last phase uses epsilon / n for n objects, which keeps
+    the total cost within epsilon of the optimum. Identical columns are bid for as one class of similar objects.
+    Rows with the same cost in every column, such as students without any feasible pair, are equally well off
+    with any object: they join the dummy persons and take objects left over at the end.
+
+    A phase taking more than AUCTION_ROUNDS_PER_OBJECT rounds per object, or a result whose prices do not
+    certify the epsilon bound, is logged and the assignment is solved with SciPy's linear_sum_assignment instead.
+
+    Args:
+        cost_matrix (np.ndarray): A 2D array of assignment costs.
+        epsilon (float): The most the total cost may exceed the optimal total cost.
+        workers (int): Threads computing the bids of large rounds, NumPy releases the GIL while it does.
+
+    Returns:
+        List[Tuple[int, int]]: The assigned (row, column) positions, every row or every column, whichever is fewer.
+    """
+    cost_matrix = np.asarray(cost_matrix, dtype=np.float64)
+    transposed = cost_matrix.shape[0] > cost_matrix.shape[1]
+    if transposed:
+        cost_matrix = cost_matrix.T
+    persons, objects = cost_matrix.shape
+    if persons == 0:
+        return []
+
+    class_costs, column_classes = group_identical_columns(cost_matrix)
+    # objects are ordered by class, columns maps them back to the columns of cost_matrix
+    columns = np.argsort(column_classes, kind='stable')
+    object_classes = column_classes[columns]
+    constant = class_costs.min(axis=1) == class_costs.max(axis=1)
+    bidding = np.flatnonzero(~constant)
+    class_costs = class_costs[bidding]
+
+    final_epsilon = epsilon / objects
+    prices = np.zeros(objects)
+    assigned = np.empty(0, dtype=np.int64)
+    owners = None
+    phases = 0
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 and len(bidding) > AUCTION_CHUNK_ROWS else None
+    try:
+        phase_epsilon = max(float(class_costs.max() - class_costs.min()) / AUCTION_SCALING_FACTOR if len(bidding) else 0.0, final_epsilon)
+        while len(bidding):
+            result = _run_phase(
+                class_costs, object_classes, prices, phase_epsilon, executor, owners, AUCTION_ROUNDS_PER_OBJECT * objects)
+            if result is None:
+                logging.warning("Auction phase with epsilon %g did not finish in %i rounds, solving the %i x %i "
+                                "assignment with SciPy instead", phase_epsilon, AUCTION_ROUNDS_PER_OBJECT * objects,
+                                persons, objects)
+                return _solve_with_scipy(cost_matrix, transposed)
+            assigned, owners = result
+            phases += 1
+            if phase_epsilon <= final_epsilon:
+                break
+            phase_epsilon = max(phase_epsilon / AUCTION_SCALING_FACTOR, final_epsilon)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if len(bidding) and not _satisfies_complementary_slackness(class_costs, object_classes, prices, assigned, owners, final_epsilon):
+        logging.warning("Auction prices do not certify an assignment within %g of the optimum, solving the %i x %i "
+                        "assignment with SciPy instead", epsilon, persons, objects)
+        return _solve_with_scipy(cost_matrix, transposed)
+
+    logging.debug("Auction solved a %i x %i assignment over %i distinct columns in %i phases",
+                  persons, objects, len(np.unique(object_classes)), phases)
+    objects_of_rows = np.empty(persons, dtype=np.int64)
+    objects_of_rows[bidding] = assigned
+    objects_of_rows[constant] = np.setdiff1d(np.arange(objects), assigned)[:int(constant.sum())]
+    pairs = list(zip(range(persons), columns[objects_of_rows].tolist()))
+    if transposed:
+        pairs = sorted((column, row) for row, column in pairs)
+    return pairs
+
+
+def _solve_with_scipy(cost_matrix: np.ndarray, transposed: bool) -> List[Tuple[int, int]]:
+    """The optimal assignment of cost_matrix, as pairs of the matrix before it was transposed."""
+    rows, columns = linear_sum_assignment(cost_matrix)
+    if transposed:
+        rows, columns = columns, rows
+    return sorted(zip(rows.tolist(), columns.tolist()))
+
+
+def make_auction_solver(epsilon: float = DEFAULT_AUCTION_EPSILON, workers: int = 1) -> Callable[[np.ndarray], List[Tuple[int, int]]]:
+    """The auction solver with the given epsilon and workers, as a student_matcher.Solver."""
+    return partial(solve_with_auction, epsilon=epsilon, workers=workers)
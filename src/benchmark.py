@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""Times every stage of the matching pipeline on synthetic cohorts of growing size.
+
+For each size a cohort is generated with synthetic_cohort, written to a temporary folder and run through the
+same stages as main.py. The wall time and the peak memory allocated during every stage are reported, followed
+by the scaling exponent of every stage between consecutive sizes (1 is linear, 2 quadratic).
+"""
+import argparse
+import configparser
+import csv
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import colorlog as logging
+
+import distance_calculator
+import faculty_matrix
+import formatter
+import ingestion
+import normalization_calculator
+import report
+import scoring_plan
+import student_filter
+import student_matcher
+import synthetic_cohort
+
+DEFAULT_SIZES: Tuple[int, ...] = (100, 500, 1000, 5000)
+
+# Share of the students in a cohort that are local students
+LOCAL_SHARE: float = 0.45
+
+MAIN_SCRIPT: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+@dataclass(frozen=True)
+class StageMeasurement:
+    """The cost of one pipeline stage on one cohort.
+
+    Attributes:
+        size (int): The number of students in the cohort, local and incoming together.
+        stage (str): The name of the stage.
+        seconds (float): The wall time of the stage.
+        peak_mib (Optional[float]): The peak memory allocated during the stage, None when not traced.
+    """
+    size: int
+    stage: str
+    seconds: float
+    peak_mib: Optional[float]
+
+
+def measure(stage: str, size: int, function: Callable[[], Any], trace_memory: bool,
+            measurements: List[StageMeasurement]) -> Any:
+    """Runs function once, appends its StageMeasurement to measurements and returns its result."""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function()
+    finally:
+        seconds = time.perf_counter() - start
+        peak_mib = None
+        if trace_memory:
+            peak_mib = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+    measurements.append(StageMeasurement(size, stage, seconds, peak_mib))
+    logging.info("%6i students  %-28s %9.3f s%s", size, stage, seconds,
+                 '' if peak_mib is None else f'  {peak_mib:9.1f} MiB')
+    return result
+
+
+def run_pipeline(
+    size: int,
+    config_dir: str,
+    work_dir: str,
+    seed: int,
+    solver: str,
+    workers: int,
+    trace_memory: bool) -> List[StageMeasurement]:
+    """Generates a cohort of size students and runs it through the pipeline stages of main.py.
+
+    Args:
+        size (int): The number of students, LOCAL_SHARE of them local.
+        config_dir (str): The config folder.
+        work_dir (str): Folder for the generated input files and the report.
+        seed (int): Seed of the cohort generator.
+        solver (str): The assignment solver in student_matcher.SOLVERS.
+        workers (int): Worker processes for the distance matrix.
+        trace_memory (bool): Whether to trace the peak memory of every stage.
+
+    Returns:
+        List[StageMeasurement]: The measurements of every stage, in pipeline order.
+    """
+    current_date = datetime.now()
+    local_count = max(1, int(round(size * LOCAL_SHARE)))
+    local_export, incoming_export = synthetic_cohort.generate_cohort(
+        local_count, size - local_count, config_dir, seed, current_date)
+    local_path, incoming_path = synthetic_cohort.write_cohort(local_export, incoming_export, work_dir)
+
+    hobbies: List[str] = pd.read_csv(os.path.join(config_dir, 'hobbies.csv'), quotechar="'").iloc[:, 0].tolist()
+    faculty_distances = pd.read_excel(os.path.join(config_dir, 'faculty_distances.xlsx'), index_col=0)
+    local_irrelevant_columns = pd.read_csv(os.path.join(config_dir, 'local_students_irrelevant_columns.csv'), quotechar="'")
+    incoming_irrelevant_columns = pd.read_csv(os.path.join(config_dir, 'incoming_students_irrelevant_columns.csv'), quotechar="'")
+    config = configparser.ConfigParser()
+    config.read(os.path.join(config_dir, 'config.ini'))
+    faculties = faculty_matrix.build_faculty_matrix(
+        faculty_distances, config.getfloat('parameters', 'unknown_faculty_distance', fallback=None))
+    local_mapping = formatter.read_column_mapping(os.path.join(config_dir, 'local_students_column_renames.csv'))
+    incoming_mapping = formatter.read_column_mapping(os.path.join(config_dir, 'incoming_students_column_renames.csv'))
+    matching_columns = ingestion.read_matching_columns(os.path.join(config_dir, 'matching_columns.csv'))
+
+    measurements: List[StageMeasurement] = []
+
+    def validate() -> None:
+        # A fresh interpreter, so the time includes the imports of main.py validate
+        subprocess.run([sys.executable, MAIN_SCRIPT, 'validate', '--input-dir', work_dir, '--config-dir', config_dir,
+                        '--log-level', 'WARNING'], check=True)
+
+    def ingest() -> Tuple[pd.DataFrame, pd.DataFrame]:
+        local_students = ingestion.read_students(
+            local_path, local_mapping, ingestion.needed_columns(local_mapping, matching_columns['local'], hobbies))
+        incoming_students = ingestion.read_students(
+            incoming_path, incoming_mapping,
+            ingestion.needed_columns(incoming_mapping, matching_columns['incoming'], hobbies, [student_filter.ACCESSIBILITY_COLUMN]))
+        return local_students, incoming_students
+
+    def prepare(local_students: pd.DataFrame, incoming_students: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        local_students = formatter.remap_columns(local_mapping, local_students)
+        incoming_students = formatter.remap_columns(incoming_mapping, incoming_students)
+        local_students, incoming_students = formatter.convert_all_dates_to_datetime(local_students, incoming_students)
+        return formatter.rename_timestamps(local_students, incoming_students)
+
+    def finish(local_students: pd.DataFrame, incoming_students: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        local_students, incoming_students = formatter.drop_irrelevant_columns(
+            local_students, incoming_students, faculty_distances, local_irrelevant_columns, incoming_irrelevant_columns)
+        local_students = formatter.adjust_dataframe_dates(local_students, ['Availability', 'AvailabilityText'], current_date)
+        incoming_students = formatter.adjust_dataframe_dates(incoming_students, ['Arrival'], current_date)
+        local_students, incoming_students = formatter.convert_categories_to_numerical(local_students, incoming_students, hobbies)
+        return local_students.reset_index(drop=True), incoming_students.reset_index(drop=True)
+
+    def match(distance_matrix: pd.DataFrame, local_students: pd.DataFrame, incoming_students: pd.DataFrame) -> np.ndarray:
+        return student_matcher.compute_optimal_pairs(
+            distance_matrix, local_students, incoming_students,
+            formatter.get_base_capacities(local_students), formatter.get_base_necessity(incoming_students), solver=solver)
+
+    measure('startup.validate', size, validate, False, measurements)
+    local_students, incoming_students = measure('ingestion', size, ingest, trace_memory, measurements)
+    local_students, incoming_students = measure(
+        'formatter.prepare', size, lambda: prepare(local_students, incoming_students), trace_memory, measurements)
+    local_students, incoming_students, _, _ = measure(
+        'student_filter.apply_filters', size,
+        lambda: student_filter.apply_filters(local_students, incoming_students, current_date), trace_memory, measurements)
+    local_students, incoming_students = measure(
+        'formatter.finish', size, lambda: finish(local_students, incoming_students), trace_memory, measurements)
+    normal_dict: Dict[str, float] = measure(
+        'normalization', size,
+        lambda: normalization_calculator.compute_normalization_values(
+            local_students, incoming_students, config, hobbies, faculty_distances), trace_memory, measurements)
+    plan = scoring_plan.build_scoring_plan(config, normal_dict, hobbies)
+    distance_matrix = measure(
+        'distances', size,
+        lambda: distance_calculator.caculate_student_distances(local_students, incoming_students, plan, faculties, workers),
+        trace_memory, measurements)
+    assignment = measure(
+        'matching', size, lambda: match(distance_matrix, local_students, incoming_students), trace_memory, measurements)
+    measure('report', size,
+            lambda: report.create_report(assignment, local_students, incoming_students, os.path.join(work_dir, 'report.csv')),
+            trace_memory, measurements)
+    return measurements
+
+
+def scaling_exponents(measurements: Sequence[StageMeasurement]) -> Dict[str, List[Tuple[int, int, float]]]:
+    """The exponent k of time ~ size ** k of every stage between consecutive sizes.
+
+    Returns:
+        Dict[str, List[Tuple[int, int, float]]]: For every stage, (smaller size, larger size, exponent) triples.
+    """
+    frame = pd.DataFrame(measurements)
+    exponents: Dict[str, List[Tuple[int, int, float]]] = {}
+    for stage, timings in frame.groupby('stage', sort=False):
+        timings = timings.sort_values('size')
+        sizes, seconds = timings['size'].to_numpy(), timings['seconds'].to_numpy()
+        exponents[stage] = [
+            (int(sizes[i]), int(sizes[i + 1]),
+             float(np.log(max(seconds[i + 1], 1e-9) / max(seconds[i], 1e-9)) / np.log(sizes[i + 1] / sizes[i])))
+            for i in range(len(sizes) - 1)]
+    return exponents
+
+
+def print_summary(measurements: Sequence[StageMeasurement]) -> None:
+    """Prints the seconds and peak memory of every stage per size, and the scaling exponents between sizes."""
+    frame = pd.DataFrame(measurements)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print('\nSeconds per stage')
+        print(frame.pivot(index='stage', columns='size', values='seconds').loc[frame['stage'].unique()].round(3))
+        if frame['peak_mib'].notna().any():
+            print('\nPeak MiB allocated per stage')
+            print(frame.pivot(index='stage', columns='size', values='peak_mib').loc[frame['stage'].unique()].round(1))
+
+    print('\nScaling exponent between sizes (time ~ size ** k)')
+    for stage, steps in scaling_exponents(measurements).items():
+        print(f"  {stage:<28} " + '  '.join(f'{low}->{high}: {exponent:5.2f}' for low, high, exponent in steps))
+
+    # ru_maxrss is in KiB on Linux
+    print(f"\nPeak resident memory of the process: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+
+
+def write_measurements(measurements: Sequence[StageMeasurement], path: str) -> None:
+    """Writes the measurements as CSV, so runs can be compared to find regressions."""
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['size', 'stage', 'seconds', 'peak_mib'])
+        for measurement in measurements:
+            writer.writerow([measurement.size, measurement.stage, f'{measurement.seconds:.6f}',
+                             '' if measurement.peak_mib is None else f'{measurement.peak_mib:.3f}'])
+    logging.info("Measurements written to %s", path)
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark the matching pipeline on synthetic cohorts.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='cohort sizes, local and incoming students together (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the cohort generator (default: %(default)s)')
+    parser.add_argument('--config-dir', default='config', help='folder holding the configuration files (default: %(default)s)')
+    parser.add_argument('--solver', choices=sorted(student_matcher.SOLVERS), default=student_matcher.DEFAULT_SOLVER,
+                        help='assignment solver backend (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes for the distance matrix (default: %(default)s)')
+    parser.add_argument('--no-memory', dest='trace_memory', action='store_false',
+                        help='do not trace the peak memory of every stage, tracing slows down pure Python stages')
+    parser.add_argument('--output', help='CSV file to write the measurements to')
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    logging.basicConfig(level=logging.INFO)
+
+    measurements: List[StageMeasurement] = []
+    for size in sorted(arguments.sizes):
+        with tempfile.TemporaryDirectory(prefix='buddy_matcher_benchmark_') as work_dir:
+            measurements.extend(run_pipeline(
+                size, arguments.config_dir, work_dir, arguments.seed, arguments.solver, arguments.workers,
+                arguments.trace_memory))
+
+    print_summary(measurements)
+    if arguments.output:
+        write_measurements(measurements, arguments.output)
+
+
+if __name__ == '__main__':
+    main()
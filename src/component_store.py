@@ -0,0 +1,270 @@
+import dataclasses
+import glob
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import colorlog as logging
+
+import distance_calculator
+from scoring_plan import ScoringPlan, DISTANCE_COMPONENTS
+from faculty_matrix import FacultyMatrix
+
+STORE_PREFIX: str = 'distance_components_'
+
+# The encoded local features, encoded incoming features and ScoringPlan fields every component is computed from,
+# see distance_calculator.calculate_component_distances. The faculty component also depends on the faculty matrix.
+# A component whose inputs did not change is copied from the last stored stack instead of being recomputed.
+COMPONENT_INPUTS: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]]] = {
+    'age': (('age',), ('age',), ('desired_age_difference',)),
+    'gender': (
+        ('any_gender', 'gender', 'gender_preference'),
+        ('any_gender', 'gender', 'gender_preference'),
+        ('local_gender_preference_penalty', 'incoming_gender_preference_penalty', 'gender_range')),
+    'age_gender': (('age', 'gender'), ('age', 'gender'), ('desired_age_difference',)),
+    'university': (('university',), ('university',), ()),
+    'faculty': (('faculty', 'faculty_code'), ('faculty', 'faculty_code'), ()),
+    'interests': (('hobbies',), ('hobbies',), ('hobby_weights', 'hobby_range')),
+    'availability': (('availability',), ('arrival',), ('date_range',)),
+    'text_availability': (('availability_text',), ('arrival',), ('desired_date_difference',)),
+    'meeting_frequency': (('meet_frequency',), ('meet_frequency',), ('meeting_frequency_range',)),
+    'expectations': (('expectations',), ('expectations',), ()),
+}
+
+
+def _update_with_array(digest, name: str, array: np.ndarray) -> None:
+    array = np.ascontiguousarray(array)
+    digest.update(f'{name}:{array.dtype.str}:{array.shape}'.encode())
+    digest.update(array.tobytes())
+
+
+def _plan_value(plan: ScoringPlan, name: str) -> str:
+    value = getattr(plan, name)
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    return f'{name}:{value!r}'
+
+
+def compute_store_key(
+    local: Dict[str, np.ndarray],
+    incoming: Dict[str, np.ndarray],
+    plan: ScoringPlan,
+    faculty_matrix: np.ndarray) -> str:
+    """Hashes everything the raw distance components depend on.
+
+    The factors of the plan are deliberately left out: they only weigh the components, so changing them
+    must not invalidate the store.
+
+    Args:
+        local (Dict[str, np.ndarray]): Encoded local students, see distance_calculator.encode_students.
+        incoming (Dict[str, np.ndarray]): Encoded incoming students, see distance_calculator.encode_students.
+        plan (ScoringPlan): The scoring plan of the run.
+        faculty_matrix (np.ndarray): The faculty distances, see FacultyMatrix.distances.
+
+    Returns:
+        str: A hex digest identifying the component stack.
+    """
+    digest = hashlib.sha256()
+    for side in (local, incoming):
+        for key in sorted(side):
+            _update_with_array(digest, key, side[key])
+
+    faculty_matrix = np.ascontiguousarray(faculty_matrix)
+    digest.update(f'faculty_matrix:{faculty_matrix.shape}'.encode())
+    digest.update(faculty_matrix.tobytes())
+
+    for field in dataclasses.fields(plan):
+        if field.name == 'factors':
+            continue
+        digest.update(_plan_value(plan, field.name).encode())
+    digest.update(repr(DISTANCE_COMPONENTS).encode())
+    return digest.hexdigest()
+
+
+def compute_component_keys(
+    local: Dict[str, np.ndarray],
+    incoming: Dict[str, np.ndarray],
+    plan: ScoringPlan,
+    faculty_matrix: np.ndarray) -> Dict[str, str]:
+    """Hashes the inputs of every component separately, see COMPONENT_INPUTS.
+
+    Returns:
+        Dict[str, str]: A hex digest for every component in DISTANCE_COMPONENTS.
+    """
+    keys = {}
+    for name in DISTANCE_COMPONENTS:
+        local_features, incoming_features, plan_fields = COMPONENT_INPUTS[name]
+        digest = hashlib.sha256(name.encode())
+        for side_name, side, features in (('local', local, local_features), ('incoming', incoming, incoming_features)):
+            for feature in features:
+                _update_with_array(digest, f'{side_name}.{feature}', side[feature])
+        if name == 'faculty':
+            _update_with_array(digest, 'faculty_matrix', faculty_matrix)
+        for field in plan_fields:
+            digest.update(_plan_value(plan, field).encode())
+        keys[name] = digest.hexdigest()
+    return keys
+
+
+def store_path(directory: str, key: str) -> str:
+    """Returns the .npy file holding the component stack for key."""
+    return os.path.join(directory, f'{STORE_PREFIX}{key[:32]}.npy')
+
+
+def keys_path(stack_path: str) -> str:
+    """Returns the .json file next to a component stack, holding the compute_component_keys of its components."""
+    return os.path.splitext(stack_path)[0] + '.json'
+
+
+def _find_partial_stack(directory: str, shape: tuple, component_keys: Dict[str, str]) -> Tuple[Optional[str], Tuple[str, ...]]:
+    """Finds a stored stack of the same shape sharing some component keys, returning its path and those components."""
+    for path in glob.glob(os.path.join(directory, f'{STORE_PREFIX}*.npy')):
+        if path.endswith('.tmp.npy') or not os.path.exists(keys_path(path)):
+            continue
+        try:
+            with open(keys_path(path)) as file:
+                stored_keys = json.load(file)
+            stored_shape = np.load(path, mmap_mode='r').shape
+        except (ValueError, OSError):
+            continue
+        reusable = tuple(name for name in DISTANCE_COMPONENTS if stored_keys.get(name) == component_keys[name])
+        if stored_shape == shape and reusable:
+            return path, reusable
+    return None, ()
+
+
+def load_component_stack(directory: str, key: str) -> Optional[np.memmap]:
+    """Opens the stored component stack for key read-only, or returns None when there is none."""
+    path = store_path(directory, key)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        return np.load(path, mmap_mode='r')
+    except (ValueError, OSError) as e:
+        logging.warning("Ignoring unreadable distance component store %s: %s", path, e)
+        return None
+
+
+def remove_stale_stores(directory: str, keep: str) -> None:
+    """Deletes every component stack in directory except the one at keep, so old runs do not pile up."""
+    for path in glob.glob(os.path.join(directory, f'{STORE_PREFIX}*.npy')):
+        if path.endswith('.tmp.npy'):
+            continue
+        if os.path.abspath(path) != os.path.abspath(keep):
+            os.remove(path)
+            if os.path.exists(keys_path(path)):
+                os.remove(keys_path(path))
+            logging.info("Removed stale distance component store %s", path)
+
+
+def weigh_component_stack(stack: np.ndarray, plan: ScoringPlan) -> np.ndarray:
+    """Weighs a (components x L x I) stack by the factors of the plan in one tensordot over the stack.
+
+    Args:
+        stack (np.ndarray): The component stack, in DISTANCE_COMPONENTS order.
+        plan (ScoringPlan): The scoring plan holding the factors.
+
+    Returns:
+        np.ndarray: The L x I distance matrix.
+    """
+    return np.tensordot(plan.factor_vector, stack, axes=1)
+
+
+def store_component_stack(
+    local: Dict[str, np.ndarray],
+    incoming: Dict[str, np.ndarray],
+    plan: ScoringPlan,
+    faculty_matrix: np.ndarray,
+    directory: str,
+    workers: int = 1) -> str:
+    """Makes sure the component stack of the students is stored in directory, returning its path.
+
+    The per-component L x I matrices are persisted as one memory-mapped .npy stack in directory, keyed by
+    compute_store_key, and reused as they are when the key matches. When the students are the same but the inputs
+    of some components changed, such as the hobbies or their weights, the other components are copied from the
+    stored stack and only those components are computed again.
+
+    Args:
+        local (Dict[str, np.ndarray]): Encoded local students, see distance_calculator.encode_students.
+        incoming (Dict[str, np.ndarray]): Encoded incoming students, see distance_calculator.encode_students.
+        plan (ScoringPlan): The scoring plan of the run, its factors are not used.
+        faculty_matrix (np.ndarray): The faculty distances, see FacultyMatrix.distances.
+        directory (str): Directory holding the component store.
+        workers (int): Worker processes used when the components have to be computed.
+
+    Returns:
+        str: The path of the (components x L x I) float64 stack, in DISTANCE_COMPONENTS order.
+    """
+    key = compute_store_key(local, incoming, plan, faculty_matrix)
+    path = store_path(directory, key)
+    if load_component_stack(directory, key) is not None:
+        logging.info("Reusing distance components from %s", path)
+        return path
+
+    os.makedirs(directory, exist_ok=True)
+    temporary_path = path + '.tmp.npy'
+    shape = (len(DISTANCE_COMPONENTS), len(local['age']), len(incoming['age']))
+
+    component_keys = compute_component_keys(local, incoming, plan, faculty_matrix)
+    partial_path, reusable = _find_partial_stack(directory, shape, component_keys)
+
+    try:
+        if partial_path is not None:
+            stale = [name for name in DISTANCE_COMPONENTS if name not in reusable]
+            logging.info("Reusing %i distance components from %s, computing %s",
+                         len(reusable), partial_path, ', '.join(stale))
+            shutil.copyfile(partial_path, temporary_path)
+            stack = np.load(temporary_path, mmap_mode='r+')
+            for name in stale:
+                stack[DISTANCE_COMPONENTS.index(name)] = distance_calculator.calculate_component_distances(
+                    local, incoming, plan, faculty_matrix, (name,))[name]
+        else:
+            stack = np.lib.format.open_memmap(temporary_path, mode='w+', dtype=np.float64, shape=shape)
+            distance_calculator.calculate_component_stack(
+                local, incoming, plan, faculty_matrix, stack, workers=workers)
+        stack.flush()
+        del stack
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    os.replace(temporary_path, path)
+    with open(keys_path(path), 'w') as file:
+        json.dump(component_keys, file)
+    logging.info("Distance components stored in %s", path)
+    remove_stale_stores(directory, keep=path)
+    return path
+
+
+def calculate_distances_with_store(
+    local_students: pd.DataFrame,
+    incoming_students: pd.DataFrame,
+    plan: ScoringPlan,
+    faculties: FacultyMatrix,
+    directory: str,
+    workers: int = 1) -> np.ndarray:
+    """Calculates the distance matrix, reusing the raw distance components of an earlier run when possible.
+
+    The components come from store_component_stack. When only the factors changed since the last run, the stored
+    stack is reused and the distance matrix is a single weighted sum over it.
+
+    Args:
+        local_students (pd.DataFrame): The prepared local students.
+        incoming_students (pd.DataFrame): The prepared incoming students.
+        plan (ScoringPlan): The scoring plan of the run.
+        faculties (FacultyMatrix): The coded faculty distances.
+        directory (str): Directory holding the component store.
+        workers (int): Worker processes used when the components have to be computed.
+
+    Returns:
+        np.ndarray: An L x I float64 distance matrix.
+    """
+    local, incoming = distance_calculator.encode_students(local_students, incoming_students, faculties, plan)
+    path = store_component_stack(local, incoming, plan, faculties.distances, directory, workers)
+    return weigh_component_stack(np.load(path, mmap_mode='r'), plan)
@@ -0,0 +1,101 @@
+import configparser
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import dates
+
+# A constraint is the name it is configured by and a function returning the L x I mask of infeasible pairs,
+# computed from the features of distance_calculator.encode_students
+Constraint = Tuple[str, Callable[[Dict[str, np.ndarray], Dict[str, np.ndarray]], np.ndarray]]
+
+# Whether each constraint is used when config.ini has no [constraints] entry for it
+DEFAULT_ENABLED_CONSTRAINTS: Dict[str, bool] = {
+    'arrival_before_availability': False,
+    'strict_gender_preference': False,
+}
+
+
+def arrival_before_availability(local: Dict[str, np.ndarray], incoming: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Marks pairs where the incoming student arrives on or before the day the local student is available.
+
+    These are the pairs calculate_text_availability_distance gives a distance of 100. Pairs with a missing date
+    stay feasible, as they are scored with the neutral distance of a missing component.
+
+    Args:
+        local (Dict[str, np.ndarray]): The encoded local students.
+        incoming (Dict[str, np.ndarray]): The encoded incoming students.
+
+    Returns:
+        np.ndarray: L x I boolean mask of the infeasible pairs.
+    """
+    days_between = dates.day_difference(incoming['arrival'][None, :], local['availability_text'][:, None])
+    with np.errstate(invalid='ignore'):
+        return days_between <= 0
+
+
+def strict_gender_preference(local: Dict[str, np.ndarray], incoming: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Marks pairs where either student has a gender preference the other student does not meet.
+
+    Students without a preference, and students whose gender or preference is missing, conflict with no one.
+
+    Args:
+        local (Dict[str, np.ndarray]): The encoded local students.
+        incoming (Dict[str, np.ndarray]): The encoded incoming students.
+
+    Returns:
+        np.ndarray: L x I boolean mask of the infeasible pairs.
+    """
+    def conflict(preference: np.ndarray, gender: np.ndarray) -> np.ndarray:
+        return (preference != gender) & (preference >= 0) & (gender >= 0)
+
+    local_conflict = ~local['any_gender'][:, None] & conflict(local['gender_preference'][:, None], incoming['gender'][None, :])
+    incoming_conflict = ~incoming['any_gender'][None, :] & conflict(local['gender'][:, None], incoming['gender_preference'][None, :])
+    return local_conflict | incoming_conflict
+
+
+CONSTRAINTS: List[Constraint] = [
+    ('arrival_before_availability', arrival_before_availability),
+    ('strict_gender_preference', strict_gender_preference),
+]
+
+
+def build_constraints(configs: configparser.ConfigParser) -> List[Constraint]:
+    """
+    Selects the constraints enabled in the [constraints] section of the configuration.
+
+    Args:
+        configs (configparser.ConfigParser): Configuration parser, the [constraints] section is optional.
+
+    Returns:
+        List[Constraint]: The enabled constraints, in the order of CONSTRAINTS.
+    """
+    return [
+        (name, constraint) for name, constraint in CONSTRAINTS
+        if configs.getboolean('constraints', name, fallback=DEFAULT_ENABLED_CONSTRAINTS[name])]
+
+
+def infeasible_pairs(
+    local: Dict[str, np.ndarray],
+    incoming: Dict[str, np.ndarray],
+    constraints: List[Constraint]) -> Optional[np.ndarray]:
+    """
+    Combines the masks of every constraint into one mask of the pairs that may never be matched.
+
+    Args:
+        local (Dict[str, np.ndarray]): The encoded local students.
+        incoming (Dict[str, np.ndarray]): The encoded incoming students.
+        constraints (List[Constraint]): The constraints to apply.
+
+    Returns:
+        Optional[np.ndarray]: L x I boolean mask of the infeasible pairs, or None when no constraint is enabled.
+    """
+    if not constraints:
+        return None
+
+    infeasible = np.zeros((len(local['age']), len(incoming['age'])), dtype=bool)
+    for _, constraint in constraints:
+        infeasible |= constraint(local, incoming)
+    return infeasible
@@ -0,0 +1,63 @@
+from datetime import datetime
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+# Formats tried when detecting the format of a date column, in order of preference
+DATE_FORMATS: Tuple[str, ...] = ('%d-%m-%Y', '%m-%d-%Y', '%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d')
+
+# Epoch day stored for missing dates
+NAT_DAYS: int = int(np.iinfo(np.int32).min)
+
+DEFAULT_SAMPLE_SIZE: int = 100
+
+
+def determine_column_format(column: pd.Series, sample_size: int = DEFAULT_SAMPLE_SIZE) -> str:
+    """Detects the date format of a column from a sample of its values.
+
+    The format that parses the most of the first sample_size non-missing values wins, so a column is no longer
+    judged by its first row alone and day-first and month-first dates are told apart by any day above 12.
+
+    Args:
+        column (pd.Series): The raw date column.
+        sample_size (int): How many non-missing values to try each format on.
+
+    Returns:
+        str: The detected format, or "Unknown format" when no format parses any sampled value.
+    """
+    sample = column.dropna().astype(str).str.strip().head(sample_size)
+    best_format, best_count = "Unknown format", 0
+    for date_format in DATE_FORMATS:
+        count = int(pd.to_datetime(sample, format=date_format, errors='coerce').notna().sum())
+        if count > best_count:
+            best_format, best_count = date_format, count
+    return best_format
+
+
+def parse_date_column(column: pd.Series, date_format: str) -> pd.Series:
+    """Parses a date column once with a known format, unparseable values become NaT."""
+    return pd.to_datetime(column, format=date_format, errors='coerce').dt.normalize()
+
+
+def clamp_dates(column: pd.Series, current_date: datetime) -> pd.Series:
+    """Moves every date before current_date to current_date with one np.maximum, missing dates stay NaT."""
+    dates = pd.to_datetime(column, errors='coerce')
+    today = np.datetime64(pd.Timestamp(current_date).normalize().to_datetime64(), 'D')
+    clamped = np.maximum(dates.to_numpy(dtype=dates.dtype), today)
+    return pd.Series(clamped, index=column.index, name=column.name).astype(dates.dtype)
+
+
+def to_epoch_days(column: pd.Series) -> np.ndarray:
+    """Converts a date column to int32 days since 1970-01-01, with NAT_DAYS for missing dates."""
+    dates = pd.to_datetime(column, errors='coerce').to_numpy()
+    days = dates.astype('datetime64[D]').astype(np.int64)
+    return np.where(np.isnat(dates), NAT_DAYS, days).astype(np.int32)
+
+
+def day_difference(minuend: np.ndarray, subtrahend: np.ndarray) -> np.ndarray:
+    """Subtracts two broadcastable epoch day arrays, giving float days with NaN where either date is missing."""
+    missing = (minuend == NAT_DAYS) | (subtrahend == NAT_DAYS)
+    difference = np.subtract(minuend, subtrahend, dtype=np.int32).astype(np.float64)
+    difference[missing] = np.nan
+    return difference
@@ -1,17 +1,22 @@
-import configparser
+import os
 import pandas as pd
 import datetime
 import math
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import  numpy as np
 import colorlog as logging
 from munkres import Munkres, DISALLOWED
+from scoring_plan import ScoringPlan, DISTANCE_COMPONENTS
+from faculty_matrix import FacultyMatrix
+import dates
 
 
 def sigmoid(x: float) -> float:
     return 1 / (1 + math.exp(-x))
 
 def calculate_age_distance(
-  config: configparser.ConfigParser,
+  plan: ScoringPlan,
   local_students: pd.Series,
   incoming_student: pd.Series) -> float:
 
@@ -19,22 +24,21 @@ def calculate_age_distance(
     incoming_age = incoming_student['Age']
 
     age_difference = abs(int(local_age) - int(incoming_age))
-    optimal_age_difference = int(config.get('parameters', 'desired_age_difference'))
+    optimal_age_difference = plan.desired_age_difference
 
     return sigmoid(age_difference/optimal_age_difference)
 
 
 def calculate_gender_distance(
-  config: configparser.ConfigParser,
-  gender_range: int,
+  plan: ScoringPlan,
   local_students: pd.Series,
   incoming_students: pd.Series) -> float:
     distance: float = 0
 
 
 
-    local_gender_preference_penalty = int(config.get('parameters', 'local_gender_preference_penalty'))
-    incoming_gender_preference_penalty = int(config.get('parameters', 'incoming_gender_preference_penalty'))
+    local_gender_preference_penalty = plan.local_gender_preference_penalty
+    incoming_gender_preference_penalty = plan.incoming_gender_preference_penalty
 
     if local_students['GenderPreference'] != 'Mix/No preference' and local_students['GenderPreference'] != \
             incoming_students['Gender']:
@@ -44,15 +48,13 @@ def calculate_gender_distance(
             local_students['Gender']:
         distance += incoming_gender_preference_penalty
 
-    distance = float(distance / gender_range)
-    print(f'gender distance -> : {distance}')
+    distance = float(distance / plan.gender_range)
     return distance
 
 
 
 def calculate_age_gender_distance(
-  config: configparser.ConfigParser,
-  age_range: int,
+  plan: ScoringPlan,
   local_students: pd.Series,
   incoming_students: pd.Series) -> float:
     """Calculate the distance between the ages and genders of a local student and an incoming student.
@@ -61,8 +63,7 @@ def calculate_age_gender_distance(
     age difference exceeds the desired age difference specified in the configuration, a distance of 1.0 is returned.
     Otherwise, the distance remains 0.0.
 
-    :param config: A ConfigParser object containing configuration parameters, including the desired age difference.
-    :param age_range: An integer representing the range of ages used for scaling the distance (not used in this function).
+    :param plan: The ScoringPlan holding the desired age difference.
     :param local_students: A pandas Series representing the local student's attributes, including their age and gender.
     :param incoming_students: A pandas Series representing the incoming student's attributes, including their age and gender.
     :return: A float representing the calculated distance based on age and gender.
@@ -75,7 +76,7 @@ def calculate_age_gender_distance(
     incoming_gender = incoming_students['Gender']
 
     if local_gender != incoming_gender:
-        if abs(local_age - incoming_age) > int(config.get('parameters', 'desired_age_difference')):
+        if abs(local_age - incoming_age) > plan.desired_age_difference:
             distance = 1.0
 
     return distance
@@ -97,16 +98,16 @@ def calculate_university_distance(local_students: pd.Series, incoming_students:
   return 0.0
 
 
-def calculate_faculty_distance(local_students: pd.Series, incoming_students: pd.Series, faculty_distances: pd.DataFrame) -> float:
+def calculate_faculty_distance(local_students: pd.Series, incoming_students: pd.Series, faculties: FacultyMatrix) -> float:
   """Calculate the distance between the faculties of a local student and an incoming student.
 
   This function compares the faculty of the local student with that of the incoming student. If the faculties are
-  different, the distance is determined based on pre-defined distances stored in the faculty_distances DataFrame.
-  If the faculties are the same, the distance is 0.0.
+  different, the distance is determined based on pre-defined distances stored in the faculty matrix, with its
+  fallback distance for faculties it does not know. If the faculties are the same, the distance is 0.0.
 
   :param local_students: A pandas Series representing the local student's attributes, including their faculty.
   :param incoming_students: A pandas Series representing the incoming student's attributes, including their faculty.
-  :param faculty_distances: A pandas DataFrame containing the distances between different faculties.
+  :param faculties: The FacultyMatrix holding the distances between different faculties.
   :return: A float representing the calculated distance between the faculties of the two students.
   """
 
@@ -115,48 +116,41 @@ def calculate_faculty_distance(local_students: pd.Series, incoming_students: pd.
   incoming_faculty = incoming_students['Faculty']
 
   if local_faculty != incoming_faculty:
-    distance = float(faculty_distances.loc[incoming_faculty, local_faculty])
+    distance = faculties.distance(incoming_faculty, local_faculty)
   return distance
 
 
 def calculate_personal_interests_distance(
-  config: configparser.ConfigParser,
+  plan: ScoringPlan,
   local_students: pd.Series,
-  incoming_students: pd.Series,
-  hobby_range: int,
-  hobbies: pd.DataFrame) -> float:
+  incoming_students: pd.Series) -> float:
   """Calculate the distance based on the personal interests (hobbies) of local and incoming students.
 
   This function computes a distance metric based on the differences in hobbies between local and incoming students.
   Each hobby is weighted by a factor specified in the configuration, which allows for different levels of importance
-  for each hobby. The resulting distance is normalized by the provided hobby range.
+  for each hobby. The resulting distance is normalized by the hobby range.
 
-  :param config: A ConfigParser object containing configuration parameters including hobby weights.
+  :param plan: The ScoringPlan holding the hobbies, their weights and the hobby range.
   :param local_students: A pandas Series representing the local student's attributes, including their hobbies.
   :param incoming_students: A pandas Series representing the incoming student's attributes, including their hobbies.
-  :param hobby_range: An integer representing the range of hobbies used for scaling the distance.
-  :param hobbies: A pandas DataFrame containing the list of hobbies being compared.
   :return: A float representing the calculated distance based on the personal interests of the two students.
   """
   distance = 0
-  for hobby in hobbies:
-    hobby_factor = float(config.get('hobbies', hobby))
-    distance += abs(local_students[hobby] - incoming_students[hobby]) * hobby_factor
+  for hobby, hobby_factor in zip(plan.hobbies, plan.hobby_weights):
+    distance += abs(local_students[hobby] - incoming_students[hobby]) * float(hobby_factor)
 
-  distance /= hobby_range
+  distance /= plan.hobby_range
   return float(distance)
 
 
 
-def calculate_availability_distance(local_student: pd.Series, incoming_student: pd.Series, date_range: int) -> float:
-  availability =  pd.to_datetime(local_student['Availability'])
-  arrival  = pd.to_datetime(incoming_student['Arrival'])
-
-  days_difference: float  = (availability - arrival).days
+def calculate_availability_distance(plan: ScoringPlan, local_student: pd.Series, incoming_student: pd.Series) -> float:
+  # The date columns are parsed once by formatter.convert_all_dates_to_datetime
+  days_difference: float  = (local_student['Availability'] - incoming_student['Arrival']).days
 
   # If the local student is available before the incoming student, the result will be below 0
   if days_difference >= 0:
-      days_difference = float(days_difference / date_range)
+      days_difference = float(days_difference / plan.date_range)
       return days_difference
 
   return 0.0
@@ -167,40 +161,31 @@ def calculate_availability_distance(local_student: pd.Series, incoming_student:
 
 
 def calculate_text_availability_distance(
-  config: configparser.ConfigParser,
+  plan: ScoringPlan,
   local_student: pd.Series,
   incoming_student: pd.Series) -> float:
   """Calculate the distance based on the text availability date of a local student and the arrival date of an incoming student.
 
-  This function computes the distance between the availability date of the local student (provided as a string in the format 'YYYY-MM-DD')
-  and the arrival date of the incoming student (also provided as a string in the same format). The distance is calculated based on the
+  This function computes the distance between the availability date of the local student and the arrival date of the incoming
+  student, both already parsed into timestamps by formatter.convert_all_dates_to_datetime. The distance is calculated based on the
   ideal difference in days specified in the configuration. If the arrival date is later than the availability date by at least the
   ideal difference, a distance of 0 is returned. If the arrival date is earlier than or the same as the availability date, a distance
   of 100 is returned. Otherwise, a penalty is calculated based on how far the arrival date is from the ideal difference.
 
-  :param config: A ConfigParser object containing configuration parameters, including the desired date difference.
+  :param plan: The ScoringPlan holding the desired date difference.
   :param local_student: A pandas Series representing the local student's attributes, including their availability date.
   :param incoming_student: A pandas Series representing the incoming student's attributes, including their arrival date.
   :return: A float representing the calculated distance based on the availability dates of the two students.
   """
 
-  # assuming local_student['AvailabilityText'] is a string in the format 'YYYY-MM-DD'
-  # and incoming_student['Arrival'] is a string in the format 'YYYY-MM-DD'
-  local_student_text_date = pd.to_datetime(local_student['AvailabilityText'])
-  incoming_student_arrival_date = pd.to_datetime(incoming_student['Arrival'])
-
+  ideal_difference = plan.desired_date_difference
+  days_between = (incoming_student['Arrival'] - local_student['AvailabilityText']).days
 
-  print(local_student_text_date)
-  print(incoming_student_arrival_date)
-
-  ideal_difference = float(config.get('parameters', 'desired_date_difference'))
-
-  if (incoming_student_arrival_date - local_student_text_date).days >= ideal_difference:
+  if days_between >= ideal_difference:
       return 0
-  elif (incoming_student_arrival_date - local_student_text_date).days <= 0:
+  elif days_between <= 0:
       return 100
   else:
-      days_between = (incoming_student_arrival_date - local_student_text_date).days
 
       penalty: float  = float(ideal_difference - days_between)
       penalty = float(penalty / ideal_difference)
@@ -208,18 +193,18 @@ def calculate_text_availability_distance(
 
 
 def calculate_meeting_frequency_distance(
+  plan: ScoringPlan,
   local_student: pd.Series,
-  incoming_student: pd.Series,
-  meeting_frequency_range: int) -> float:
+  incoming_student: pd.Series) -> float:
   """Calculate the distance based on the meeting frequency preferences of a local student and an incoming student.
 
   This function computes the absolute difference between the meeting frequencies of the two students and normalizes
-  the result by the provided meeting frequency range. The resulting distance indicates how closely aligned the students'
+  the result by the meeting frequency range. The resulting distance indicates how closely aligned the students'
   preferences are regarding how often they would like to meet.
 
+  :param plan: The ScoringPlan holding the meeting frequency range.
   :param local_student: A pandas Series representing the local student's attributes, including their meeting frequency.
   :param incoming_student: A pandas Series representing the incoming student's attributes, including their meeting frequency.
-  :param meeting_frequency_range: An integer representing the range of meeting frequencies used for scaling the distance.
   :return: A float representing the calculated distance based on the meeting frequency preferences of the two students.
   """
 
@@ -227,24 +212,21 @@ def calculate_meeting_frequency_distance(
   incoming_meeting_frequency: float  = float(incoming_student['MeetFrequency'])
 
   distance: float  = abs(local_meeting_frequency - incoming_meeting_frequency)
-  distance /= meeting_frequency_range
+  distance /= plan.meeting_frequency_range
   return distance
 
 
 def calculate_expectation_distance(
+  plan: ScoringPlan,
   local_student: pd.Series,
   incoming_student: pd.Series,
   ) -> float:
 
   distance: float = 0.0
 
-  local_expectations = [int(expectation in local_student['Expectations']) for expectation in
-                        ['Just answering some (practical) questions', 'Showing the new student(s) around',
-                          'Becoming friends with my buddies']]
+  local_expectations = [int(expectation in local_student['Expectations']) for expectation in plan.local_expectations]
 
-  incoming_expectations = [int(expectation in incoming_student['Expectations']) for expectation in
-                            ['Just asking (practical) questions', 'Being shown around the city',
-                            'Becoming friends with my buddy']]
+  incoming_expectations = [int(expectation in incoming_student['Expectations']) for expectation in plan.incoming_expectations]
 
   comparison: list[int] = [0 if x == y else 1 for x, y in zip(local_expectations, incoming_expectations)]
 
@@ -256,142 +238,615 @@ def calculate_expectation_distance(
 
 
 
+def calculate_student_components(
+  local_student: pd.Series,
+  incoming_student: pd.Series,
+  plan: ScoringPlan,
+  faculties: FacultyMatrix,
+  components: tuple = None
+  ) -> dict[str, float]:
+  """Calculate the individual distance components between one local and one incoming student.
+
+  Missing values are replaced by 0.5 per component.
+
+  :param components: The components to calculate. Defaults to the active components of the plan.
+  :return: A dictionary mapping each calculated component name to its distance.
+  """
+  component_functions = {
+    # age distance between a local student and an incoming student
+    'age': lambda: calculate_age_distance(plan, local_student, incoming_student),
+    # distance between the gender preferences of local and incoming students.
+    'gender': lambda: calculate_gender_distance(plan, local_student, incoming_student),
+    # If the genders are different and the absolute age difference exceeds the desired age difference specified in the configuration
+    'age_gender': lambda: calculate_age_gender_distance(plan, local_student, incoming_student),
+    # the distance between the universities of two students.
+    'university': lambda: calculate_university_distance(local_student, incoming_student),
+    # distance between the faculties of a local student and an incoming student
+    'faculty': lambda: calculate_faculty_distance(local_student, incoming_student, faculties),
+    # distance based on the personal interests (hobbies) of local and incoming students
+    'interests': lambda: calculate_personal_interests_distance(plan, local_student, incoming_student),
+    # distance based on the availability dates of local and incoming students
+    'availability': lambda: calculate_availability_distance(plan, local_student, incoming_student),
+    # distance based on the text availability dates of local and incoming students
+    'text_availability': lambda: calculate_text_availability_distance(plan, local_student, incoming_student),
+    # distance based on the meeting frequency preferences of local and incoming students
+    'meeting_frequency': lambda: calculate_meeting_frequency_distance(plan, local_student, incoming_student),
+    # distance based on the expectations of local and incoming students
+    'expectations': lambda: calculate_expectation_distance(plan, local_student, incoming_student),
+  }
+
+  distances: dict[str, float] = {}
+  for name in (plan.active_components if components is None else components):
+    distance = component_functions[name]()
+    if pd.isnull(distance):
+      distance = 0.5
+    distances[name] = distance
+  return distances
+
+
 def calculate_student_distance(
   local_student: pd.Series,
   incoming_student: pd.Series,
-  config: configparser.ConfigParser,
-  normal_dict: dict,
-  faculty_distances: pd.DataFrame,
-  hobbies: pd.DataFrame
+  plan: ScoringPlan,
+  faculties: FacultyMatrix
   ) -> float:
+  """Calculate the weighted distance between one local and one incoming student.
 
+  Components whose [normalization] factor is 0 are not calculated at all.
+  """
+  components = calculate_student_components(local_student, incoming_student, plan, faculties)
+
+  # Calculate the total distance
   distance: float = 0.0
-  # age distance between a local student and an incoming student
-  age_distance: float = calculate_age_distance(config,local_student, incoming_student)
-  if pd.isnull(age_distance):
-        age_distance = 0.5
+  for name, component_distance in components.items():
+    distance += plan.factor(name) * component_distance
 
+  return distance
 
-  # distance between the gender preferences of local and incoming students.
-  gender_distance: float = calculate_gender_distance(config, normal_dict['gender_range'] , local_student, incoming_student)
-  if pd.isnull(gender_distance):
-      gender_distance = 0.5
 
 
-  # If the genders are different and the absolute age difference exceeds the desired age difference specified in the configuration
-  gender_age_distance: float = calculate_age_gender_distance(config, normal_dict['age_range'], local_student , incoming_student)
-  if pd.isnull(gender_age_distance):
-      gender_age_distance = 0.5
+def _shared_codes(*columns: pd.Series) -> list[np.ndarray]:
+  """Factorize several columns over one shared vocabulary so their codes can be compared directly.
 
-   # the distance between the universities of two students.
-  university_distance: float = calculate_university_distance(local_student, incoming_student)
-  if pd.isnull(university_distance):
-      university_distance = 0.5
+  Missing values get the code -1, which :func:`_mismatch` never treats as equal to anything (NaN != NaN).
+  """
+  values = pd.concat([pd.Series(column.to_numpy(dtype=object)) for column in columns], ignore_index=True)
+  codes, _ = pd.factorize(values, use_na_sentinel=True)
+  codes = codes.astype(np.int32)
 
-  # distance between the faculties of a local student and an incoming student
-  faculty_distance: float = calculate_faculty_distance(local_student, incoming_student, faculty_distances)
-  if pd.isnull(faculty_distance):
-        faculty_distance = 0.5
+  split_codes: list[np.ndarray] = []
+  start = 0
+  for column in columns:
+    split_codes.append(codes[start:start + len(column)])
+    start += len(column)
+  return split_codes
 
-  # distance based on the personal interests (hobbies) of local and incoming students
-  interest_distance: float = calculate_personal_interests_distance(config,local_student, incoming_student, normal_dict['hobby_range'],hobbies)
-  if pd.isnull(interest_distance):
-        interest_distance = 0.5
 
+def _mismatch(local_codes: np.ndarray, incoming_codes: np.ndarray) -> np.ndarray:
+  """L x I boolean grid that is True where the local and incoming values differ (missing values always differ)."""
+  return ((local_codes[:, None] != incoming_codes[None, :])
+          | (local_codes[:, None] < 0)
+          | (incoming_codes[None, :] < 0))
 
-  # distance based on the availability dates of local and incoming students
-  availability_distance = calculate_availability_distance(local_student, incoming_student, normal_dict['date_range'])
-  if pd.isnull(availability_distance):
-        availability_distance = 0.5
 
+def _to_float(column: pd.Series) -> np.ndarray:
+  return pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64)
 
-  # distance based on the text availability dates of local and incoming students
-  text_availability_distance = calculate_text_availability_distance(config, local_student, incoming_student)
-  if pd.isnull(text_availability_distance):
-        text_availability_distance = 0.5
 
+def _contains_expectations(column: pd.Series, expectations: tuple[str, ...]) -> np.ndarray:
+  """n x len(expectations) boolean array marking which expectation texts each answer contains."""
+  column = column.astype(object)
+  return np.column_stack([
+    column.str.contains(expectation, regex=False).fillna(False).to_numpy(dtype=bool)
+    for expectation in expectations])
 
-  # distance based on the meeting frequency preferences of local and incoming students
-  meeting_frequency_distance = calculate_meeting_frequency_distance(local_student, incoming_student, normal_dict['meeting_frequency_range'])
-  if pd.isnull(meeting_frequency_distance):
-        meeting_frequency_distance = 0.5
 
+def encode_students(
+  local_students: pd.DataFrame,
+  incoming_students: pd.DataFrame,
+  faculties: FacultyMatrix,
+  plan: ScoringPlan) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray]]:
+  """Encode the matching columns of both sides into plain NumPy arrays for the matrix engine.
+
+  Categorical columns (gender, university, faculty) are mapped to integer codes over a vocabulary shared by
+  both sides, dates become int32 days since the epoch (dates.NAT_DAYS when missing), and hobbies become an
+  n x len(hobbies) array. Faculties are also coded into the rows and columns of the faculty matrix, with its
+  sentinel code for unknown faculties.
+  Each array is indexed by the row position of the student in its DataFrame.
+
+  :param local_students: The prepared local students DataFrame (after convert_categories_to_numerical).
+  :param incoming_students: The prepared incoming students DataFrame (after convert_categories_to_numerical).
+  :param faculties: The FacultyMatrix holding the distances between different faculties.
+  :param plan: The ScoringPlan holding the compared hobbies and the expectation vocabularies.
+  :return: A tuple of (local features, incoming features) dictionaries.
+  """
+  local_gender, local_gender_preference, incoming_gender, incoming_gender_preference = _shared_codes(
+    local_students['Gender'], local_students['GenderPreference'],
+    incoming_students['Gender'], incoming_students['GenderPreference'])
+  local_university, incoming_university = _shared_codes(local_students['University'], incoming_students['University'])
+  local_faculty, incoming_faculty = _shared_codes(local_students['Faculty'], incoming_students['Faculty'])
+
+  local_features = {
+    'age': _to_float(local_students['Age']),
+    'gender': local_gender,
+    'gender_preference': local_gender_preference,
+    'any_gender': (local_students['GenderPreference'] == 'Mix/No preference').to_numpy(dtype=bool),
+    'university': local_university,
+    'faculty': local_faculty,
+    'faculty_code': faculties.encode_local(local_students['Faculty']),
+    'hobbies': np.column_stack([_to_float(local_students[hobby]) for hobby in plan.hobbies]),
+    'availability': dates.to_epoch_days(local_students['Availability']),
+    'availability_text': dates.to_epoch_days(local_students['AvailabilityText']),
+    'meet_frequency': _to_float(local_students['MeetFrequency']),
+    'expectations': _contains_expectations(local_students['Expectations'], plan.local_expectations),
+  }
+  incoming_features = {
+    'age': _to_float(incoming_students['Age']),
+    'gender': incoming_gender,
+    'gender_preference': incoming_gender_preference,
+    'any_gender': (incoming_students['GenderPreference'] == 'No preference').to_numpy(dtype=bool),
+    'university': incoming_university,
+    'faculty': incoming_faculty,
+    'faculty_code': faculties.encode_incoming(incoming_students['Faculty']),
+    'hobbies': np.column_stack([_to_float(incoming_students[hobby]) for hobby in plan.hobbies]),
+    'arrival': dates.to_epoch_days(incoming_students['Arrival']),
+    'meet_frequency': _to_float(incoming_students['MeetFrequency']),
+    'expectations': _contains_expectations(incoming_students['Expectations'], plan.incoming_expectations),
+  }
+  return local_features, incoming_features
+
+
+def calculate_age_distance_matrix(plan: ScoringPlan, local: dict, incoming: dict) -> np.ndarray:
+  """Vectorized :func:`calculate_age_distance` over every local/incoming pair."""
+  optimal_age_difference = plan.desired_age_difference
+  age_difference = np.abs(np.trunc(local['age'])[:, None] - np.trunc(incoming['age'])[None, :])
+  return 1 / (1 + np.exp(-(age_difference / optimal_age_difference)))
+
+
+def calculate_gender_distance_matrix(plan: ScoringPlan, local: dict, incoming: dict) -> np.ndarray:
+  """Vectorized :func:`calculate_gender_distance` over every local/incoming pair."""
+  local_gender_preference_penalty = plan.local_gender_preference_penalty
+  incoming_gender_preference_penalty = plan.incoming_gender_preference_penalty
+
+  local_conflict = ~local['any_gender'][:, None] & _mismatch(local['gender_preference'], incoming['gender'])
+  incoming_conflict = ~incoming['any_gender'][None, :] & _mismatch(local['gender'], incoming['gender_preference'])
+
+  distance = local_conflict * float(local_gender_preference_penalty)
+  distance += incoming_conflict * float(incoming_gender_preference_penalty)
+  return distance / plan.gender_range
+
+
+def calculate_age_gender_distance_matrix(plan: ScoringPlan, local: dict, incoming: dict) -> np.ndarray:
+  """Vectorized :func:`calculate_age_gender_distance` over every local/incoming pair."""
+  desired_age_difference = plan.desired_age_difference
+  age_difference = np.abs(local['age'][:, None] - incoming['age'][None, :])
+  different_gender = _mismatch(local['gender'], incoming['gender'])
+  return (different_gender & (age_difference > desired_age_difference)).astype(np.float64)
+
+
+def calculate_university_distance_matrix(local: dict, incoming: dict) -> np.ndarray:
+  """Vectorized :func:`calculate_university_distance` over every local/incoming pair."""
+  return _mismatch(local['university'], incoming['university']).astype(np.float64)
+
+
+def calculate_faculty_distance_matrix(local: dict, incoming: dict, faculty_matrix: np.ndarray) -> np.ndarray:
+  """Vectorized :func:`calculate_faculty_distance` over every local/incoming pair.
+
+  :param faculty_matrix: FacultyMatrix.distances, indexed by [incoming faculty code, local faculty code].
+  """
+  # faculty_matrix is [incoming faculty, local faculty], the result is [local, incoming]
+  gathered = faculty_matrix[incoming['faculty_code']][:, local['faculty_code']].T
+  return np.where(_mismatch(local['faculty'], incoming['faculty']), gathered, 0.0)
 
-  # distance based on the expectations of local and incoming students
-  expectation_distance = calculate_expectation_distance(local_student, incoming_student)
-  if pd.isnull(expectation_distance):
-      expectation_distance = 0.5
 
-  # Get all factors
-  age_factor = float(config.get('normalization', 'age_factor'))
-  gender_factor = float(config.get('normalization', 'gender_factor'))
-  age_gender_factor = float(config.get('normalization', 'age_gender_factor'))
-  university_factor = float(config.get('normalization', 'university_factor'))
-  faculty_factor = float(config.get('normalization', 'faculty_factor'))
-  interests_factor = float(config.get('normalization', 'interests_factor'))
-  availability_text_factor = float(config.get('normalization', 'availability_text_factor'))
-  availability_physical_factor = float(config.get('normalization', 'availability_physical_factor'))
-  meeting_frequency_factor = float(config.get('normalization', 'meeting_frequency_factor'))
-  expectation_factor = float(config.get('normalization', 'expectations_factor'))
+def calculate_personal_interests_distance_matrix(plan: ScoringPlan, local: dict, incoming: dict) -> np.ndarray:
+  """Vectorized :func:`calculate_personal_interests_distance` over every local/incoming pair.
 
-  # Calculate the total distance
-  distance += (age_factor * age_distance)
-  distance += (float)(gender_factor * gender_distance)
-  distance += (age_gender_factor * gender_age_distance)
-  distance += (university_factor * university_distance)
-  distance += (faculty_factor * faculty_distance)
-  distance += (interests_factor * interest_distance)
-  distance += (availability_physical_factor * availability_distance)
-  distance += (availability_text_factor * text_availability_distance)
-  distance += (meeting_frequency_factor * meeting_frequency_distance)
-  distance += (expectation_factor * expectation_distance)
+  Hobbies are accumulated one at a time so only a single L x I array is alive besides the result.
+  """
+  distance = np.zeros((len(local['hobbies']), len(incoming['hobbies'])))
+  for hobby_index, hobby_factor in enumerate(plan.hobby_weights):
+    distance += np.abs(local['hobbies'][:, hobby_index, None] - incoming['hobbies'][None, :, hobby_index]) * hobby_factor
+
+  distance /= plan.hobby_range
+  return distance
+
+
+def calculate_availability_distance_matrix(plan: ScoringPlan, local: dict, incoming: dict) -> np.ndarray:
+  """Vectorized :func:`calculate_availability_distance` over every local/incoming pair."""
+  days_difference = dates.day_difference(local['availability'][:, None], incoming['arrival'][None, :])
+  # If the local student is available before the incoming student, the difference is below 0
+  return np.where(days_difference >= 0, days_difference / plan.date_range, 0.0)
 
 
+def calculate_text_availability_distance_matrix(plan: ScoringPlan, local: dict, incoming: dict) -> np.ndarray:
+  """Vectorized :func:`calculate_text_availability_distance` over every local/incoming pair."""
+  ideal_difference = plan.desired_date_difference
+  days_between = dates.day_difference(incoming['arrival'][None, :], local['availability_text'][:, None])
 
+  penalty = (ideal_difference - days_between) / ideal_difference
+  penalty = np.where(days_between <= 0, 100.0, penalty)
+  return np.where(days_between >= ideal_difference, 0.0, penalty)
+
+
+def calculate_meeting_frequency_distance_matrix(plan: ScoringPlan, local: dict, incoming: dict) -> np.ndarray:
+  """Vectorized :func:`calculate_meeting_frequency_distance` over every local/incoming pair."""
+  distance = np.abs(local['meet_frequency'][:, None] - incoming['meet_frequency'][None, :])
+  distance /= plan.meeting_frequency_range
   return distance
 
 
+def calculate_expectation_distance_matrix(local: dict, incoming: dict) -> np.ndarray:
+  """Vectorized :func:`calculate_expectation_distance` over every local/incoming pair."""
+  local_expectations = local['expectations']
+  incoming_expectations = incoming['expectations']
+
+  count_ones = np.zeros((len(local_expectations), len(incoming_expectations)))
+  for expectation_index in range(local_expectations.shape[1]):
+    count_ones += local_expectations[:, expectation_index, None] != incoming_expectations[None, :, expectation_index]
+  return count_ones / local_expectations.shape[1]
+
+
+def calculate_component_distances(
+  local: dict,
+  incoming: dict,
+  plan: ScoringPlan,
+  faculty_matrix: np.ndarray,
+  components: tuple = None) -> dict[str, np.ndarray]:
+  """Compute distance components for the whole L x I grid at once.
+
+  Missing values are replaced by 0.5 per component, as in :func:`calculate_student_distance`.
+
+  :param local: Encoded local students, see :func:`encode_students`.
+  :param incoming: Encoded incoming students, see :func:`encode_students`.
+  :param plan: The ScoringPlan holding the parsed configuration and normalization values.
+  :param faculty_matrix: FacultyMatrix.distances, indexed by [incoming faculty code, local faculty code].
+  :param components: The components to compute. Defaults to the active components of the plan, so components
+    whose factor is 0 are skipped entirely.
+  :return: A dictionary mapping each computed component name to an L x I float64 array.
+  """
+  component_functions = {
+    'age': lambda: calculate_age_distance_matrix(plan, local, incoming),
+    'gender': lambda: calculate_gender_distance_matrix(plan, local, incoming),
+    'age_gender': lambda: calculate_age_gender_distance_matrix(plan, local, incoming),
+    'university': lambda: calculate_university_distance_matrix(local, incoming),
+    'faculty': lambda: calculate_faculty_distance_matrix(local, incoming, faculty_matrix),
+    'interests': lambda: calculate_personal_interests_distance_matrix(plan, local, incoming),
+    'availability': lambda: calculate_availability_distance_matrix(plan, local, incoming),
+    'text_availability': lambda: calculate_text_availability_distance_matrix(plan, local, incoming),
+    'meeting_frequency': lambda: calculate_meeting_frequency_distance_matrix(plan, local, incoming),
+    'expectations': lambda: calculate_expectation_distance_matrix(local, incoming),
+  }
+
+  distances: dict[str, np.ndarray] = {}
+  with np.errstate(divide='ignore', invalid='ignore'):
+    for name in (plan.active_components if components is None else components):
+      component = component_functions[name]()
+      component[np.isnan(component)] = 0.5
+      distances[name] = component
+  return distances
+
+
+def weigh_components(components: dict[str, np.ndarray], plan: ScoringPlan, shape: tuple) -> np.ndarray:
+  """Sum the active distance components weighted by their [normalization] factors, in DISTANCE_COMPONENTS order."""
+  distances = np.zeros(shape)
+  for name in plan.active_components:
+    distances += plan.factor(name) * components[name]
+  return distances
+
+
+def calculate_distance_matrix(
+  local_students: pd.DataFrame,
+  incoming_students: pd.DataFrame,
+  plan: ScoringPlan,
+  faculties: FacultyMatrix) -> np.ndarray:
+  """Calculate the weighted distance between every local and incoming student.
+
+  This is the vectorized equivalent of calling :func:`calculate_student_distance` for every pair: the students
+  are encoded once and each active component is computed for the whole grid with NumPy broadcasting.
+
+  :return: An L x I float64 array where entry [i, j] is the distance between local student i and incoming student j.
+  """
+  local, incoming = encode_students(local_students, incoming_students, faculties, plan)
+  components = calculate_component_distances(local, incoming, plan, faculties.distances)
+  return weigh_components(components, plan, (len(local_students), len(incoming_students)))
+
+
+# Bytes per L x I cell alive while a row block is computed: every component, the weighted sum and the
+# temporaries of the component being computed, all float64
+BLOCK_BYTES_PER_CELL: int = np.dtype(np.float64).itemsize * (len(DISTANCE_COMPONENTS) + 4)
+
+# The disk-backed distance matrix of calculate_distance_matrix_within_budget
+DISTANCE_MATRIX_FILE: str = 'distance_matrix.npy'
+
+# State of a distance worker process, set once by _attach_shared_arrays
+_worker_state: dict = {}
+
+
+def _share_array(array: np.ndarray) -> tuple[shared_memory.SharedMemory, tuple]:
+  """Copy an array into a new shared memory block and return the block with a picklable (name, shape, dtype) descriptor."""
+  block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+  np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+  return block, (block.name, array.shape, array.dtype.str)
+
+
+def _attach_array(descriptor: tuple, blocks: list, writeable: bool = False) -> np.ndarray:
+  name, shape, dtype = descriptor
+  block = shared_memory.SharedMemory(name=name)
+  # keep the block open for as long as the worker uses the array
+  blocks.append(block)
+  array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+  array.flags.writeable = writeable
+  return array
+
+
+def _attach_shared_arrays(
+  descriptors: dict,
+  output: tuple,
+  plan: ScoringPlan) -> None:
+  """Process pool initializer: map the shared features, faculty matrix and output array into this worker.
+
+  The output is either ('shared', descriptor) for a shared memory distance matrix or ('memmap', filename) for a
+  component stack in a .npy file, see :func:`calculate_component_stack`.
+  """
+  blocks: list = []
+  kind, target = output
+  if kind == 'shared':
+    output_array = _attach_array(target, blocks, writeable=True)
+  else:
+    output_array = np.load(target, mmap_mode='r+')
+
+  _worker_state.update({
+    'blocks': blocks,
+    'local': {key: _attach_array(descriptor, blocks) for key, descriptor in descriptors['local'].items()},
+    'incoming': {key: _attach_array(descriptor, blocks) for key, descriptor in descriptors['incoming'].items()},
+    'faculty_matrix': _attach_array(descriptors['faculty_matrix'], blocks),
+    'output': output_array,
+    'plan': plan,
+  })
+
+
+def _calculate_distance_block(start: int, stop: int) -> None:
+  """Fill rows [start, stop) of the shared output in a worker process."""
+  local = {key: array[start:stop] for key, array in _worker_state['local'].items()}
+  components = calculate_component_distances(
+    local,
+    _worker_state['incoming'],
+    _worker_state['plan'],
+    _worker_state['faculty_matrix'],
+    DISTANCE_COMPONENTS if _worker_state['output'].ndim == 3 else None)
+
+  output = _worker_state['output']
+  if output.ndim == 3:
+    for component_index, name in enumerate(DISTANCE_COMPONENTS):
+      output[component_index, start:stop] = components[name]
+  else:
+    output[start:stop] += weigh_components(components, _worker_state['plan'], (stop - start, output.shape[1]))
+
+
+def _run_distance_workers(
+  local: dict,
+  incoming: dict,
+  plan: ScoringPlan,
+  faculty_matrix: np.ndarray,
+  output: tuple,
+  workers: int,
+  max_block_rows: int = None) -> None:
+  """Split the local students into row blocks and let a process pool fill the output described by output.
+
+  The encoded students and the faculty matrix are copied into shared memory once, so only the (start, stop)
+  bounds of each block travel through the pool. A distance matrix output is added to, so it must start as zeros.
+
+  :param max_block_rows: The most local students per block, to bound the memory of every worker.
+  """
+  number_of_locals = len(local['age'])
+
+  blocks: list[shared_memory.SharedMemory] = []
+  def share(array: np.ndarray) -> tuple:
+    block, descriptor = _share_array(np.ascontiguousarray(array))
+    blocks.append(block)
+    return descriptor
+
+  try:
+    descriptors = {
+      'local': {key: share(array) for key, array in local.items()},
+      'incoming': {key: share(array) for key, array in incoming.items()},
+      'faculty_matrix': share(faculty_matrix),
+    }
+
+    # a few blocks per worker keeps the pool busy when blocks take unequal time
+    block_size = max(1, math.ceil(number_of_locals / (workers * 4)))
+    if max_block_rows is not None:
+      block_size = min(block_size, max_block_rows)
+    starts = list(range(0, number_of_locals, block_size))
+    stops = [min(start + block_size, number_of_locals) for start in starts]
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_attach_shared_arrays,
+        initargs=(descriptors, output, plan)) as executor:
+      # consume the results so worker exceptions are raised here
+      list(executor.map(_calculate_distance_block, starts, stops))
+  finally:
+    for block in blocks:
+      block.close()
+      block.unlink()
+
+
+def calculate_distance_matrix_parallel(
+  local_students: pd.DataFrame,
+  incoming_students: pd.DataFrame,
+  plan: ScoringPlan,
+  faculties: FacultyMatrix,
+  workers: int) -> np.ndarray:
+  """Calculate the same matrix as :func:`calculate_distance_matrix` with a pool of worker processes.
+
+  The encoded students, the faculty matrix and the result matrix live in shared memory. The local students are
+  split into row blocks and each worker writes its block straight into the shared result, so neither DataFrames
+  nor results are pickled between processes.
+
+  :param workers: The number of worker processes.
+  :return: An L x I float64 array where entry [i, j] is the distance between local student i and incoming student j.
+  """
+  local, incoming = encode_students(local_students, incoming_students, faculties, plan)
+  shape = (len(local_students), len(incoming_students))
+
+  result_block, result_descriptor = _share_array(np.zeros(shape))
+  try:
+    _run_distance_workers(
+      local, incoming, plan, faculties.distances, ('shared', result_descriptor), workers)
+    return np.ndarray(shape, dtype=np.float64, buffer=result_block.buf).copy()
+  finally:
+    result_block.close()
+    result_block.unlink()
+
+
+def calculate_component_stack(
+  local: dict,
+  incoming: dict,
+  plan: ScoringPlan,
+  faculty_matrix: np.ndarray,
+  out: np.ndarray,
+  workers: int = 1) -> np.ndarray:
+  """Fill out with every distance component, stacked in DISTANCE_COMPONENTS order.
+
+  Components are computed regardless of their factor, so the stack can be re-weighted later.
+
+  :param local: Encoded local students, see :func:`encode_students`.
+  :param incoming: Encoded incoming students, see :func:`encode_students`.
+  :param out: A (len(DISTANCE_COMPONENTS), L, I) array. With more than one worker it must be a np.memmap of a
+    .npy file, which every worker opens and writes its rows into.
+  :param workers: The number of worker processes.
+  :return: out
+  """
+  if workers > 1:
+    out.flush()
+    _run_distance_workers(
+      local, incoming, plan, faculty_matrix, ('memmap', out.filename), workers)
+    return out
+
+  components = calculate_component_distances(local, incoming, plan, faculty_matrix, DISTANCE_COMPONENTS)
+  for component_index, name in enumerate(DISTANCE_COMPONENTS):
+    out[component_index] = components[name]
+  return out
+
+
+def rows_per_block(incoming_count: int, max_memory: int, workers: int = 1) -> int:
+  """The number of local students whose intermediate arrays fit in max_memory bytes, split between the workers.
+
+  A block holds every active component, the weighted sum and the temporaries of one component as float64 rows
+  against all incoming students, see BLOCK_BYTES_PER_CELL.
+  """
+  return max(1, int(max_memory // (max(workers, 1) * max(incoming_count, 1) * BLOCK_BYTES_PER_CELL)))
+
+
+def add_distances_blockwise(
+  local: dict,
+  incoming: dict,
+  plan: ScoringPlan,
+  faculty_matrix: np.ndarray,
+  out: np.ndarray,
+  max_memory: int = None) -> np.ndarray:
+  """Add the weighted distances of plan to out, computing the local students in row blocks.
+
+  Only one block of float64 components is alive at a time, so out can be float32 or a np.memmap much larger than
+  the intermediate arrays.
+
+  :param local: Encoded local students, see :func:`encode_students`.
+  :param incoming: Encoded incoming students, see :func:`encode_students`.
+  :param out: An L x I array the distances are added to.
+  :param max_memory: The most bytes the intermediate arrays of a block may take. Defaults to a single block.
+  :return: out
+  """
+  number_of_locals, number_of_incomings = out.shape
+  block_size = number_of_locals if max_memory is None else rows_per_block(number_of_incomings, max_memory)
+  for start in range(0, number_of_locals, max(block_size, 1)):
+    stop = min(start + block_size, number_of_locals)
+    block_local = {key: array[start:stop] for key, array in local.items()}
+    components = calculate_component_distances(block_local, incoming, plan, faculty_matrix)
+    out[start:stop] += weigh_components(components, plan, (stop - start, number_of_incomings))
+  return out
+
+
+def calculate_distance_matrix_within_budget(
+  local_students: pd.DataFrame,
+  incoming_students: pd.DataFrame,
+  plan: ScoringPlan,
+  faculties: FacultyMatrix,
+  max_memory: int,
+  directory: str,
+  workers: int = 1) -> np.ndarray:
+  """Calculate the distance matrix as float32, keeping the intermediate arrays within max_memory bytes.
+
+  The matrix is kept in memory when it takes at most half of max_memory, and is otherwise a np.memmap of
+  DISTANCE_MATRIX_FILE in directory, so its pages are written to disk as the blocks are filled. The rest of the
+  budget bounds the row blocks of :func:`add_distances_blockwise`, or of every worker when workers > 1.
+
+  :param max_memory: The memory budget of the distance stage in bytes.
+  :param directory: The folder of the disk-backed matrix.
+  :param workers: The number of worker processes.
+  :return: An L x I float32 array where entry [i, j] is the distance between local student i and incoming student j.
+  """
+  local, incoming = encode_students(local_students, incoming_students, faculties, plan)
+  shape = (len(local_students), len(incoming_students))
+  matrix_bytes = shape[0] * shape[1] * np.dtype(np.float32).itemsize
+  in_memory = matrix_bytes <= max_memory // 2
+  block_budget = max_memory - matrix_bytes if in_memory else max_memory
+  logging.info("Calculating the distance matrix in blocks of %i local students, %s",
+               rows_per_block(shape[1], block_budget, workers), 'in memory' if in_memory else f'on disk in {directory}')
+
+  if in_memory and workers <= 1:
+    return add_distances_blockwise(local, incoming, plan, faculties.distances, np.zeros(shape, dtype=np.float32), block_budget)
+
+  if in_memory:
+    result_block, result_descriptor = _share_array(np.zeros(shape, dtype=np.float32))
+    try:
+      _run_distance_workers(
+        local, incoming, plan, faculties.distances, ('shared', result_descriptor), workers,
+        rows_per_block(shape[1], block_budget, workers))
+      return np.ndarray(shape, dtype=np.float32, buffer=result_block.buf).copy()
+    finally:
+      result_block.close()
+      result_block.unlink()
+
+  os.makedirs(directory, exist_ok=True)
+  path = os.path.join(directory, DISTANCE_MATRIX_FILE)
+  out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape)
+  if workers <= 1:
+    add_distances_blockwise(local, incoming, plan, faculties.distances, out, block_budget)
+  else:
+    out.flush()
+    _run_distance_workers(
+      local, incoming, plan, faculties.distances, ('memmap', path), workers,
+      rows_per_block(shape[1], block_budget, workers))
+  out.flush()
+  return out
+
+
+def default_worker_count() -> int:
+  """The number of CPU cores this process may run on (respects container CPU sets)."""
+  try:
+    return len(os.sched_getaffinity(0))
+  except AttributeError:
+    return os.cpu_count() or 1
+
 
 def caculate_student_distances(
   local_students: pd.DataFrame,
   incoming_students: pd.DataFrame,
-  config: configparser.ConfigParser,
-  normal_dict: dict,
-  faculty_distances: pd.DataFrame ,
-  hobbies: pd.DataFrame) -> pd.DataFrame:
-  distance: float = 0.0
-  # Create a DataFrame to store the distances between all local and incoming students
-  distances = pd.DataFrame(index=range(len(local_students)), columns=range(len(incoming_students)))
-
-
-  # for each local student, calculate the distance between them and each incoming student
-  for local_student_index in range(len(local_students)):
-
-
-    local_student_name = local_students.iloc[local_student_index]['FirstName']
-    logging.info(f'Calculating distances for {local_student_name} between incoming students')
-
-
-    if local_student_index == 1:
-        for incoming_student_index in range(len(incoming_students)):
-                distance = calculate_student_distance(
-                local_students.iloc[local_student_index],
-                incoming_students.iloc[incoming_student_index],
-                config,
-                normal_dict,
-                faculty_distances,
-                hobbies)
-                distances.loc[local_student_index, incoming_student_index] = distance
-                print(distance)
-
-    # for each incoming student, calculate the distance between them and the local student
-    for incoming_student_index in range(len(incoming_students)):
-        distance = calculate_student_distance(
-        local_students.iloc[local_student_index],
-        incoming_students.iloc[incoming_student_index],
-        config,
-        normal_dict,
-        faculty_distances,
-        hobbies)
-        distances.loc[local_student_index, incoming_student_index] = distance
-  return distances
+  plan: ScoringPlan,
+  faculties: FacultyMatrix,
+  workers: int = 1) -> pd.DataFrame:
+  """Calculate the distances between all local and incoming students.
+
+  The matrix is computed by :func:`calculate_distance_matrix`, or by :func:`calculate_distance_matrix_parallel`
+  when more than one worker is requested, and wrapped without copying in a float64 DataFrame indexed by row
+  position (local students) and column position (incoming students).
+  """
+  logging.info(f'Calculating distances between {len(local_students)} local and {len(incoming_students)} incoming students')
+  if workers > 1:
+    distances = calculate_distance_matrix_parallel(
+      local_students, incoming_students, plan, faculties, workers)
+  else:
+    distances = calculate_distance_matrix(local_students, incoming_students, plan, faculties)
+  return pd.DataFrame(distances, index=range(len(local_students)), columns=range(len(incoming_students)), copy=False)
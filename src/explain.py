@@ -0,0 +1,99 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import colorlog as logging
+
+import distance_calculator
+import incremental
+from faculty_matrix import FacultyMatrix
+from scoring_plan import ScoringPlan
+
+# Pairs explained per vectorized block, each block computes a block x block grid and keeps its diagonal
+EXPLAIN_BLOCK_SIZE: int = 256
+
+
+def explain_pairs(
+    local_students: pd.DataFrame,
+    incoming_students: pd.DataFrame,
+    plan: ScoringPlan,
+    faculties: FacultyMatrix,
+    local_positions: np.ndarray,
+    incoming_positions: np.ndarray) -> pd.DataFrame:
+    """Breaks the distance of the given pairs down into its components.
+
+    The components come from the same vectorized functions as the distance matrix, evaluated in blocks of
+    EXPLAIN_BLOCK_SIZE pairs, so the work grows with the number of pairs explained and not with L x I.
+
+    Args:
+        local_students (pd.DataFrame): The prepared local students.
+        incoming_students (pd.DataFrame): The prepared incoming students.
+        plan (ScoringPlan): The scoring plan the distances were computed with.
+        faculties (FacultyMatrix): The coded faculty distances.
+        local_positions (np.ndarray): Row position of the local student of every pair.
+        incoming_positions (np.ndarray): Row position of the incoming student of every pair.
+
+    Returns:
+        pd.DataFrame: One row per pair with both students' names and emails, the raw value of every active
+        component, its weighted value (suffixed '_weighted') and the total distance.
+    """
+    local_positions = np.asarray(local_positions, dtype=np.int64)
+    incoming_positions = np.asarray(incoming_positions, dtype=np.int64)
+    local, incoming = distance_calculator.encode_students(local_students, incoming_students, faculties, plan)
+
+    raw = {name: np.empty(len(local_positions)) for name in plan.active_components}
+    for start in range(0, len(local_positions), EXPLAIN_BLOCK_SIZE):
+        block = slice(start, start + EXPLAIN_BLOCK_SIZE)
+        block_local = {key: value[local_positions[block]] for key, value in local.items()}
+        block_incoming = {key: value[incoming_positions[block]] for key, value in incoming.items()}
+        components = distance_calculator.calculate_component_distances(block_local, block_incoming, plan, faculties.distances)
+        for name, component in components.items():
+            raw[name][block] = np.diagonal(component)
+
+    local_rows = local_students.iloc[local_positions].reset_index(drop=True)
+    incoming_rows = incoming_students.iloc[incoming_positions].reset_index(drop=True)
+    explanation = pd.DataFrame({
+        'local_student_fullname': local_rows['FirstName'] + ' ' + local_rows['LastName'],
+        'local_student_email': local_rows['Email'],
+        'incoming_student_fullname': incoming_rows['FirstName'] + ' ' + incoming_rows['LastName'],
+        'incoming_student_email': incoming_rows['Email'],
+    })
+    total = np.zeros(len(local_positions))
+    for name, values in raw.items():
+        weighted = plan.factor(name) * values
+        explanation[name] = values
+        explanation[f'{name}_weighted'] = weighted
+        total += weighted
+    explanation['distance'] = total
+    return explanation
+
+
+def find_pairs(
+    local_students: pd.DataFrame,
+    incoming_students: pd.DataFrame,
+    emails: Sequence[Tuple[str, str]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Looks up (local email, incoming email) pairs, warning about and skipping students that are not found.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The row positions of the local and of the incoming students of the found pairs.
+    """
+    local_keys = pd.Index(incremental.student_keys(local_students))
+    incoming_keys = pd.Index(incremental.student_keys(incoming_students))
+
+    local_positions: List[int] = []
+    incoming_positions: List[int] = []
+    for local_email, incoming_email in emails:
+        local_matches = np.flatnonzero(local_keys == local_email.strip().lower())
+        incoming_matches = np.flatnonzero(incoming_keys == incoming_email.strip().lower())
+        if len(local_matches) == 0 or len(incoming_matches) == 0:
+            logging.warning("Cannot explain %s and %s, one of them is not taking part in the matching", local_email, incoming_email)
+            continue
+        local_positions.append(int(local_matches[0]))
+        incoming_positions.append(int(incoming_matches[0]))
+    return np.array(local_positions, dtype=np.int64), np.array(incoming_positions, dtype=np.int64)
+
+
+def write_trace(explanation: pd.DataFrame, path: str) -> None:
+    """Writes an explanation from explain_pairs to a CSV trace file."""
+    explanation.to_csv(path, index=False)
+    logging.info("Explanation of %i pairs written to %s", len(explanation), path)
@@ -0,0 +1,86 @@
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+import colorlog as logging
+
+
+@dataclass(frozen=True)
+class FacultyMatrix:
+    """The faculty distances as a contiguous float array with integer-coded faculties.
+
+    The array is indexed by [incoming faculty code, local faculty code]. One extra row and column hold the
+    fallback distance, so faculties missing from faculty_distances.xlsx map to the sentinel code instead of failing.
+
+    Attributes:
+        incoming_codes (Dict[str, int]): Code of every faculty in the rows of faculty_distances.xlsx.
+        local_codes (Dict[str, int]): Code of every faculty in the columns of faculty_distances.xlsx.
+        distances (np.ndarray): The (rows + 1) x (columns + 1) float64 distance array, sentinel last.
+        fallback_distance (float): The distance to and from an unknown faculty.
+    """
+    incoming_codes: Dict[str, int]
+    local_codes: Dict[str, int]
+    distances: np.ndarray
+    fallback_distance: float
+
+    @property
+    def unknown_incoming_code(self) -> int:
+        """The sentinel row used for incoming faculties missing from the matrix."""
+        return len(self.incoming_codes)
+
+    @property
+    def unknown_local_code(self) -> int:
+        """The sentinel column used for local faculties missing from the matrix."""
+        return len(self.local_codes)
+
+    def encode_incoming(self, faculties: pd.Series) -> np.ndarray:
+        """Maps the faculties of incoming students to row codes, unknown ones to the sentinel."""
+        return _encode(faculties, self.incoming_codes, self.unknown_incoming_code)
+
+    def encode_local(self, faculties: pd.Series) -> np.ndarray:
+        """Maps the faculties of local students to column codes, unknown ones to the sentinel."""
+        return _encode(faculties, self.local_codes, self.unknown_local_code)
+
+    def distance(self, incoming_faculty: str, local_faculty: str) -> float:
+        """Returns the distance between two faculty names, falling back for unknown ones."""
+        row = self.incoming_codes.get(incoming_faculty, self.unknown_incoming_code)
+        column = self.local_codes.get(local_faculty, self.unknown_local_code)
+        return float(self.distances[row, column])
+
+
+def _encode(faculties: pd.Series, codes: Dict[str, int], unknown_code: int) -> np.ndarray:
+    encoded = pd.Series(faculties).map(codes)
+    unknown = encoded.isna().to_numpy()
+    if unknown.any():
+        names = sorted(map(str, set(pd.Series(faculties)[unknown])))
+        logging.warning("Faculties not found in the faculty distances, using the fallback distance: %s", names)
+    return encoded.fillna(unknown_code).to_numpy(dtype=np.intp)
+
+
+def build_faculty_matrix(
+    faculty_distances: pd.DataFrame,
+    fallback_distance: Optional[float] = None) -> FacultyMatrix:
+    """Builds a FacultyMatrix from the DataFrame read from faculty_distances.xlsx.
+
+    Args:
+        faculty_distances (pd.DataFrame): Distances indexed by [incoming faculty, local faculty].
+        fallback_distance (Optional[float]): Distance used for unknown faculties. Defaults to the largest distance
+            in the matrix, so an unknown faculty never looks closer than the most distant known one.
+
+    Returns:
+        FacultyMatrix: The coded faculty distances.
+    """
+    known = faculty_distances.to_numpy(dtype=np.float64)
+    if fallback_distance is None:
+        fallback_distance = float(np.nanmax(known)) if known.size else 0.0
+
+    distances = np.full((known.shape[0] + 1, known.shape[1] + 1), fallback_distance, dtype=np.float64)
+    distances[:-1, :-1] = known
+    distances.flags.writeable = False
+
+    return FacultyMatrix(
+        incoming_codes={name: code for code, name in enumerate(faculty_distances.index)},
+        local_codes={name: code for code, name in enumerate(faculty_distances.columns)},
+        distances=distances,
+        fallback_distance=float(fallback_distance))
@@ -1,9 +1,10 @@
 from datetime import datetime
 import pandas as pd
 
+import dates
+
 def determine_datetime_format(date_str: str) -> str:
-    formats = ['%d-%m-%Y', '%m-%d-%Y', '%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d']
-    for fmt in formats:
+    for fmt in dates.DATE_FORMATS:
         try:
             datetime.strptime(date_str, fmt)
             return fmt
@@ -1,51 +1,22 @@
-import format_check
+import dates
 import pandas as pd
 import colorlog as logging
-from typing import Tuple, Optional, Union, List, Dict
+from typing import Tuple, Optional, List, Dict
 from datetime import datetime, timedelta
-import numpy as np
 import configparser
 
 def convert_all_dates_to_datetime(local_students: pd.DataFrame, incoming_students: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
-  # Convert date columns to datetime objects and extract the date
+  # Convert date columns to datetime64 columns, detecting each format from a sample of the column
 
-  date_format: str = format_check.determine_datetime_format(local_students['Availability'].iloc[0])
-  if date_format == "Unknown format":
-    logging.error("Date format not recognized for Availability Date Column. Please check the date format in the input file.")
-    raise ValueError("Date format not recognized. Please check the date format in the input file.")
+  date_columns = [(local_students, 'Availability'), (local_students, 'AvailabilityText'), (incoming_students, 'Arrival')]
+  for students, column in date_columns:
+    date_format: str = dates.determine_column_format(students[column])
+    if date_format == "Unknown format":
+      logging.error(f"Date format not recognized for {column} Date Column. Please check the date format in the input file.")
+      raise ValueError("Date format not recognized. Please check the date format in the input file.")
 
-  logging.info(f"Date format found for Availability Column: {date_format}")
-
-  local_students['Availability'] = pd.to_datetime(
-      local_students['Availability'], errors='coerce', format=date_format).dt.date
-
-
-
-
-  date_format = format_check.determine_datetime_format(local_students['AvailabilityText'].iloc[0])
-  if date_format == "Unknown format":
-    logging.error("Date format not recognized for AvailabilityText Date Column. Please check the date format in the input file.")
-    raise ValueError("Date format not recognized. Please check the date format in the input file.")
-
-  logging.info(f"Date format found for AvailabilityText Column: {date_format}")
-
-  local_students['AvailabilityText'] = pd.to_datetime(
-      local_students['AvailabilityText'],
-      errors='coerce', format=date_format).dt.date
-
-
-
-
-
-  date_format = format_check.determine_datetime_format(incoming_students['Arrival'].iloc[0])
-  if date_format == "Unknown format":
-    logging.error("Date format not recognized for Arrival Date Colum. Please check the date format in the input file.")
-    raise ValueError("Date format not recognized. Please check the date format in the input file.")
-
-  logging.info(f"Date format found for Arrival Column: {date_format}")
-
-  incoming_students['Arrival'] = pd.to_datetime(
-      incoming_students['Arrival'], errors='coerce', format=date_format).dt.date
+    logging.info(f"Date format found for {column} Column: {date_format}")
+    students[column] = dates.parse_date_column(students[column], date_format)
 
   return local_students, incoming_students
 
@@ -113,17 +84,13 @@ def drop_irrelevant_columns(local_students: pd.DataFrame,
       print('Incoming students irrelevant columns file not found. Please run the configuration script first.')
       raise e
 
-  # Make copies of the original DataFrames
-  local_students_copy = local_students.copy(deep=True)
-  incoming_students_copy = incoming_students.copy(deep=True)
-
   # Convert the DataFrame of columns to drop into a list
   local_students_columns_to_drop = local_students_irrelevant_columns.iloc[:, 0].tolist()
   incoming_students_columns_to_drop = incoming_students_irrelevant_columns.iloc[:, 0].tolist()
 
-  # Drop the specified columns
-  local_students_copy = local_students_copy.drop(columns=local_students_columns_to_drop)
-  incoming_students_copy = incoming_students_copy.drop(columns=incoming_students_columns_to_drop)
+  # Drop the specified columns, the ingestion may not have read them in the first place
+  local_students_copy = local_students_copy.drop(columns=local_students_columns_to_drop, errors='ignore')
+  incoming_students_copy = incoming_students_copy.drop(columns=incoming_students_columns_to_drop, errors='ignore')
 
   return local_students_copy, incoming_students_copy
 
@@ -216,20 +183,21 @@ def convert_categories_to_numerical(local_students_df: pd.DataFrame,
 
 
 
-def adjust_dates(date: Union[str, datetime], current_date: datetime) -> datetime:
-    parsed_date = pd.to_datetime(date).to_pydatetime()
-    return parsed_date if parsed_date > current_date else current_date
-
-
-
-
+def adjust_dataframe_dates(dataframe: pd.DataFrame, columns: List[str], current_date: datetime) -> pd.DataFrame:
+  """Moves the dates in columns that lie before current_date to current_date.
 
+  Args:
+      dataframe (pd.DataFrame): DataFrame with datetime64 date columns.
+      columns (List[str]): The date columns to adjust.
+      current_date (datetime): The earliest date kept.
 
-def adjust_dataframe_dates(dataframe: pd.DataFrame, columns: List[str], current_date: datetime) -> None:
-    dataframe = dataframe.copy()
-    adjust_dates_vectorized = np.vectorize(adjust_dates)
-    for column in columns:
-        dataframe[column] = adjust_dates_vectorized(pd.to_datetime(dataframe[column]), current_date)
+  Returns:
+      pd.DataFrame: A copy of dataframe with the adjusted columns.
+  """
+  dataframe = dataframe.copy()
+  for column in columns:
+    dataframe[column] = dates.clamp_dates(dataframe[column], current_date)
+  return dataframe
 
 
 
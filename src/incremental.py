@@ -0,0 +1,256 @@
+import dataclasses
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import colorlog as logging
+
+import distance_calculator
+import student_matcher
+from faculty_matrix import FacultyMatrix
+from scoring_plan import ScoringPlan, DISTANCE_COMPONENTS, COMPONENT_RANGE_FIELDS
+
+STATE_FILE: str = 'incremental_state.npz'
+
+# Column identifying a student across runs
+KEY_COLUMN: str = 'Email'
+
+
+@dataclass(frozen=True)
+class RunState:
+    """What a later run needs to update the distances and the matching of this one.
+
+    Attributes:
+        plan_key (str): Hash of the scoring plan and faculty distances the distances were computed with.
+        local_keys (np.ndarray): The key of every local student, in row order of distances.
+        local_fingerprints (np.ndarray): A hash of every local student's prepared row.
+        incoming_keys (np.ndarray): The key of every incoming student, in column order of distances.
+        incoming_fingerprints (np.ndarray): A hash of every incoming student's prepared row.
+        distances (np.ndarray): The L x I distances of the plan, as float32 to halve the size of the saved state.
+        pair_local_keys (np.ndarray): The local student of every matched pair.
+        pair_incoming_keys (np.ndarray): The incoming student of every matched pair.
+    """
+    plan_key: str
+    local_keys: np.ndarray
+    local_fingerprints: np.ndarray
+    incoming_keys: np.ndarray
+    incoming_fingerprints: np.ndarray
+    distances: np.ndarray
+    pair_local_keys: np.ndarray
+    pair_incoming_keys: np.ndarray
+
+
+def state_path(directory: str) -> str:
+    """Returns the file holding the state of the last run in directory."""
+    return os.path.join(directory, STATE_FILE)
+
+
+def student_keys(students: pd.DataFrame) -> np.ndarray:
+    """The normalized email address of every student."""
+    return students[KEY_COLUMN].astype(str).str.strip().str.lower().to_numpy(dtype=str)
+
+
+def student_fingerprints(students: pd.DataFrame) -> np.ndarray:
+    """A uint64 hash of every prepared row, so a student who changed their answers is scored again."""
+    return pd.util.hash_pandas_object(students.astype(str), index=False).to_numpy(dtype=np.uint64)
+
+
+def compute_plan_key(plan: ScoringPlan, faculties: FacultyMatrix) -> str:
+    """Hashes everything besides the students that the distances depend on.
+
+    The range of a component whose factor is 0 is left out: the shared plan computes the range dependent
+    components per scenario, so a late sign-up that widens the date range keeps the saved distances usable.
+
+    Args:
+        plan (ScoringPlan): The scoring plan of the run.
+        faculties (FacultyMatrix): The coded faculty distances.
+
+    Returns:
+        str: A hex digest, distances computed with a different key are not reused.
+    """
+    unused_ranges = {field for component, field in COMPONENT_RANGE_FIELDS.items() if plan.factor(component) == 0}
+    digest = hashlib.sha256()
+    for field in dataclasses.fields(plan):
+        if field.name in unused_ranges:
+            continue
+        value = getattr(plan, field.name)
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        digest.update(f'{field.name}:{value!r}'.encode())
+    digest.update(repr(DISTANCE_COMPONENTS).encode())
+    digest.update(repr((faculties.incoming_codes, faculties.local_codes)).encode())
+    digest.update(np.ascontiguousarray(faculties.distances).tobytes())
+    return digest.hexdigest()
+
+
+def build_state(
+    plan_key: str,
+    local_students: pd.DataFrame,
+    incoming_students: pd.DataFrame,
+    distances: np.ndarray,
+    assignment: np.ndarray) -> RunState:
+    """Collects the state of a run.
+
+    Args:
+        plan_key (str): See compute_plan_key.
+        local_students (pd.DataFrame): The prepared local students.
+        incoming_students (pd.DataFrame): The prepared incoming students.
+        distances (np.ndarray): The L x I distances of the run.
+        assignment (np.ndarray): The matching over all students, see student_matcher.ASSIGNMENT_DTYPE.
+
+    Returns:
+        RunState: The state to save with save_state.
+    """
+    local_keys = student_keys(local_students)
+    incoming_keys = student_keys(incoming_students)
+    return RunState(
+        plan_key,
+        local_keys,
+        student_fingerprints(local_students),
+        incoming_keys,
+        student_fingerprints(incoming_students),
+        np.asarray(distances, dtype=np.float32),
+        local_keys[assignment['local']],
+        incoming_keys[assignment['incoming']])
+
+
+def save_state(path: str, state: RunState) -> None:
+    """Writes the state to path, replacing the previous state only once it is complete."""
+    if not (pd.Index(state.local_keys).is_unique and pd.Index(state.incoming_keys).is_unique):
+        logging.warning("Not saving the incremental state, the students' email addresses are not unique")
+        return
+
+    temporary_path = f'{path}.tmp.npz'
+    np.savez(temporary_path, **{field.name: np.asarray(getattr(state, field.name)) for field in dataclasses.fields(state)})
+    os.replace(temporary_path, path)
+    logging.info("Incremental state saved to %s", path)
+
+
+def load_state(path: str) -> Optional[RunState]:
+    """Reads the state saved by save_state, or returns None when there is none or it cannot be read."""
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            values = {field.name: data[field.name] for field in dataclasses.fields(RunState)}
+    except (ValueError, OSError, KeyError) as e:
+        logging.warning("Ignoring unreadable incremental state %s: %s", path, e)
+        return None
+
+    values['plan_key'] = str(values['plan_key'])
+    return RunState(**values)
+
+
+def _previous_positions(
+    previous_keys: np.ndarray,
+    previous_fingerprints: np.ndarray,
+    keys: np.ndarray,
+    fingerprints: np.ndarray) -> np.ndarray:
+    """The position of every student in the previous run, or -1 for students that are new or changed."""
+    positions = pd.Index(previous_keys).get_indexer(keys)
+    known = positions >= 0
+    positions[known & (previous_fingerprints[np.where(known, positions, 0)] != fingerprints)] = -1
+    return positions
+
+
+def update_distances(
+    state: RunState,
+    local_students: pd.DataFrame,
+    incoming_students: pd.DataFrame,
+    plan: ScoringPlan,
+    faculties: FacultyMatrix) -> np.ndarray:
+    """Builds the distance matrix from the previous run's, computing only the rows and columns that changed.
+
+    Students are matched to the previous run by email address. The distances between students whose prepared
+    rows are unchanged are copied; new or changed local students get a full row and new or changed incoming
+    students a column against the remaining local students. Students that left are dropped.
+
+    Args:
+        state (RunState): The state of the previous run, computed with the same plan.
+        local_students (pd.DataFrame): The prepared local students.
+        incoming_students (pd.DataFrame): The prepared incoming students.
+        plan (ScoringPlan): The scoring plan of the run.
+        faculties (FacultyMatrix): The coded faculty distances.
+
+    Returns:
+        np.ndarray: The L x I distances of the plan.
+    """
+    local_positions = _previous_positions(
+        state.local_keys, state.local_fingerprints, student_keys(local_students), student_fingerprints(local_students))
+    incoming_positions = _previous_positions(
+        state.incoming_keys, state.incoming_fingerprints, student_keys(incoming_students), student_fingerprints(incoming_students))
+
+    kept_local = np.flatnonzero(local_positions >= 0)
+    kept_incoming = np.flatnonzero(incoming_positions >= 0)
+    new_local = np.flatnonzero(local_positions < 0)
+    new_incoming = np.flatnonzero(incoming_positions < 0)
+    logging.info("Reusing the distances of %i local and %i incoming students, computing %i local and %i incoming students",
+                 len(kept_local), len(kept_incoming), len(new_local), len(new_incoming))
+
+    distances = np.empty((len(local_students), len(incoming_students)))
+    distances[np.ix_(kept_local, kept_incoming)] = state.distances[
+        np.ix_(local_positions[kept_local], incoming_positions[kept_incoming])]
+
+    if len(new_local) and len(incoming_students):
+        distances[new_local, :] = distance_calculator.calculate_distance_matrix(
+            local_students.iloc[new_local], incoming_students, plan, faculties)
+    if len(kept_local) and len(new_incoming):
+        distances[np.ix_(kept_local, new_incoming)] = distance_calculator.calculate_distance_matrix(
+            local_students.iloc[kept_local], incoming_students.iloc[new_incoming], plan, faculties)
+    return distances
+
+
+def pinned_pairs(state: RunState, local_students: pd.DataFrame, incoming_students: pd.DataFrame) -> np.ndarray:
+    """The pairs of the previous run whose students are both still taking part.
+
+    Args:
+        state (RunState): The state of the previous run.
+        local_students (pd.DataFrame): The prepared local students.
+        incoming_students (pd.DataFrame): The prepared incoming students.
+
+    Returns:
+        np.ndarray: The pairs as a student_matcher.ASSIGNMENT_DTYPE array of row positions, the cost is left at 0.
+    """
+    local = pd.Index(student_keys(local_students)).get_indexer(state.pair_local_keys)
+    incoming = pd.Index(student_keys(incoming_students)).get_indexer(state.pair_incoming_keys)
+    kept = (local >= 0) & (incoming >= 0)
+
+    pairs = np.zeros(int(kept.sum()), dtype=student_matcher.ASSIGNMENT_DTYPE)
+    pairs['local'] = local[kept]
+    pairs['incoming'] = incoming[kept]
+    logging.info("Pinning %i of the %i pairs of the previous run", len(pairs), len(state.pair_local_keys))
+    return pairs
+
+
+def load_usable_state(
+    directory: str,
+    plan_key: str,
+    local_students: pd.DataFrame,
+    incoming_students: pd.DataFrame) -> Optional[RunState]:
+    """Loads the state of the last run if the current run can build on it.
+
+    Args:
+        directory (str): Directory holding the state.
+        plan_key (str): See compute_plan_key, for the current run.
+        local_students (pd.DataFrame): The prepared local students.
+        incoming_students (pd.DataFrame): The prepared incoming students.
+
+    Returns:
+        Optional[RunState]: The state, or None when there is none, it was computed with another plan, or the
+        students cannot be told apart by email address.
+    """
+    state = load_state(state_path(directory))
+    if state is None:
+        logging.info("No incremental state found in %s, computing every distance", directory)
+        return None
+    if state.plan_key != plan_key:
+        logging.info("The configuration changed since the last run, computing every distance")
+        return None
+    if not (pd.Index(student_keys(local_students)).is_unique and pd.Index(student_keys(incoming_students)).is_unique):
+        logging.warning("The students' email addresses are not unique, computing every distance")
+        return None
+    return state
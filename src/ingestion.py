@@ -0,0 +1,160 @@
+import glob
+import hashlib
+import importlib.util
+import os
+from typing import Dict, Iterable, List, Optional, Set
+
+import pandas as pd
+import colorlog as logging
+
+from validation import clean_column_name
+
+# Renamed columns read as categoricals and as the smallest integer type that holds them
+CATEGORICAL_COLUMNS: tuple = ('Gender', 'University', 'Faculty')
+SMALL_INT_COLUMNS: tuple = ('Age', 'Capacity')
+
+CACHE_PREFIX: str = 'ingested_'
+
+PYARROW_AVAILABLE: bool = importlib.util.find_spec('pyarrow') is not None
+
+
+def read_matching_columns(filename: str) -> Dict[str, List[str]]:
+    """Reads the columns compared by the matching, after renaming.
+
+    Args:
+        filename (str): Path to matching_columns.csv. The first column holds the local name, the second the incoming
+            name when it differs.
+
+    Returns:
+        Dict[str, List[str]]: The matching columns of the 'local' and the 'incoming' students.
+    """
+    try:
+        matching_columns = pd.read_csv(filename, quotechar="'", skipinitialspace=True, dtype=str)
+    except FileNotFoundError as e:
+        print('Matching columns file not found. Please run the configuration script first.')
+        raise e
+
+    local_columns = matching_columns.iloc[:, 0].str.strip()
+    incoming_columns = matching_columns.iloc[:, 1].str.strip().fillna(local_columns)
+    return {'local': local_columns.tolist(), 'incoming': incoming_columns.tolist()}
+
+
+def needed_columns(
+    column_mapping: Dict[str, str],
+    matching_columns: Iterable[str],
+    hobbies: Iterable[str],
+    extra_columns: Iterable[str] = ()) -> Set[str]:
+    """Works out which input columns the program uses, by their cleaned name before renaming.
+
+    These are every renamed column, the matching columns, the hobbies and the extra_columns that filters read.
+
+    Args:
+        column_mapping (Dict[str, str]): Mapping of old column names to new column names.
+        matching_columns (Iterable[str]): Renamed columns compared by the matching.
+        hobbies (Iterable[str]): Renamed hobby columns.
+        extra_columns (Iterable[str]): Input columns needed under their original name.
+
+    Returns:
+        Set[str]: The cleaned input column names to read.
+    """
+    original_names = {new: old for old, new in column_mapping.items()}
+    columns = {clean_column_name(old) for old in column_mapping}
+    for renamed in [*matching_columns, *hobbies]:
+        columns.add(clean_column_name(original_names.get(renamed, renamed)))
+    columns.update(clean_column_name(column) for column in extra_columns)
+    return columns
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_path(cache_dir: str, path: str, key: str) -> str:
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f'{CACHE_PREFIX}{stem}_{key[:32]}.parquet')
+
+
+def _remove_stale_caches(cache_dir: str, path: str, keep: str) -> None:
+    stem = os.path.splitext(os.path.basename(path))[0]
+    for cached in glob.glob(os.path.join(cache_dir, f'{CACHE_PREFIX}{stem}_*.parquet')):
+        if os.path.abspath(cached) != os.path.abspath(keep):
+            os.remove(cached)
+
+
+def _read_csv_with_pyarrow(path: str, selected: List[str], dtypes: Dict[str, object]) -> pd.DataFrame:
+    # The pyarrow engine of pd.read_csv infers types before applying dtype, which strips the leading zeros of phone
+    # numbers, so the columns are typed as strings in pyarrow itself
+    import pyarrow as pa
+    import pyarrow.csv
+
+    table = pyarrow.csv.read_csv(path, convert_options=pyarrow.csv.ConvertOptions(
+        include_columns=selected,
+        column_types={name: pa.string() for name in selected},
+        strings_can_be_null=True))
+    return table.to_pandas().astype(dtypes)
+
+
+def read_students(
+    path: str,
+    column_mapping: Dict[str, str],
+    columns: Set[str],
+    cache_dir: Optional[str] = None) -> pd.DataFrame:
+    """Reads a students CSV with only the needed columns and explicit dtypes.
+
+    The first column (the form timestamp) is always kept. Gender, University and Faculty become categoricals, Age
+    and Capacity the smallest integer type holding them (float when values are missing), and every other column
+    is read as text. The pyarrow CSV engine is used when it is installed. With a cache_dir and pyarrow the parsed
+    frame is cached as Parquet, keyed by the hash of the file and the selected columns, so re-runs skip parsing.
+
+    Args:
+        path (str): Path to the CSV file.
+        column_mapping (Dict[str, str]): Mapping of old column names to new column names, used to find the dtypes.
+        columns (Set[str]): The cleaned input column names to read, see needed_columns.
+        cache_dir (Optional[str]): Directory for the Parquet cache, None disables it.
+
+    Returns:
+        pd.DataFrame: The students with cleaned column names, in file order.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    selected = [name for position, name in enumerate(header) if position == 0 or clean_column_name(name) in columns]
+
+    dtypes = {}
+    for name in selected:
+        renamed = column_mapping.get(clean_column_name(name), clean_column_name(name))
+        dtypes[name] = 'category' if renamed in CATEGORICAL_COLUMNS else str
+
+    cache_file = None
+    if cache_dir is not None and PYARROW_AVAILABLE:
+        digest = hashlib.sha256(_file_digest(path).encode())
+        digest.update(repr([(name, str(dtypes[name])) for name in selected]).encode())
+        cache_file = _cache_path(cache_dir, path, digest.hexdigest())
+        if os.path.exists(cache_file):
+            try:
+                students = pd.read_parquet(cache_file)
+                logging.info("Reusing parsed %s from %s", path, cache_file)
+                return students
+            except (OSError, ValueError) as e:
+                logging.warning("Ignoring unreadable ingestion cache %s: %s", cache_file, e)
+
+    if PYARROW_AVAILABLE:
+        students = _read_csv_with_pyarrow(path, selected, dtypes)
+    else:
+        students = pd.read_csv(path, usecols=selected, dtype=dtypes)[selected]
+    students.columns = [clean_column_name(name) for name in students.columns]
+
+    for name in students.columns:
+        if column_mapping.get(name, name) in SMALL_INT_COLUMNS:
+            students[name] = pd.to_numeric(students[name], errors='coerce', downcast='integer')
+
+    if cache_file is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary_file = cache_file + '.tmp'
+        students.to_parquet(temporary_file, index=False)
+        os.replace(temporary_file, cache_file)
+        _remove_stale_caches(cache_dir, path, keep=cache_file)
+
+    return students
@@ -0,0 +1,123 @@
+import json
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, asdict
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+
+import colorlog as logging
+
+
+@dataclass
+class Span:
+    """The cost of one pipeline stage.
+
+    Attributes:
+        name (str): The name of the stage.
+        wall_seconds (float): Elapsed wall clock time.
+        cpu_seconds (float): CPU time of this process, worker processes are not included.
+        peak_rss_mib (float): The peak resident memory of the process at the end of the stage.
+        allocated_mib (float): Memory allocated during the stage and still held at its end, by tracemalloc.
+        peak_allocated_mib (float): The most memory allocated at once during the stage, by tracemalloc.
+        attributes (Dict[str, Any]): Sizes and counts describing the input of the stage.
+    """
+    name: str
+    wall_seconds: float
+    cpu_seconds: float
+    peak_rss_mib: float
+    allocated_mib: float
+    peak_allocated_mib: float
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+def _peak_rss_mib() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Recorder:
+    """Records a Span for every stage wrapped in span().
+
+    When disabled, span() returns a shared no-op context manager, so instrumented code costs one method call per
+    stage. Spans are not meant to be nested, as the tracemalloc peak is reset at the start of every span.
+
+    Attributes:
+        enabled (bool): Whether spans are recorded.
+        spans (List[Span]): The recorded spans, in the order they finished.
+        attributes (Dict[str, Any]): Sizes and counts describing the whole run.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.spans: List[Span] = []
+        self.attributes: Dict[str, Any] = {}
+        self._started = time.perf_counter()
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def span(self, name: str, **attributes: Any) -> ContextManager[Optional[Span]]:
+        """Measures the stage run inside the returned context manager.
+
+        Args:
+            name (str): The name of the stage.
+            **attributes: Sizes and counts describing the input of the stage.
+
+        Returns:
+            ContextManager[Optional[Span]]: Yields the Span, which is filled in when the stage ends, or None when
+            the recorder is disabled.
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._measure(name, attributes)
+
+    @contextmanager
+    def _measure(self, name: str, attributes: Dict[str, Any]) -> Iterator[Span]:
+        span = Span(name, 0.0, 0.0, 0.0, 0.0, 0.0, dict(attributes))
+        tracemalloc.reset_peak()
+        allocated_before = tracemalloc.get_traced_memory()[0]
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield span
+        finally:
+            span.wall_seconds = time.perf_counter() - wall_start
+            span.cpu_seconds = time.process_time() - cpu_start
+            allocated_after, peak_allocated = tracemalloc.get_traced_memory()
+            span.allocated_mib = (allocated_after - allocated_before) / 2 ** 20
+            span.peak_allocated_mib = (peak_allocated - allocated_before) / 2 ** 20
+            span.peak_rss_mib = _peak_rss_mib()
+            self.spans.append(span)
+            logging.debug("Stage %s took %.3f s", name, span.wall_seconds)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Records a size or count describing the whole run, such as the number of students."""
+        if self.enabled:
+            self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The run attributes, the total wall time and every span, ready for JSON."""
+        return {
+            'attributes': self.attributes,
+            'total_wall_seconds': time.perf_counter() - self._started,
+            'peak_rss_mib': _peak_rss_mib(),
+            'spans': [asdict(span) for span in self.spans],
+        }
+
+    def write_json(self, path: str) -> None:
+        """Writes to_dict() as JSON to path."""
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2, default=str)
+        logging.info("Metrics written to %s", path)
+
+    def summary_table(self) -> str:
+        """A plain text table with one line per span and a total line."""
+        name_width = max([len('stage')] + [len(span.name) for span in self.spans])
+        lines = [f"{'stage':<{name_width}}  {'wall s':>9}  {'cpu s':>9}  {'peak alloc MiB':>14}  {'peak RSS MiB':>12}"]
+        for span in self.spans:
+            lines.append(f"{span.name:<{name_width}}  {span.wall_seconds:9.3f}  {span.cpu_seconds:9.3f}  "
+                         f"{span.peak_allocated_mib:14.1f}  {span.peak_rss_mib:12.1f}")
+        lines.append(f"{'total':<{name_width}}  {sum(span.wall_seconds for span in self.spans):9.3f}  "
+                     f"{sum(span.cpu_seconds for span in self.spans):9.3f}")
+        if self.attributes:
+            lines.append(', '.join(f'{key}={value}' for key, value in self.attributes.items()))
+        return '\n'.join(lines)
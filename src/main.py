@@ -1,274 +1,264 @@
 #!/usr/bin/env python3
 
 
-# Importing external libraries
-import configparser
-from datetime import datetime
-from typing import Dict
-import pandas as pd
+# Importing external libraries, the heavy ones are imported by the subcommands that need them
+import argparse
 import os
-from pandas.core.arrays.datetimelike import Union
-import pyfiglet
-import numpy as np
+import sys
+from typing import Callable, Dict, List, Optional
 import colorlog as logging
-# Importing internal libraries
-import distance_calculator
-import formatter
-import student_filter
-import normalization_calculator
-import outlier_calculator
-import formatter
-import student_matcher
-import report
 
+SUBCOMMANDS: tuple = ('validate', 'match', 'serve', 'sweep', 'report')
 
-def main():
+# Suffixes accepted by --max-memory
+MEMORY_UNITS: Dict[str, int] = {'': 1, 'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
 
-  logging.basicConfig(level=logging.INFO)
-
-  # figlet name
-  custom_fig = pyfiglet.Figlet(font='standard')
-  print(custom_fig.renderText('ESN Buddy Matcher'))
-
-  output_dir: str = 'output'
-
-  # Check if the input files exist
-  if not os.path.exists("/input/local_students.csv"):
-      raise FileNotFoundError(f"Local students file not found in the input folder.")
-
-  logging.info("Local students file found")
-
-  if not os.path.exists("/input/incoming_students.csv"):
-      raise FileNotFoundError(f"Incoming students file not found in the input folder.")
-
-  logging.info("Incoming students file found")
-
-  # Load the data
-  local_students: pd.DataFrame = pd.read_csv("/input/local_students.csv")
-  logging.info("Local students loaded [%s]", local_students.shape)
-
-  incoming_students: pd.DataFrame = pd.read_csv("/input/incoming_students.csv")
-  logging.info("Incoming students loaded [%s]", incoming_students.shape)
 
+def parse_memory_size(text: str) -> int:
+  """Parse a number of bytes with an optional K, M or G suffix, such as 512M."""
+  number, unit = text.strip().upper().rstrip('IB'), ''
+  if number and number[-1] in MEMORY_UNITS:
+    number, unit = number[:-1], number[-1]
   try:
-        hobbies: pd.DataFrame = pd.read_csv("/config/hobbies.csv", quotechar="'").iloc[:, 0].tolist()
-        logging.info("Hobbies loaded")
-
-  except FileNotFoundError as e:
-          print(f"Error reading hobbies file: {e}\nEnsure there is a hobbies.csv file at the given path")
-          exit()
+    size = int(float(number) * MEMORY_UNITS[unit])
+  except ValueError:
+    raise argparse.ArgumentTypeError(f"invalid memory size '{text}', expected a number of bytes such as 512M or 2G")
+  if size <= 0:
+    raise argparse.ArgumentTypeError(f"invalid memory size '{text}', it must be positive")
+  return size
+
+
+def add_common_arguments(parser: argparse.ArgumentParser) -> None:
+  parser.add_argument('--input-dir', default='/input',
+                      help='folder holding local_students.csv and incoming_students.csv (default: %(default)s)')
+  parser.add_argument('--config-dir', default='/config',
+                      help='folder holding config.ini and the other configuration files (default: %(default)s)')
+  parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO',
+                      help='the least severe log messages shown (default: %(default)s)')
+
+
+def add_match_arguments(parser: argparse.ArgumentParser) -> None:
+  """Add the options of a matching run, shared by the match and serve subcommands."""
+  parser.add_argument('--output-dir', default='output',
+                      help='folder the reports, caches and state are written to (default: %(default)s)')
+  parser.add_argument('--no-banner', dest='banner', action='store_false',
+                      help='do not print the banner at the start of the run')
+  parser.add_argument('--solver', default='scipy',
+                      help='assignment solver backend: scipy, munkres or auction (default: %(default)s)')
+  parser.add_argument('--auction-epsilon', type=float, default=None, metavar='EPSILON',
+                      help='with --solver auction, the most the total distance of every scenario may exceed the optimum (default: 1.0)')
+  parser.add_argument('--workers', type=int, default=None,
+                      help='worker processes for the distance matrix, 1 disables the process pool (default: the number of CPU cores)')
+  parser.add_argument('--outlier-thresholds', type=float, nargs='+', default=None,
+                      help='age z-score thresholds, each one that finds outliers is also matched without them (default: 2.0)')
+  parser.add_argument('--max-memory', type=parse_memory_size, default=None, metavar='SIZE',
+                      help='compute the distances as float32 in row blocks whose intermediate arrays stay within SIZE '
+                           '(such as 512M or 2G), keeping the matrix on disk when it takes more than half of SIZE; the '
+                           'in-memory columns of every scenario and the solver\'s float64 incoming x capacity slot '
+                           'matrix are not counted')
+  parser.add_argument('--shard-by', choices=['university', 'faculty'], default=None,
+                      help='solve the students of every university, or of every group of related faculties, in their own '
+                           'process, then place the incoming students left unmatched across the groups')
+  parser.add_argument('--no-component-store', dest='component_store', action='store_false',
+                      help='always recompute the distance components instead of reusing the store in the output folder')
+  parser.add_argument('--no-ingestion-cache', dest='ingestion_cache', action='store_false',
+                      help='always parse the students files instead of reusing their Parquet copies in the output folder')
+  parser.add_argument('--no-stage-cache', dest='stage_cache', action='store_false',
+                      help='always run every preparation stage instead of reusing their cached outputs in the output folder')
+  parser.add_argument('--stage-cache-size', type=parse_memory_size, default=parse_memory_size('256M'), metavar='SIZE',
+                      help='the most disk space the cached preparation stages may take, the least recently used are '
+                           'removed first (default: 256M)')
+  parser.add_argument('--incremental', action='store_true',
+                      help='reuse the distances of the last incremental run in the output folder, computing only new or changed '
+                           'students, and save the distances of this run for the next one')
+  parser.add_argument('--pin-confirmed', action='store_true',
+                      help='with --incremental, keep the pairs of the last run whose students are both still registered')
+  parser.add_argument('--metrics', action='store_true',
+                      help='record the time and memory of every stage, written as metrics_<timestamp>.json next to the reports')
+  parser.add_argument('--explain', action='store_true',
+                      help='write the distance components of every matched pair to trace_<scenario>_<timestamp>.csv')
+  parser.add_argument('--explain-pair', nargs=2, action='append', default=[], metavar=('LOCAL_EMAIL', 'INCOMING_EMAIL'),
+                      help='also explain the pair of these two students, matched or not (can be repeated)')
+  parser.add_argument('--report-format', choices=['csv', 'parquet'], default='csv',
+                      help='file format of the matching reports (default: %(default)s)')
+
+
+def build_parser() -> argparse.ArgumentParser:
+  parser = argparse.ArgumentParser(description='Match local students with incoming international students.')
+  subparsers = parser.add_subparsers(dest='command', metavar='{validate,match,serve,sweep,report}')
+
+  validate_parser = subparsers.add_parser('validate', help='check the input and configuration files without matching')
+  add_common_arguments(validate_parser)
+
+  match_parser = subparsers.add_parser('match', help='match the students and write the reports (the default)')
+  add_common_arguments(match_parser)
+  add_match_arguments(match_parser)
+  match_parser.add_argument('--watch', action='store_true',
+                            help='keep running and match again whenever a file in the input or config folder is saved, '
+                                 'recomputing only what the changed files affect')
+
+  serve_parser = subparsers.add_parser('serve', help='keep the configuration loaded and match uploaded students over HTTP')
+  add_common_arguments(serve_parser)
+  add_match_arguments(serve_parser)
+  serve_parser.add_argument('--host', default='127.0.0.1',
+                            help='address the service listens on (default: %(default)s)')
+  serve_parser.add_argument('--port', type=int, default=8080,
+                            help='port the service listens on (default: %(default)s)')
+  serve_parser.add_argument('--jobs', type=int, default=1,
+                            help='matching runs processed at the same time, each in its own worker process (default: %(default)s)')
+
+  sweep_parser = subparsers.add_parser('sweep', help='compare the matchings of many [normalization] and [hobbies] weightings')
+  add_common_arguments(sweep_parser)
+  add_match_arguments(sweep_parser)
+  sweep_parser.add_argument('--candidates', metavar='FILE',
+                            help='CSV file with one weighting per row, its columns are [normalization] factors or hobbies '
+                                 'and an optional name, empty cells keep the weight of config.ini')
+  sweep_parser.add_argument('--grid', action='append', default=[], metavar='KEY=V1,V2,...',
+                            help='also compare every combination of these values of a factor or hobby weight (can be repeated)')
+
+  report_parser = subparsers.add_parser('report', help='summarize a matching report, optionally converting it')
+  report_parser.add_argument('report_file', help='a matching report written by the match subcommand')
+  report_parser.add_argument('--convert-to', choices=['csv', 'parquet'],
+                             help='also write the report in this format, next to the original')
+  report_parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO',
+                             help='the least severe log messages shown (default: %(default)s)')
+  return parser
+
+
+def parse_arguments(argv: Optional[List[str]] = None) -> argparse.Namespace:
+  """Parse the command line, running the match subcommand when none is given so `main.py --solver munkres` keeps working."""
+  argv = sys.argv[1:] if argv is None else list(argv)
+  if not argv or argv[0] not in (*SUBCOMMANDS, '-h', '--help'):
+    argv = ['match', *argv]
+
+  parser = build_parser()
+  arguments = parser.parse_args(argv)
+  if arguments.command in ('match', 'serve') and arguments.pin_confirmed and not arguments.incremental:
+    parser.error('--pin-confirmed requires --incremental')
+  if arguments.command in ('match', 'serve') and arguments.shard_by and arguments.incremental:
+    parser.error('--shard-by cannot be combined with --incremental, it does not compute the distances of every pair')
+  if arguments.command == 'sweep':
+    if not arguments.candidates and not arguments.grid:
+      parser.error('sweep requires --candidates or --grid')
+    if arguments.shard_by or arguments.incremental or arguments.max_memory:
+      parser.error('sweep solves every weighting from the stored distance components, it cannot be combined with '
+                   '--shard-by, --incremental or --max-memory')
+  if arguments.command == 'serve' and arguments.jobs < 1:
+    parser.error('--jobs must be at least 1')
+  if arguments.command == 'serve' and arguments.incremental:
+    parser.error('serve keeps nothing of an upload after answering it, it cannot be combined with --incremental')
+  return arguments
+
+
+def run_validate(arguments: argparse.Namespace) -> int:
+  import validation
+
+  problems = validation.validate(arguments.input_dir, arguments.config_dir)
+  for problem in problems:
+    logging.error(problem)
+  if problems:
+    return 1
+  logging.info("The input and configuration files are ready for matching")
+  return 0
+
+
+def resolve_match_arguments(arguments: argparse.Namespace) -> int:
+  """Check the options of a matching run and fill in their defaults, returning a non-zero exit code when they are unusable."""
+  import auction_solver
+  import distance_calculator
+  import ingestion
+  import scenario_runner
+  import student_matcher
+
+  if arguments.solver not in student_matcher.SOLVERS:
+    logging.error("Unknown solver '%s'. Available solvers: %s", arguments.solver, ', '.join(student_matcher.SOLVERS))
+    return 2
+  if arguments.report_format == 'parquet' and not ingestion.PYARROW_AVAILABLE:
+    logging.error("--report-format parquet requires pyarrow")
+    return 2
+  if arguments.auction_epsilon is None:
+    arguments.auction_epsilon = auction_solver.DEFAULT_AUCTION_EPSILON
+  elif arguments.auction_epsilon <= 0:
+    logging.error("--auction-epsilon must be positive")
+    return 2
+  if arguments.workers is None:
+    arguments.workers = distance_calculator.default_worker_count()
+  if arguments.outlier_thresholds is None:
+    arguments.outlier_thresholds = list(scenario_runner.DEFAULT_OUTLIER_THRESHOLDS)
+  return 0
+
+
+def run_match(arguments: argparse.Namespace) -> int:
+  if arguments.banner:
+    import pyfiglet
+
+    # figlet name
+    custom_fig = pyfiglet.Figlet(font='standard')
+    print(custom_fig.renderText('ESN Buddy Matcher'))
+
+  exit_code = resolve_match_arguments(arguments)
+  if exit_code:
+    return exit_code
+
+  if arguments.watch:
+    import watch
+
+    return watch.watch(arguments)
+
+  import pipeline
+
+  pipeline.run_match(arguments)
+  return 0
+
+
+def run_serve(arguments: argparse.Namespace) -> int:
+  exit_code = resolve_match_arguments(arguments)
+  if exit_code:
+    return exit_code
+
+  import asyncio
+  import service
 
   try:
-      faculty_distances: pd.DataFrame = pd.read_excel(r'/config/faculty_distances.xlsx', index_col=0)
-  except FileNotFoundError as e:
-      print(f"Error reading faculty distances file: {e}\nEnsure there is a faculty_distances.xlsx file in the ")
-      exit()
-
-
-  logging.info("Faculty distances loaded")
-
-
-  # Clean column names by replacing double single quotes with double quotes and stripping whitespace
-  local_students.columns = local_students.columns.str.replace("''", '"').str.strip()
-  incoming_students.columns = incoming_students.columns.str.replace("''", '"').str.strip()
-  logging.info("Columns cleaned")
-
-    # Remap the columns in the dataframes for consistency
-  column_mapping: Dict[str, str] = formatter.read_column_mapping("/config/local_students_column_renames.csv")
-  local_students = formatter.remap_columns(column_mapping,local_students)
-
-  column_mapping = formatter.read_column_mapping("/config/incoming_students_column_renames.csv")
-  incoming_students = formatter.remap_columns(column_mapping,incoming_students)
-  logging.info("Columns remapped successfully")
-
-  # Convert all date columns to datetime objects
-  local_students, incoming_students = formatter.convert_all_dates_to_datetime(local_students, incoming_students)
-
-
-
-
-
-  logging.info("Dates converted to datetime objects successfully")
-
-  local_students, incoming_students = formatter.rename_timestamps(local_students, incoming_students)
-  logging.info("Timestamps renamed")
-
-  local_students, incoming_students, removed_local_students, removed_incoming_students = student_filter.apply_filters(local_students, incoming_students)
-  logging.info("Filters applied")
-
-
-  # Strip spaces from column names
-  local_students.columns = local_students.columns.str.strip()
-  incoming_students.columns = incoming_students.columns.str.strip()
-
-  local_students, incoming_students = formatter.drop_irrelevant_columns(local_students, incoming_students)
-  logging.info("Irrelevant columns dropped")
-
-    #adjust dates
-  current_date = datetime.now()
-  formatter.adjust_dataframe_dates(local_students, ['Availability', 'AvailabilityText'], current_date)
-  formatter.adjust_dataframe_dates(incoming_students, ['Arrival'], current_date)
-
-  threshold: float = 2.0
-
-  # look for outliers by age in the incoming students
-  local_std: float = float(local_students['Age'].std())
-  incoming_outliers = outlier_calculator.calculate_outliers(incoming_students, threshold=threshold, std= local_std)
-
-  logging.info("Outliers calculated")
-  are_outliers: bool = any(incoming_outliers)
-
-  if are_outliers:
-
-    logging.warning("Outliers found in incoming students using a threshold of %i and a STD of %s", threshold, local_std)
-    str_outlier = outlier_calculator.outliers_to_str(incoming_students, incoming_outliers)
-    for i in str_outlier:
-       #print in red color
-       print(f"\033[91m{i}\033[00m")
-    logging.info("Outliers printed")
-
-    logging.info("running the program without the outliers")
-
-
-    # create dulicate copies of the incoming and local students
-    local_students_no_outliers: pd.DataFrame= local_students.copy()
-    incoming_students_no_outliers: pd.DataFrame = incoming_students.copy()
-    logging.info("Copies of incoming and local students created")
-
-    #remove outliers
-    incoming_students_no_outliers = outlier_calculator.remove_outliers(
-      incoming_students_no_outliers
-      , incoming_outliers)
-
-    # Fix the indexes after removing people
-    incoming_students_no_outliers.reset_index(drop=True, inplace=True)
-    logging.info("Outliers removed from incoming students")
-
-    # convert categories to numerical values
-    local_students_no_outliers, incoming_students_no_outliers= formatter.convert_categories_to_numerical(
-    local_students_no_outliers,
-    incoming_students_no_outliers,
-    hobbies)
-     # calulate capacities of the local students and number of  incoming students
-    base_local_capacity: int  = formatter.get_base_capacities(local_students_no_outliers)
-    base_incoming_necessity: int = formatter.get_base_necessity(incoming_students_no_outliers)
-
-
-    logging.info("Base capacities and necessities calculated")
-
-    logging.info("base local capacity: %s", base_local_capacity)
-    logging.info("base incoming necessity: %s", base_incoming_necessity)
-
-    if base_local_capacity < base_incoming_necessity:
-      logging.warning("The base local capacity is less than the base incoming necessity")
-      logging.warning("The algorithm may not be able to match all incoming students")
-
-
-    # compute the bounds for the different categories
-    config = configparser.ConfigParser()
-    config.read("/config/config.ini")
-    normal_dict: Dict[str, Union[float,int]] = normalization_calculator.compute_normalization_values(
-      local_students_no_outliers,
-      incoming_students_no_outliers,
-      config,
-      hobbies,
-      faculty_distances)
-    logging.info("Normalization values computed")
-
-    for key, value in normal_dict.items():
-      logging.info("value for %s: %s", key, value)
-
-
-    distance_matrix: pd.DataFrame = distance_calculator.caculate_student_distances(
-    local_students_no_outliers,
-    incoming_students_no_outliers,
-    config,
-    normal_dict,
-    faculty_distances,
-    hobbies)
-
-    logging.info("Distance matrix computed")
-
-    logging.info("beggining the Kuhn-Munkres algorithm for building the matching matrix")
-    matching_matrix: pd.DataFrame = student_matcher.compute_optimal_pairs(distance_matrix, local_students_no_outliers, incoming_students_no_outliers, base_local_capacity, base_incoming_necessity)
-
-    print(matching_matrix)
-
-    logging.info("Matching matrix computed")
-    # create the output dir
-    os.makedirs(output_dir, exist_ok=True)
-    # create the output file name
-    file_name = f"matching_report_no_outliers{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
-    output_file_name = os.path.join(output_dir, file_name)
-
-    report.create_report(matching_matrix, distance_matrix, local_students_no_outliers, incoming_students_no_outliers,  output_file_name)
-
-
-  else:
-    logging.info("No outliers found in incoming students using a threshold of %i and a STD of %s", threshold, local_std)
-
-
-  logging.info("running the program without the outliers")
-
-
-  # convert categories to numerical values
-  local_students, incoming_students = formatter.convert_categories_to_numerical(
-  local_students,
-  incoming_students,
-  hobbies)
-    # calulate capacities of the local students and number of  incoming students
-  base_local_capacity: int  = formatter.get_base_capacities(local_students)
-  base_incoming_necessity: int = formatter.get_base_necessity(incoming_students)
-
-
-  logging.info("Base capacities and necessities calculated")
-
-  logging.info("base local capacity: %s", base_local_capacity)
-  logging.info("base incoming necessity: %s", base_incoming_necessity)
-
-  if base_local_capacity < base_incoming_necessity:
-    logging.warning("The base local capacity is less than the base incoming necessity")
-    logging.warning("The algorithm may not be able to match all incoming students")
-
+    return asyncio.run(service.serve(arguments))
+  except KeyboardInterrupt:
+    logging.info("Service stopped")
+    return 0
 
-    # compute the bounds for the different categories
-  config = configparser.ConfigParser()
-  config.read("/config/config.ini")
-  normal_dict: Dict[str, Union[float,int]] = normalization_calculator.compute_normalization_values(
-    local_students,
-    incoming_students,
-    config,
-    hobbies,
-    faculty_distances)
-  logging.info("Normalization values computed")
 
+def run_sweep(arguments: argparse.Namespace) -> int:
+  exit_code = resolve_match_arguments(arguments)
+  if exit_code:
+    return exit_code
 
-  for key, value in normal_dict.items():
-    logging.info("value for %s: %s", key, value)
+  import weight_sweep
 
-  distance_matrix: pd.DataFrame = distance_calculator.caculate_student_distances(
-  local_students,
-  incoming_students,
-  config,
-  normal_dict,
-  faculty_distances,
-  hobbies)
+  return weight_sweep.run_sweep(arguments)
 
-  logging.info("Distance matrix computed")
 
+def run_report(arguments: argparse.Namespace) -> int:
+  import report
 
-  logging.info("beggining the Kuhn-Munkres algorithm for building the matching matrix")
-  matching_matrix: pd.DataFrame = student_matcher.compute_optimal_pairs(distance_matrix, local_students, incoming_students, base_local_capacity, base_incoming_necessity)
+  output = report.read_report(arguments.report_file)
+  print(report.summarize_report(output))
+  if arguments.convert_to:
+    report.save_report(output, os.path.splitext(arguments.report_file)[0] + f'.{arguments.convert_to}')
+  return 0
 
 
-  # create the output dir
-  os.makedirs(output_dir, exist_ok=True)
-  # create the output file name
-  file_name = f"matching_report_with_outliers{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
-  output_file_name = os.path.join(output_dir, file_name)
+COMMANDS: Dict[str, Callable[[argparse.Namespace], int]] = {
+  'validate': run_validate,
+  'match': run_match,
+  'serve': run_serve,
+  'sweep': run_sweep,
+  'report': run_report,
+}
 
-  report.create_report(matching_matrix, distance_matrix, local_students, incoming_students,  output_file_name)
 
+def main(argv: Optional[List[str]] = None) -> int:
+  arguments = parse_arguments(argv)
+  logging.basicConfig(level=arguments.log_level)
+  return COMMANDS[arguments.command](arguments)
 
 if __name__ == '__main__':
-  main()
+  sys.exit(main())
@@ -114,3 +114,32 @@ def compute_normalization_values(
         'date_range': compute_date_range(local_students.copy(), incoming_students.copy())
     }
     return normalization_values
+
+
+
+def rescope_normalization_values(
+    normal_dict: Dict[str, Union[int, float]],
+    local_students: pd.DataFrame,
+    incoming_students: pd.DataFrame
+) -> dict[str, Union[int, float]]:
+    """Recomputes the normalization values that depend on the students for a subset of them.
+
+    The age, meeting frequency and date ranges are minima and maxima over the students, so they are recomputed
+    for the subset at the cost of one pass over its columns. The values taken from the configuration and the
+    faculty distances are copied from normal_dict.
+
+    Args:
+        normal_dict (Dict[str, Union[int, float]]): The values from compute_normalization_values for all students.
+        local_students (pd.DataFrame): The local students of the subset.
+        incoming_students (pd.DataFrame): The incoming students of the subset.
+
+    Returns:
+        dict: The normalization values of the subset.
+    """
+    normalization_values = dict(normal_dict)
+    normalization_values.update({
+        'age_range': compute_age_range(local_students, incoming_students),
+        'meeting_frequency_range': compute_meeting_frequency_range(local_students, incoming_students),
+        'date_range': compute_date_range(local_students, incoming_students)
+    })
+    return normalization_values
@@ -0,0 +1,433 @@
+"""The matching run behind `main.py match`.
+
+Kept apart from main.py so the heavy libraries are only imported by the subcommands that need them.
+"""
+import argparse
+import configparser
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import os
+
+import pandas as pd
+import numpy as np
+import colorlog as logging
+
+import distance_calculator
+import formatter
+import student_filter
+import normalization_calculator
+import outlier_calculator
+import student_matcher
+import report
+import component_store
+import scoring_plan
+import faculty_matrix
+import ingestion
+import stage_cache
+import scenario_runner
+import auction_solver
+import incremental
+import instrumentation
+import explain
+
+
+def compute_distance_matrix(
+  arguments: argparse.Namespace,
+  output_dir: str,
+  local_students: pd.DataFrame,
+  incoming_students: pd.DataFrame,
+  plan: scoring_plan.ScoringPlan,
+  faculties: faculty_matrix.FacultyMatrix,
+  state: incremental.RunState = None) -> np.ndarray:
+  """Compute the distance matrix, from the last run's state, within the --max-memory budget, through the persistent component store or from scratch."""
+  if state is not None:
+    return incremental.update_distances(state, local_students, incoming_students, plan, faculties)
+
+  # the component store holds every component of every pair, so it is skipped when memory is bounded
+  if arguments.max_memory is not None:
+    return distance_calculator.calculate_distance_matrix_within_budget(
+      local_students, incoming_students, plan, faculties, arguments.max_memory,
+      directory=output_dir, workers=arguments.workers)
+
+  if not arguments.component_store:
+    return distance_calculator.caculate_student_distances(
+      local_students, incoming_students, plan, faculties, workers=arguments.workers).to_numpy()
+
+  return component_store.calculate_distances_with_store(
+    local_students, incoming_students, plan, faculties,
+    directory=output_dir, workers=arguments.workers)
+
+
+def write_explanation(
+  arguments: argparse.Namespace,
+  output_dir: str,
+  run_timestamp: str,
+  result: scenario_runner.ScenarioResult,
+  local_students: pd.DataFrame,
+  faculties: faculty_matrix.FacultyMatrix) -> None:
+  """Write the component breakdown of the matched pairs (--explain) and the requested pairs (--explain-pair) of one scenario."""
+  local_positions = np.empty(0, dtype=np.int64)
+  incoming_positions = np.empty(0, dtype=np.int64)
+  if arguments.explain:
+    local_positions, incoming_positions = result.assignment['local'], result.assignment['incoming']
+  if arguments.explain_pair:
+    requested_local, requested_incoming = explain.find_pairs(local_students, result.incoming_students, arguments.explain_pair)
+    local_positions = np.concatenate([local_positions, requested_local])
+    incoming_positions = np.concatenate([incoming_positions, requested_incoming])
+
+  explanation = explain.explain_pairs(
+    local_students, result.incoming_students, result.plan, faculties, local_positions, incoming_positions)
+  matched = pd.MultiIndex.from_arrays([result.assignment['local'], result.assignment['incoming']])
+  explanation['matched'] = pd.MultiIndex.from_arrays([local_positions, incoming_positions]).isin(matched)
+  explain.write_trace(explanation, os.path.join(output_dir, f"trace_{result.scenario.name}_{run_timestamp}.csv"))
+
+
+@dataclass(frozen=True)
+class MatchConfiguration:
+  """The parsed files of the config folder, which every matching run reads and a long-running service keeps.
+
+  Attributes:
+    hobbies (list): The compared hobbies, from hobbies.csv.
+    faculty_distances (pd.DataFrame): The distances read from faculty_distances.xlsx.
+    config (configparser.ConfigParser): The parsed config.ini.
+    faculties (faculty_matrix.FacultyMatrix): The coded faculty distances.
+    local_column_mapping (Dict[str, str]): The column renames of the local students.
+    incoming_column_mapping (Dict[str, str]): The column renames of the incoming students.
+    matching_columns (Dict[str, list]): The matching columns of both sides.
+    local_irrelevant_columns (pd.DataFrame): The columns dropped from the local students.
+    incoming_irrelevant_columns (pd.DataFrame): The columns dropped from the incoming students.
+  """
+  hobbies: list
+  faculty_distances: pd.DataFrame
+  config: configparser.ConfigParser
+  faculties: faculty_matrix.FacultyMatrix
+  local_column_mapping: Dict[str, str]
+  incoming_column_mapping: Dict[str, str]
+  matching_columns: Dict[str, list]
+  local_irrelevant_columns: pd.DataFrame
+  incoming_irrelevant_columns: pd.DataFrame
+
+
+def load_configuration(
+  config_dir: str,
+  previous: Optional[MatchConfiguration] = None,
+  changed_files: Optional[Iterable[str]] = None) -> MatchConfiguration:
+  """Read and parse every file of the config folder.
+
+  With a previous configuration and the names of the changed_files, only the parts read from those files are
+  parsed again, so a watched config.ini edit does not re-read faculty_distances.xlsx.
+  """
+  changed_files = None if changed_files is None else set(changed_files)
+  def changed(*names: str) -> bool:
+    return previous is None or changed_files is None or not changed_files.isdisjoint(names)
+
+  hobbies = previous.hobbies if previous is not None else None
+  if changed('hobbies.csv'):
+    try:
+          hobbies: pd.DataFrame = pd.read_csv(os.path.join(config_dir, "hobbies.csv"), quotechar="'").iloc[:, 0].tolist()
+          logging.info("Hobbies loaded")
+
+    except FileNotFoundError as e:
+            print(f"Error reading hobbies file: {e}\nEnsure there is a hobbies.csv file at the given path")
+            exit()
+
+  faculty_distances = previous.faculty_distances if previous is not None else None
+  if changed('faculty_distances.xlsx'):
+    try:
+        faculty_distances: pd.DataFrame = pd.read_excel(os.path.join(config_dir, 'faculty_distances.xlsx'), index_col=0)
+    except FileNotFoundError as e:
+        print(f"Error reading faculty distances file: {e}\nEnsure there is a faculty_distances.xlsx file in the ")
+        exit()
+
+  config = previous.config if previous is not None else None
+  if changed('config.ini'):
+    config = configparser.ConfigParser()
+    config.read(os.path.join(config_dir, "config.ini"))
+
+  faculties = previous.faculties if previous is not None else None
+  if changed('config.ini', 'faculty_distances.xlsx'):
+    unknown_faculty_distance: float = config.getfloat('parameters', 'unknown_faculty_distance', fallback=None)
+    faculties: faculty_matrix.FacultyMatrix = faculty_matrix.build_faculty_matrix(faculty_distances, unknown_faculty_distance)
+    logging.info("Faculty distances loaded")
+
+  def reload(name: str, current, read):
+    return read(os.path.join(config_dir, name)) if changed(name) else current
+
+  return MatchConfiguration(
+    hobbies=hobbies,
+    faculty_distances=faculty_distances,
+    config=config,
+    faculties=faculties,
+    local_column_mapping=reload(
+      "local_students_column_renames.csv", previous and previous.local_column_mapping, formatter.read_column_mapping),
+    incoming_column_mapping=reload(
+      "incoming_students_column_renames.csv", previous and previous.incoming_column_mapping, formatter.read_column_mapping),
+    matching_columns=reload(
+      "matching_columns.csv", previous and previous.matching_columns, ingestion.read_matching_columns),
+    local_irrelevant_columns=reload(
+      "local_students_irrelevant_columns.csv", previous and previous.local_irrelevant_columns,
+      lambda path: pd.read_csv(path, quotechar="'")),
+    incoming_irrelevant_columns=reload(
+      "incoming_students_irrelevant_columns.csv", previous and previous.incoming_irrelevant_columns,
+      lambda path: pd.read_csv(path, quotechar="'")))
+
+
+def preparation_stages(configuration: MatchConfiguration, current_date: datetime) -> List[stage_cache.Stage]:
+  """The stages preparing the ingested students for the distances, with what each depends on besides the students.
+
+  The filters and the date adjustment compare with current_date, so their outputs are cached for its calendar day.
+  """
+  def remap(state):
+    local_students = formatter.remap_columns(configuration.local_column_mapping, state['local_students'])
+    incoming_students = formatter.remap_columns(configuration.incoming_column_mapping, state['incoming_students'])
+    logging.info("Columns remapped successfully")
+    return {'local_students': local_students, 'incoming_students': incoming_students}
+
+  def convert_dates(state):
+    local_students, incoming_students = formatter.convert_all_dates_to_datetime(state['local_students'], state['incoming_students'])
+    logging.info("Dates converted to datetime objects successfully")
+    return {'local_students': local_students, 'incoming_students': incoming_students}
+
+  def rename_timestamps(state):
+    local_students, incoming_students = formatter.rename_timestamps(state['local_students'], state['incoming_students'])
+    logging.info("Timestamps renamed")
+    return {'local_students': local_students, 'incoming_students': incoming_students}
+
+  def filters(state):
+    local_students, incoming_students, _, _ = student_filter.apply_filters(
+      state['local_students'], state['incoming_students'], current_date)
+    logging.info("Filters applied")
+    return {'local_students': local_students, 'incoming_students': incoming_students}
+
+  def drop_irrelevant_columns(state):
+    local_students, incoming_students = state['local_students'], state['incoming_students']
+    # Strip spaces from column names
+    local_students.columns = local_students.columns.str.strip()
+    incoming_students.columns = incoming_students.columns.str.strip()
+
+    local_students, incoming_students = formatter.drop_irrelevant_columns(
+      local_students, incoming_students, configuration.faculty_distances,
+      configuration.local_irrelevant_columns, configuration.incoming_irrelevant_columns)
+    logging.info("Irrelevant columns dropped")
+    return {'local_students': local_students, 'incoming_students': incoming_students}
+
+  def adjust_dates(state):
+    return {
+      'local_students': formatter.adjust_dataframe_dates(state['local_students'], ['Availability', 'AvailabilityText'], current_date),
+      'incoming_students': formatter.adjust_dataframe_dates(state['incoming_students'], ['Arrival'], current_date)}
+
+  def convert_categories(state):
+    local_students, incoming_students = formatter.convert_categories_to_numerical(
+      state['local_students'], state['incoming_students'], configuration.hobbies)
+    incoming_students.reset_index(drop=True, inplace=True)
+    return {'local_students': local_students, 'incoming_students': incoming_students}
+
+  # compute the bounds for the different categories
+  def normalization(state):
+    normal_dict = normalization_calculator.compute_normalization_values(
+      state['local_students'], state['incoming_students'], configuration.config, configuration.hobbies,
+      configuration.faculty_distances)
+    logging.info("Normalization values computed")
+    return {**state, 'normal_dict': normal_dict}
+
+  day = current_date.date().isoformat()
+  return [
+    stage_cache.Stage('remap_columns', remap,
+                      (configuration.local_column_mapping, configuration.incoming_column_mapping)),
+    stage_cache.Stage('convert_dates', convert_dates),
+    stage_cache.Stage('rename_timestamps', rename_timestamps),
+    stage_cache.Stage('filters', filters, (day,)),
+    stage_cache.Stage('drop_irrelevant_columns', drop_irrelevant_columns,
+                      (configuration.faculty_distances, configuration.local_irrelevant_columns,
+                       configuration.incoming_irrelevant_columns)),
+    stage_cache.Stage('adjust_dates', adjust_dates, (day,)),
+    stage_cache.Stage('convert_categories', convert_categories, (configuration.hobbies,)),
+    stage_cache.Stage('normalization', normalization,
+                      (configuration.config, configuration.hobbies, configuration.faculty_distances)),
+  ]
+
+
+def prepare_students(
+  arguments: argparse.Namespace,
+  configuration: MatchConfiguration,
+  metrics: instrumentation.Recorder) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, Union[float, int]]]:
+  """Read the students files and run the preparation stages, returning the prepared local and incoming students and the normalization values."""
+  # Load only the columns the matching uses, with cleaned column names
+  with metrics.span('ingestion'):
+    local_students: pd.DataFrame = ingestion.read_students(
+      os.path.join(arguments.input_dir, "local_students.csv"),
+      configuration.local_column_mapping,
+      ingestion.needed_columns(configuration.local_column_mapping, configuration.matching_columns['local'], configuration.hobbies),
+      cache_dir=arguments.output_dir if arguments.ingestion_cache else None)
+    logging.info("Local students loaded [%s]", local_students.shape)
+
+    incoming_students: pd.DataFrame = ingestion.read_students(
+      os.path.join(arguments.input_dir, "incoming_students.csv"),
+      configuration.incoming_column_mapping,
+      ingestion.needed_columns(
+        configuration.incoming_column_mapping, configuration.matching_columns['incoming'], configuration.hobbies,
+        [student_filter.ACCESSIBILITY_COLUMN]),
+      cache_dir=arguments.output_dir if arguments.ingestion_cache else None)
+    logging.info("Incoming students loaded [%s]", incoming_students.shape)
+  metrics.set_attribute('registered_local_students', len(local_students))
+  metrics.set_attribute('registered_incoming_students', len(incoming_students))
+
+  # the preparation is cached stage by stage in the output folder, a repeated run on the same export reuses it
+  cache = None
+  if arguments.stage_cache and ingestion.PYARROW_AVAILABLE:
+    cache = stage_cache.StageCache(os.path.join(arguments.output_dir, stage_cache.STAGE_CACHE_DIR), arguments.stage_cache_size)
+  prepared, statuses = stage_cache.run_stages(
+    preparation_stages(configuration, datetime.now()),
+    {'local_students': local_students, 'incoming_students': incoming_students},
+    cache,
+    metrics)
+  local_students, incoming_students = prepared['local_students'], prepared['incoming_students']
+  if cache is not None:
+    logging.info("Preparation stages:\n%s", stage_cache.format_report(statuses))
+    metrics.set_attribute('stage_cache', statuses)
+  metrics.set_attribute('local_students', len(local_students))
+  metrics.set_attribute('incoming_students', len(incoming_students))
+
+  return local_students, incoming_students, prepared['normal_dict']
+
+
+def run_match(arguments: argparse.Namespace, configuration: Optional[MatchConfiguration] = None) -> List[str]:
+  """Run the whole matching: read and prepare the students, compute the distances, solve every scenario and write the reports.
+
+  The input, config and output folders and every setting come from the parsed arguments of `main.py match`.
+  A configuration already loaded from the config folder is used instead of reading it again.
+  Returns the paths of the written reports.
+  """
+  metrics = instrumentation.Recorder(enabled=arguments.metrics)
+  input_dir: str = arguments.input_dir
+  config_dir: str = arguments.config_dir
+  output_dir: str = arguments.output_dir
+  run_timestamp: str = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+
+  # Check if the input files exist
+  if not os.path.exists(os.path.join(input_dir, "local_students.csv")):
+      raise FileNotFoundError(f"Local students file not found in the input folder.")
+
+  logging.info("Local students file found")
+
+  if not os.path.exists(os.path.join(input_dir, "incoming_students.csv")):
+      raise FileNotFoundError(f"Incoming students file not found in the input folder.")
+
+  logging.info("Incoming students file found")
+
+  with metrics.span('load_config'):
+    if configuration is None:
+      configuration = load_configuration(config_dir)
+  hobbies: list = configuration.hobbies
+  faculty_distances: pd.DataFrame = configuration.faculty_distances
+  config: configparser.ConfigParser = configuration.config
+  faculties: faculty_matrix.FacultyMatrix = configuration.faculties
+  metrics.set_attribute('hobbies', len(hobbies))
+  metrics.set_attribute('faculties', len(faculty_distances))
+
+  local_students, incoming_students, normal_dict = prepare_students(arguments, configuration, metrics)
+
+  # look for outliers by age in the incoming students, each threshold that finds some gets its own scenario
+  with metrics.span('outliers'):
+    local_std: float = float(local_students['Age'].std())
+    scenarios = scenario_runner.build_scenarios(incoming_students, local_std, arguments.outlier_thresholds)
+    logging.info("Outliers calculated")
+
+  for scenario in scenarios:
+    if scenario.outliers is None:
+      continue
+    for i in outlier_calculator.outliers_to_str(incoming_students, pd.Series(scenario.outliers)):
+       #print in red color
+       print(f"\033[91m{i}\033[00m")
+  logging.info("Outliers printed")
+
+    # compute the bounds for the different categories
+  with metrics.span('scoring_plan'):
+    extra_buddy_penalty: float = config.getfloat('parameters', 'extra_buddy_penalty', fallback=student_matcher.DEFAULT_EXTRA_BUDDY_PENALTY)
+
+    for key, value in normal_dict.items():
+      logging.debug("value for %s: %s", key, value)
+
+    plan: scoring_plan.ScoringPlan = scoring_plan.build_scoring_plan(config, normal_dict, hobbies)
+    shared_plan: scoring_plan.ScoringPlan = scenario_runner.shared_components_plan(plan)
+
+  # the state of the last run lets late sign-ups be added without recomputing every distance
+  plan_key: str = incremental.compute_plan_key(shared_plan, faculties)
+  state = None
+  if arguments.incremental:
+    state = incremental.load_usable_state(output_dir, plan_key, local_students, incoming_students)
+  pinned = None
+  if state is not None and arguments.pin_confirmed:
+    pinned = incremental.pinned_pairs(state, local_students, incoming_students)
+
+  # the components that do not depend on the normalization ranges are computed once for every scenario,
+  # sharded runs only compute the distances within every shard while solving it
+  shared_distances = None
+  if arguments.shard_by is None:
+    with metrics.span('distances', components=len(shared_plan.active_components), incremental=state is not None):
+      shared_distances = compute_distance_matrix(
+      arguments,
+      output_dir,
+      local_students,
+      incoming_students,
+      shared_plan,
+      faculties,
+      state)
+
+      logging.info("Distance matrix computed")
+
+  # the auction solver is configured with the --auction-epsilon bound and the worker threads
+  solver = arguments.solver
+  if solver == 'auction':
+    solver = auction_solver.make_auction_solver(arguments.auction_epsilon, arguments.workers)
+
+  logging.info("Solving %i matching scenarios", len(scenarios))
+  metrics.set_attribute('solve_rounds', len(scenarios))
+  with metrics.span('matching', solver=arguments.solver, scenarios=len(scenarios), shard_by=arguments.shard_by):
+    results = scenario_runner.solve_scenarios(
+      scenarios,
+      shared_distances,
+      local_students,
+      incoming_students,
+      config,
+      normal_dict,
+      hobbies,
+      faculties,
+      solver=solver,
+      extra_buddy_penalty=extra_buddy_penalty,
+      workers=arguments.workers,
+      pinned=pinned,
+      max_memory=arguments.max_memory,
+      shard_by=arguments.shard_by)
+    logging.info("Matching matrices computed")
+
+  # create the output dir
+  os.makedirs(output_dir, exist_ok=True)
+  # only incremental runs keep their state for the next one, it needs the distances of every pair, which a
+  # sharded run never computes
+  if arguments.incremental and shared_distances is not None:
+    with metrics.span('save_state'):
+      incremental.save_state(
+        incremental.state_path(output_dir),
+        incremental.build_state(plan_key, local_students, incoming_students, shared_distances, results[-1].assignment))
+
+  report_files: List[str] = []
+  with metrics.span('report', reports=len(results)):
+    for result in results:
+      # create the output file name
+      file_name = f"matching_report_{result.scenario.name}_{run_timestamp}.{arguments.report_format}"
+      output_file_name = os.path.join(output_dir, file_name)
+
+      report.create_report(result.assignment, local_students, result.incoming_students,  output_file_name)
+      report_files.append(output_file_name)
+
+  if arguments.explain or arguments.explain_pair:
+    with metrics.span('explain'):
+      for result in results:
+        write_explanation(arguments, output_dir, run_timestamp, result, local_students, faculties)
+
+  if metrics.enabled:
+    metrics.write_json(os.path.join(output_dir, f"metrics_{run_timestamp}.json"))
+    print(metrics.summary_table())
+  return report_files
@@ -1,63 +1,104 @@
+import numpy as np
 import pandas as pd
 import colorlog as logging
 
-def convert_matching_matrix_to_output(
-    matching_matrix: pd.DataFrame,
-    distance_matrix: pd.DataFrame,
+# Rows written per chunk by save_report
+REPORT_CHUNK_SIZE: int = 10000
+
+def convert_assignment_to_output(
+    assignment: np.ndarray,
     local_students: pd.DataFrame,
     incoming_students: pd.DataFrame) -> pd.DataFrame:
     """
-    Convert the matching matrix to the output format
-    """
+    Convert the assignment to the output format
 
-    output_data = []
+    The students of every pair are gathered with one positional take per side, so the work grows with the
+    number of pairs rather than with the size of the distance matrix.
+    """
 
-    # iterate over the columns of the matching matrix
-    for incoming_student_index in matching_matrix.columns:
-        # Get the local student index with the max value for this incoming student
-       for i in range(0,len(matching_matrix[incoming_student_index])):
-         if matching_matrix[incoming_student_index][i] == 1:
-           distance = distance_matrix.iloc[i, incoming_students.index.get_loc(incoming_student_index)]
-           output_data.append({
-                "local_student_fullname": local_students.loc[i]["FirstName"] + " " + local_students.loc[i]["LastName"],
-                "local_student_age": local_students.loc[i]["Age"],
-                "local_student_gender": local_students.loc[i]["Gender"],
-                "local_student_country": local_students.loc[i]["Country"],
-                "incoming_student_fullname": incoming_students.loc[incoming_student_index]["FirstName"] + " " + incoming_students.loc[incoming_student_index]["LastName"],
-                "incoming_student_age": incoming_students.loc[incoming_student_index]["Age"],
-                "incoming_student_gender": incoming_students.loc[incoming_student_index]["Gender"],
-                "incoming_student_email": incoming_students.loc[incoming_student_index]["Email"],
-                "incoming_student_country": incoming_students.loc[incoming_student_index]["Country"],
-                "distance": distance
-            })
+    local = local_students.iloc[assignment['local']].reset_index(drop=True)
+    incoming = incoming_students.iloc[assignment['incoming']].reset_index(drop=True)
 
-    output = pd.DataFrame(output_data)
+    output = pd.DataFrame({
+        "local_student_fullname": local["FirstName"] + " " + local["LastName"],
+        "local_student_age": local["Age"],
+        "local_student_gender": local["Gender"],
+        "local_student_email": local["Email"],
+        "local_student_country": local["Country"],
+        "incoming_student_fullname": incoming["FirstName"] + " " + incoming["LastName"],
+        "incoming_student_age": incoming["Age"],
+        "incoming_student_gender": incoming["Gender"],
+        "incoming_student_email": incoming["Email"],
+        "incoming_student_country": incoming["Country"],
+        "distance": assignment['cost'],
+    })
 
     sorted_output = output.sort_values(by=["local_student_fullname", "distance"], ascending=[True, True])
 
     return sorted_output
 
-def save_report(output: pd.DataFrame, output_file: str) -> None:
+def save_report(output: pd.DataFrame, output_file: str, chunksize: int = REPORT_CHUNK_SIZE) -> None:
     """
-    Save the report to a file
+    Save the report to a file, in chunks of rows
+
+    Files ending in .parquet are written with a pyarrow ParquetWriter, one row group per chunk, anything else as CSV.
     """
-    output.to_csv(output_file, index=False)
+    if output_file.endswith('.parquet'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(output, preserve_index=False)
+        with pq.ParquetWriter(output_file, table.schema) as writer:
+            for batch in table.to_batches(max_chunksize=chunksize):
+                writer.write_batch(batch)
+    else:
+        output.to_csv(output_file, index=False, chunksize=chunksize)
     logging.info("Report saved to %s", output_file)
 
 
+def read_report(report_file: str) -> pd.DataFrame:
+    """
+    Read a report written by save_report, parquet or CSV depending on the file extension
+    """
+    if report_file.endswith('.parquet'):
+        return pd.read_parquet(report_file)
+    return pd.read_csv(report_file)
+
+
+def summarize_report(output: pd.DataFrame) -> str:
+    """
+    Summarize a report as plain text: the number of pairs and students and the spread of the distances
+
+    Local students are told apart by email address. Reports written before that column existed are grouped by
+    full name, which merges namesakes, so their count is labelled approximate.
+    """
+    distances = output["distance"]
+    if "local_student_email" in output.columns:
+        buddies_per_local = output.groupby("local_student_email").size()
+        local_label = "Local students"
+    else:
+        buddies_per_local = output.groupby("local_student_fullname").size()
+        local_label = "Local students (approximate, by full name)"
+    lines = [
+        f"Pairs: {len(output)}",
+        f"{local_label}: {len(buddies_per_local)} ({int((buddies_per_local > 1).sum())} with more than one buddy)",
+        f"Incoming students: {output['incoming_student_email'].nunique()}",
+        f"Distance: mean {distances.mean():.3f}, median {distances.median():.3f}, "
+        f"min {distances.min():.3f}, max {distances.max():.3f}",
+    ]
+    return "\n".join(lines)
 
 
 def create_report(
-    matching_matrix: pd.DataFrame,
-    distance_matrix: pd.DataFrame,
+    assignment: np.ndarray,
     local_students: pd.DataFrame,
     incoming_students: pd.DataFrame,
     file_name: str
     ) -> None:
     """
-    Create a report from the matching matrix
+    Create a report from the assignment returned by student_matcher.compute_optimal_pairs
     """
 
-    output = convert_matching_matrix_to_output(matching_matrix, distance_matrix, local_students, incoming_students)
+    output = convert_assignment_to_output(assignment, local_students, incoming_students)
 
     save_report(output, file_name)
@@ -0,0 +1,204 @@
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+import colorlog as logging
+
+import constraints
+import distance_calculator
+import formatter
+import normalization_calculator
+import outlier_calculator
+import scoring_plan
+import sharding
+import student_matcher
+from faculty_matrix import FacultyMatrix
+from scoring_plan import ScoringPlan, DISTANCE_COMPONENTS, RANGE_DEPENDENT_COMPONENTS
+
+DEFAULT_OUTLIER_THRESHOLDS: tuple = (2.0,)
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """A matching run over a subset of the incoming students.
+
+    Attributes:
+        name (str): Name used in the report file name.
+        incoming_positions (np.ndarray): Row positions of the incoming students taking part.
+        outliers (Optional[np.ndarray]): Boolean mask of the incoming students removed as age outliers.
+        threshold (Optional[float]): The z-score threshold the outliers were found with.
+    """
+    name: str
+    incoming_positions: np.ndarray
+    outliers: Optional[np.ndarray] = None
+    threshold: Optional[float] = None
+
+
+@dataclass(frozen=True)
+class ScenarioResult:
+    """The matching of one scenario.
+
+    Attributes:
+        scenario (Scenario): The scenario that was solved.
+        incoming_students (pd.DataFrame): The incoming students of the scenario, with a positional index.
+        assignment (np.ndarray): The matched pairs, see student_matcher.ASSIGNMENT_DTYPE.
+        plan (ScoringPlan): The scoring plan of the scenario, with its rescoped normalization values.
+    """
+    scenario: Scenario
+    incoming_students: pd.DataFrame
+    assignment: np.ndarray
+    plan: ScoringPlan
+
+
+def build_scenarios(
+    incoming_students: pd.DataFrame,
+    local_std: float,
+    thresholds: Sequence[float] = DEFAULT_OUTLIER_THRESHOLDS) -> List[Scenario]:
+    """Builds a scenario without the age outliers for every threshold that finds any, followed by the full run.
+
+    Args:
+        incoming_students (pd.DataFrame): All incoming students.
+        local_std (float): Standard deviation of the local students' ages, used for the z-scores.
+        thresholds (Sequence[float]): The z-score thresholds to try.
+
+    Returns:
+        List[Scenario]: The outlier scenarios in threshold order, then the 'with_outliers' scenario.
+    """
+    scenarios: List[Scenario] = []
+    for threshold in thresholds:
+        outliers = outlier_calculator.calculate_outliers(incoming_students, threshold=threshold, std=local_std)
+        outliers = outliers.to_numpy(dtype=bool)
+        if not outliers.any():
+            logging.info("No outliers found in incoming students using a threshold of %s and a STD of %s", threshold, local_std)
+            continue
+
+        logging.warning("Outliers found in incoming students using a threshold of %s and a STD of %s", threshold, local_std)
+        name = 'no_outliers' if len(thresholds) == 1 else f'no_outliers_z{threshold:g}'
+        scenarios.append(Scenario(name, np.flatnonzero(~outliers), outliers, threshold))
+
+    scenarios.append(Scenario('with_outliers', np.arange(len(incoming_students))))
+    return scenarios
+
+
+def shared_components_plan(plan: ScoringPlan) -> ScoringPlan:
+    """The plan restricted to the components that are the same in every scenario.
+
+    The distance matrix of this plan is computed once over all students and sliced for each scenario.
+    """
+    return plan.restricted_to(name for name in DISTANCE_COMPONENTS if name not in RANGE_DEPENDENT_COMPONENTS)
+
+
+def _pinned_in_scenario(pinned: np.ndarray, positions: np.ndarray, incoming_count: int) -> np.ndarray:
+    """The pinned pairs whose incoming student takes part, with incoming positions relative to the scenario."""
+    scenario_positions = np.full(incoming_count, -1, dtype=np.int64)
+    scenario_positions[positions] = np.arange(len(positions))
+
+    scenario_pinned = pinned[scenario_positions[pinned['incoming']] >= 0].copy()
+    scenario_pinned['incoming'] = scenario_positions[scenario_pinned['incoming']]
+    return scenario_pinned
+
+
+def solve_scenarios(
+    scenarios: List[Scenario],
+    shared_distances: Optional[np.ndarray],
+    local_students: pd.DataFrame,
+    incoming_students: pd.DataFrame,
+    configs: configparser.ConfigParser,
+    normal_dict: Dict[str, Union[int, float]],
+    hobbies: list,
+    faculties: FacultyMatrix,
+    solver: Union[str, student_matcher.Solver] = student_matcher.DEFAULT_SOLVER,
+    extra_buddy_penalty: float = student_matcher.DEFAULT_EXTRA_BUDDY_PENALTY,
+    workers: int = 1,
+    pinned: Optional[np.ndarray] = None,
+    max_memory: Optional[int] = None,
+    shard_by: Optional[str] = None) -> List[ScenarioResult]:
+    """Solves every scenario from one shared distance matrix, concurrently.
+
+    Each scenario takes the columns of its incoming students from shared_distances. Only the components in
+    RANGE_DEPENDENT_COMPONENTS are computed per scenario, with the normalization values rescoped to the students
+    of the scenario by normalization_calculator.rescope_normalization_values. The pairs ruled out by the
+    constraints enabled in the configuration are never matched.
+
+    With shard_by, shared_distances is not used: every scenario is solved by sharding.solve_in_shards, one after
+    the other, with the shards of a scenario spread over the workers.
+
+    Args:
+        scenarios (List[Scenario]): The scenarios to solve.
+        shared_distances (Optional[np.ndarray]): The L x I distances of shared_components_plan(plan) over all
+            students, None with shard_by.
+        local_students (pd.DataFrame): The prepared local students.
+        incoming_students (pd.DataFrame): All prepared incoming students, with a positional index.
+        configs (configparser.ConfigParser): Configuration parser containing the matching parameters and weights.
+        normal_dict (Dict[str, Union[int, float]]): The normalization values over all students.
+        hobbies (list): List of hobbies that are compared.
+        faculties (FacultyMatrix): The coded faculty distances.
+        solver (Union[str, student_matcher.Solver]): The assignment solver or its name in student_matcher.SOLVERS.
+        extra_buddy_penalty (float): The extra cost of matching a student to a local student's overflow slot.
+        workers (int): The number of scenarios solved at the same time, or of shards with shard_by.
+        pinned (Optional[np.ndarray]): Pairs kept in every scenario that has their incoming student, as a
+            student_matcher.ASSIGNMENT_DTYPE array of positions in local_students and incoming_students.
+        max_memory (Optional[int]): The most bytes the intermediate arrays of the scenarios solved at the same
+            time may take while their components are computed, unbounded when None. The in-memory copy of the
+            columns of every scenario and the matrices of the assignment solver are not counted.
+        shard_by (Optional[str]): Solve every scenario in shards of students with this key, see sharding.SHARD_KEYS.
+
+    Returns:
+        List[ScenarioResult]: The results, in the order of scenarios.
+    """
+    plan = scoring_plan.build_scoring_plan(configs, normal_dict, hobbies)
+    local, incoming = distance_calculator.encode_students(local_students, incoming_students, faculties, plan)
+    base_local_capacity: int = formatter.get_base_capacities(local_students)
+    enabled_constraints = constraints.build_constraints(configs)
+    # the shards of a scenario already keep the workers busy
+    concurrent_scenarios = 1 if shard_by is not None else max(1, min(workers, len(scenarios)))
+    scenario_max_memory = None if max_memory is None else max_memory // concurrent_scenarios
+
+    def solve(scenario: Scenario) -> ScenarioResult:
+        positions = scenario.incoming_positions
+        full = len(positions) == len(incoming_students)
+        scenario_students = incoming_students.iloc[positions].reset_index(drop=True)
+        scenario_incoming = {key: value[positions] for key, value in incoming.items()}
+        scenario_pinned = None if pinned is None else _pinned_in_scenario(pinned, positions, len(incoming_students))
+
+        scenario_normal_dict = normal_dict if full else normalization_calculator.rescope_normalization_values(
+            normal_dict, local_students, scenario_students)
+        scenario_plan = scoring_plan.build_scoring_plan(configs, scenario_normal_dict, hobbies)
+
+        base_incoming_necessity: int = formatter.get_base_necessity(scenario_students)
+        logging.info("Scenario %s: base local capacity %s, base incoming necessity %s",
+                     scenario.name, base_local_capacity, base_incoming_necessity)
+        if base_local_capacity < base_incoming_necessity:
+            logging.warning("Scenario %s: the base local capacity is less than the base incoming necessity", scenario.name)
+            logging.warning("The algorithm may not be able to match all incoming students")
+
+        if shard_by is not None:
+            capacities, extra_capacities = student_matcher.local_capacities(
+                local_students, base_local_capacity, base_incoming_necessity)
+            assignment = sharding.solve_in_shards(
+                local, scenario_incoming, scenario_plan, faculties, capacities, extra_capacities, shard_by,
+                extra_buddy_penalty=extra_buddy_penalty, solver=solver, enabled_constraints=enabled_constraints,
+                workers=workers, max_memory=max_memory,
+                max_faculty_distance=configs.getfloat('parameters', 'shard_faculty_distance', fallback=None))
+            logging.info("Scenario %s: matched %i of %i incoming students in shards",
+                         scenario.name, len(assignment), len(scenario_students))
+            return ScenarioResult(scenario, scenario_students, assignment, scenario_plan)
+
+        range_plan = scenario_plan.restricted_to(RANGE_DEPENDENT_COMPONENTS)
+        # the columns of the scenario are copied into memory in the dtype of shared_distances, then the range
+        # components added; the copy is dropped once the scenario is solved
+        distance_matrix = distance_calculator.add_distances_blockwise(
+            local, scenario_incoming, range_plan, faculties.distances, shared_distances[:, positions], scenario_max_memory)
+
+        assignment = student_matcher.compute_optimal_pairs(
+            distance_matrix, local_students, scenario_students, base_local_capacity, base_incoming_necessity,
+            solver=solver, extra_buddy_penalty=extra_buddy_penalty,
+            infeasible=constraints.infeasible_pairs(local, scenario_incoming, enabled_constraints),
+            pinned=scenario_pinned)
+        return ScenarioResult(scenario, scenario_students, assignment, scenario_plan)
+
+    with ThreadPoolExecutor(max_workers=concurrent_scenarios) as executor:
+        return list(executor.map(solve, scenarios))
@@ -0,0 +1,135 @@
+import configparser
+from dataclasses import dataclass, replace
+from typing import Dict, Iterable, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# Order in which the components are weighted and summed
+DISTANCE_COMPONENTS: Tuple[str, ...] = (
+    'age',
+    'gender',
+    'age_gender',
+    'university',
+    'faculty',
+    'interests',
+    'availability',
+    'text_availability',
+    'meeting_frequency',
+    'expectations')
+
+# [normalization] key holding the weight of each component
+COMPONENT_FACTORS: Dict[str, str] = {
+    'age': 'age_factor',
+    'gender': 'gender_factor',
+    'age_gender': 'age_gender_factor',
+    'university': 'university_factor',
+    'faculty': 'faculty_factor',
+    'interests': 'interests_factor',
+    'availability': 'availability_physical_factor',
+    'text_availability': 'availability_text_factor',
+    'meeting_frequency': 'meeting_frequency_factor',
+    'expectations': 'expectations_factor'}
+
+# Components normalized by ranges that depend on which students take part in a run
+RANGE_DEPENDENT_COMPONENTS: Tuple[str, ...] = ('availability', 'meeting_frequency')
+
+# ScoringPlan field holding the normalization range of each of RANGE_DEPENDENT_COMPONENTS
+COMPONENT_RANGE_FIELDS: Dict[str, str] = {
+    'availability': 'date_range',
+    'meeting_frequency': 'meeting_frequency_range'}
+
+LOCAL_EXPECTATIONS: Tuple[str, ...] = (
+    'Just answering some (practical) questions',
+    'Showing the new student(s) around',
+    'Becoming friends with my buddies')
+
+INCOMING_EXPECTATIONS: Tuple[str, ...] = (
+    'Just asking (practical) questions',
+    'Being shown around the city',
+    'Becoming friends with my buddy')
+
+
+@dataclass(frozen=True)
+class ScoringPlan:
+    """Everything the distance functions need from the configuration, parsed once per run.
+
+    Attributes:
+        desired_age_difference (int): [parameters] desired_age_difference.
+        local_gender_preference_penalty (int): [parameters] local_gender_preference_penalty.
+        incoming_gender_preference_penalty (int): [parameters] incoming_gender_preference_penalty.
+        desired_date_difference (float): [parameters] desired_date_difference.
+        gender_range (float): Normalization range of the gender component.
+        hobby_range (float): Normalization range of the interests component.
+        date_range (float): Normalization range of the physical availability component.
+        meeting_frequency_range (float): Normalization range of the meeting frequency component.
+        hobbies (Tuple[str, ...]): The compared hobby columns.
+        hobby_weights (np.ndarray): The [hobbies] weight of every hobby, in the order of hobbies.
+        factors (Tuple[float, ...]): The [normalization] factor of every component, in DISTANCE_COMPONENTS order.
+        local_expectations (Tuple[str, ...]): The expectation answers looked for in local students.
+        incoming_expectations (Tuple[str, ...]): The expectation answers looked for in incoming students.
+    """
+    desired_age_difference: int
+    local_gender_preference_penalty: int
+    incoming_gender_preference_penalty: int
+    desired_date_difference: float
+    gender_range: float
+    hobby_range: float
+    date_range: float
+    meeting_frequency_range: float
+    hobbies: Tuple[str, ...]
+    hobby_weights: np.ndarray
+    factors: Tuple[float, ...]
+    local_expectations: Tuple[str, ...] = LOCAL_EXPECTATIONS
+    incoming_expectations: Tuple[str, ...] = INCOMING_EXPECTATIONS
+
+    def factor(self, component: str) -> float:
+        """Returns the [normalization] factor of a component."""
+        return self.factors[DISTANCE_COMPONENTS.index(component)]
+
+    @property
+    def active_components(self) -> Tuple[str, ...]:
+        """The components with a non-zero factor, in DISTANCE_COMPONENTS order. The others are never computed."""
+        return tuple(name for name, factor in zip(DISTANCE_COMPONENTS, self.factors) if factor != 0)
+
+    def restricted_to(self, components: Iterable[str]) -> 'ScoringPlan':
+        """Returns a copy of the plan in which every component outside components has a factor of 0."""
+        components = set(components)
+        return replace(self, factors=tuple(
+            factor if name in components else 0.0 for name, factor in zip(DISTANCE_COMPONENTS, self.factors)))
+
+    @property
+    def factor_vector(self) -> np.ndarray:
+        """The factors as a float array, in DISTANCE_COMPONENTS order."""
+        return np.array(self.factors, dtype=np.float64)
+
+
+def build_scoring_plan(
+    configs: configparser.ConfigParser,
+    normal_dict: Dict[str, Union[int, float]],
+    hobbies: pd.DataFrame) -> ScoringPlan:
+    """Parses the configuration and normalization values into a ScoringPlan.
+
+    Args:
+        configs (configparser.ConfigParser): Configuration parser with the [parameters], [normalization] and [hobbies] sections.
+        normal_dict (Dict[str, Union[int, float]]): The values from normalization_calculator.compute_normalization_values.
+        hobbies (list[str]): List of hobbies to compare.
+
+    Returns:
+        ScoringPlan: The parsed plan.
+    """
+    hobby_weights = np.array([float(configs.get('hobbies', hobby)) for hobby in hobbies], dtype=np.float64)
+    hobby_weights.flags.writeable = False
+
+    return ScoringPlan(
+        desired_age_difference=int(configs.get('parameters', 'desired_age_difference')),
+        local_gender_preference_penalty=int(configs.get('parameters', 'local_gender_preference_penalty')),
+        incoming_gender_preference_penalty=int(configs.get('parameters', 'incoming_gender_preference_penalty')),
+        desired_date_difference=float(configs.get('parameters', 'desired_date_difference')),
+        gender_range=normal_dict['gender_range'],
+        hobby_range=normal_dict['hobby_range'],
+        date_range=normal_dict['date_range'],
+        meeting_frequency_range=normal_dict['meeting_frequency_range'],
+        hobbies=tuple(hobbies),
+        hobby_weights=hobby_weights,
+        factors=tuple(float(configs.get('normalization', COMPONENT_FACTORS[name])) for name in DISTANCE_COMPONENTS))
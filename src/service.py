@@ -0,0 +1,278 @@
+"""The matching service behind `main.py serve`.
+
+An asyncio HTTP server on localhost accepts the two students files as a multipart/form-data upload and answers
+with the matching reports. The matching runs in a pool of worker processes, so the event loop keeps answering
+while students are matched. Every worker keeps the parsed config folder, faculty matrix included, between runs
+and parses it again when one of its files changes.
+
+Endpoints:
+    GET /health: The state of the service.
+    POST /match: Matches the uploaded local_students and incoming_students files.
+"""
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import itertools
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import colorlog as logging
+
+import validation
+
+# The largest request body accepted, the students files of a cohort take a few megabytes
+MAX_REQUEST_BYTES: int = 64 * 2 ** 20
+
+# The multipart/form-data fields of a /match request, uploaded as <field>.csv
+UPLOAD_FIELDS: Tuple[str, ...] = ('local_students', 'incoming_students')
+
+HTTP_REASONS: Dict[int, str] = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    422: 'Unprocessable Entity',
+    500: 'Internal Server Error',
+}
+
+# State of a matching worker process, see _load_worker_configuration
+_worker_state: dict = {}
+
+
+class RequestError(Exception):
+    """A request the service cannot handle, answered with an HTTP status and a message."""
+
+    def __init__(self, status: int, message: str, problems: Optional[List[str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.problems = problems or []
+
+
+def config_signature(config_dir: str) -> Tuple[tuple, ...]:
+    """The modification time and size of every config file, which changes whenever one of them is edited."""
+    signature = []
+    for name in validation.CONFIG_FILES:
+        try:
+            stat = os.stat(os.path.join(config_dir, name))
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((name, None, None))
+    return tuple(signature)
+
+
+def _load_worker_configuration(config_dir: str, signature: Tuple[tuple, ...]):
+    """The configuration kept by this worker process, parsed again when the config files changed since it was loaded."""
+    import pipeline
+
+    if _worker_state.get('signature') != signature:
+        if 'signature' in _worker_state:
+            logging.info("Configuration files changed, reloading %s", config_dir)
+        _worker_state['configuration'] = pipeline.load_configuration(config_dir)
+        _worker_state['signature'] = signature
+    return _worker_state['configuration']
+
+
+def _warm_up(config_dir: str) -> None:
+    """Initializer of the worker processes: imports the matching modules and loads the configuration once."""
+    _load_worker_configuration(config_dir, config_signature(config_dir))
+
+
+def _run_matching(arguments: argparse.Namespace, signature: Tuple[tuple, ...]) -> List[str]:
+    """Matches the students files in arguments.input_dir in a worker process, returning the report files."""
+    import pipeline
+
+    configuration = _load_worker_configuration(arguments.config_dir, signature)
+    return pipeline.run_match(arguments, configuration)
+
+
+def parse_multipart(content_type: str, body: bytes) -> Dict[str, bytes]:
+    """Parses a multipart/form-data body with the email parser, returning the content of every named field."""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+    if not message.is_multipart():
+        raise RequestError(400, "Expected a multipart/form-data body")
+
+    fields: Dict[str, bytes] = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if name:
+            fields[name] = part.get_payload(decode=True) or b''
+    return fields
+
+
+async def read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+    """Reads one HTTP/1.1 request, returning its method, path, lower-cased headers and body."""
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.LimitOverrunError:
+        raise RequestError(400, "The request headers are too large")
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, _ = lines[0].split(' ', 2)
+    except ValueError:
+        raise RequestError(400, "Malformed request line")
+    headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(':') for line in lines[1:] if line)}
+
+    if 'transfer-encoding' in headers:
+        raise RequestError(411, "Send the request with a Content-Length instead of a Transfer-Encoding")
+    try:
+        length = int(headers.get('content-length', '0') or 0)
+    except ValueError:
+        raise RequestError(400, "Malformed Content-Length header")
+    if length > MAX_REQUEST_BYTES:
+        raise RequestError(413, f"The request body is larger than {MAX_REQUEST_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target.split('?', 1)[0], headers, body
+
+
+def encode_response(status: int, payload: dict) -> bytes:
+    """An HTTP/1.1 response with a JSON body, after which the connection is closed."""
+    body = json.dumps(payload, indent=2).encode('utf-8')
+    head = (f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n")
+    return head.encode('latin-1') + body
+
+
+class MatchingService:
+    """Answers the HTTP requests of one service, submitting the matching runs to its worker pool.
+
+    Attributes:
+        arguments (argparse.Namespace): The parsed arguments of `main.py serve`, the settings of every run.
+        executor (ProcessPoolExecutor): The matching worker processes.
+    """
+
+    def __init__(self, arguments: argparse.Namespace, executor: ProcessPoolExecutor):
+        self.arguments = arguments
+        self.executor = executor
+        self.signature = config_signature(arguments.config_dir)
+        self.running = 0
+        self.completed = 0
+        self.run_numbers = itertools.count(1)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answers one connection, see the endpoints in the module docstring."""
+        try:
+            method, path, headers, body = await read_request(reader)
+            if path == '/health':
+                if method != 'GET':
+                    raise RequestError(405, "Use GET for /health")
+                status, payload = 200, {'status': 'ok', 'running': self.running, 'completed': self.completed,
+                                        'jobs': self.arguments.jobs}
+            elif path == '/match':
+                if method != 'POST':
+                    raise RequestError(405, "Use POST for /match")
+                status, payload = 200, await self.match(headers.get('content-type', ''), body)
+            else:
+                raise RequestError(404, f"No endpoint {path}, use GET /health or POST /match")
+        except RequestError as e:
+            status, payload = e.status, {'error': str(e), 'problems': e.problems}
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except Exception as e:
+            logging.exception("Matching request failed")
+            status, payload = 500, {'error': f"{type(e).__name__}: {e}", 'problems': []}
+
+        writer.write(encode_response(status, payload))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    def check_configuration(self) -> Tuple[tuple, ...]:
+        """The current signature of the config files, validated again whenever one of them changed."""
+        signature = config_signature(self.arguments.config_dir)
+        if signature != self.signature:
+            problems = validation.validate_config(self.arguments.config_dir)
+            if problems:
+                raise RequestError(500, "The configuration files changed and cannot be used", problems)
+            logging.info("Configuration files changed, the next runs reload them")
+            self.signature = signature
+        return signature
+
+    async def match(self, content_type: str, body: bytes) -> dict:
+        """Matches an upload in a worker process, returning the report files and their CSV content."""
+        fields = parse_multipart(content_type, body)
+        missing = [field for field in UPLOAD_FIELDS if field not in fields]
+        if missing:
+            raise RequestError(400, f"Missing upload fields: {', '.join(missing)}")
+        signature = self.check_configuration()
+
+        run_id = f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{next(self.run_numbers)}"
+        arguments = argparse.Namespace(**vars(self.arguments))
+        arguments.output_dir = os.path.join(self.arguments.output_dir, run_id)
+        arguments.banner = False
+        # the uploads hold personal data, they are only kept while the run needs them: no parsed copies, prepared
+        # frames or distances are cached, as no later upload would reuse them
+        arguments.ingestion_cache = False
+        arguments.stage_cache = False
+        arguments.component_store = False
+
+        with tempfile.TemporaryDirectory(prefix='buddy-matcher-') as input_dir:
+            for field in UPLOAD_FIELDS:
+                with open(os.path.join(input_dir, f'{field}.csv'), 'wb') as file:
+                    file.write(fields[field])
+            problems = [problem.replace(input_dir + os.sep, '') for problem in validation.validate(input_dir, arguments.config_dir)]
+            if problems:
+                raise RequestError(422, "The uploaded files cannot be matched", problems)
+
+            arguments.input_dir = input_dir
+            logging.info("Matching run %s started", run_id)
+            self.running += 1
+            try:
+                report_files = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, _run_matching, arguments, signature)
+            finally:
+                self.running -= 1
+        self.completed += 1
+        logging.info("Matching run %s finished with %i reports", run_id, len(report_files))
+
+        reports = []
+        for path in report_files:
+            entry = {'file': os.path.basename(path), 'path': path}
+            if path.endswith('.csv'):
+                with open(path, encoding='utf-8') as file:
+                    entry['csv'] = file.read()
+            reports.append(entry)
+        return {'run': run_id, 'output_dir': arguments.output_dir, 'reports': reports}
+
+
+async def serve(arguments: argparse.Namespace) -> int:
+    """Runs the service until it is interrupted.
+
+    Args:
+        arguments (argparse.Namespace): The parsed arguments of `main.py serve`.
+
+    Returns:
+        int: The exit code, 1 when the config folder cannot be used.
+    """
+    problems = validation.validate_config(arguments.config_dir)
+    for problem in problems:
+        logging.error(problem)
+    if problems:
+        return 1
+
+    executor = ProcessPoolExecutor(max_workers=arguments.jobs, initializer=_warm_up, initargs=(arguments.config_dir,))
+    service = MatchingService(arguments, executor)
+    try:
+        # start every worker now, so the first requests do not wait for the imports and the configuration
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(executor, os.getpid) for _ in range(arguments.jobs)))
+        server = await asyncio.start_server(service.handle, arguments.host, arguments.port)
+        logging.info("Serving on http://%s:%i with %i matching workers, POST the students files to /match",
+                     arguments.host, arguments.port, arguments.jobs)
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return 0
@@ -0,0 +1,199 @@
+"""Solves a matching in shards of students that are likely to be matched with each other.
+
+Students are split by university, or by groups of related faculties, and every shard computes its own distance
+matrix and assignment in a worker process. The sum of the shards' cubic solves is much smaller than the solve of
+the whole cohort. Incoming students left unmatched by their shard are placed afterwards, against the local
+students with capacity left in any shard.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import colorlog as logging
+from scipy.cluster.hierarchy import fcluster, linkage
+from scipy.spatial.distance import squareform
+
+import constraints
+import distance_calculator
+import student_matcher
+from faculty_matrix import FacultyMatrix
+from scoring_plan import ScoringPlan
+
+# The keys students can be sharded by, see shard_labels
+SHARD_KEYS: Tuple[str, ...] = ('university', 'faculty')
+
+
+def faculty_groups(faculties: FacultyMatrix, max_distance: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Groups the faculties of faculty_distances.xlsx whose distances to each other are all at most max_distance.
+
+    The groups are the clusters of complete-linkage clustering, so a chain of close faculties does not link
+    distant ones. A faculty in both the rows and the columns of the file is one faculty, and two faculties are as
+    close as the smaller of their distances either way. Unknown faculties form a group of their own.
+
+    Args:
+        faculties (FacultyMatrix): The coded faculty distances.
+        max_distance (Optional[float]): The largest distance within a group. Defaults to half the largest distance
+            in the file.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The group of every incoming faculty code and of every local faculty code,
+        sentinel codes included.
+    """
+    names = list(dict.fromkeys([*faculties.incoming_codes, *faculties.local_codes]))
+    positions = {name: position for position, name in enumerate(names)}
+    incoming_positions = np.array([positions[name] for name in faculties.incoming_codes], dtype=np.intp)
+    local_positions = np.array([positions[name] for name in faculties.local_codes], dtype=np.intp)
+    known = faculties.distances[:-1, :-1]
+    if max_distance is None:
+        max_distance = float(known.max()) / 2 if known.size else 0.0
+
+    pairwise = np.full((len(names), len(names)), faculties.fallback_distance)
+    pairwise[np.ix_(incoming_positions, local_positions)] = known
+    pairwise = np.minimum(pairwise, pairwise.T)
+    np.fill_diagonal(pairwise, 0.0)
+    if len(names) > 1:
+        groups = fcluster(linkage(squareform(pairwise, checks=False), method='complete'), max_distance, criterion='distance')
+    else:
+        groups = np.ones(len(names), dtype=np.intp)
+    group_count = int(groups.max()) + 1 if len(names) else 0
+    return np.append(groups[incoming_positions], group_count), np.append(groups[local_positions], group_count)
+
+
+def shard_labels(
+    local: Dict[str, np.ndarray],
+    incoming: Dict[str, np.ndarray],
+    key: str,
+    faculties: FacultyMatrix,
+    max_faculty_distance: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """The shard of every local and incoming student.
+
+    Args:
+        local (Dict[str, np.ndarray]): The encoded local students, see distance_calculator.encode_students.
+        incoming (Dict[str, np.ndarray]): The encoded incoming students.
+        key (str): 'university' to shard by the University column, or 'faculty' to shard by faculty_groups.
+        faculties (FacultyMatrix): The coded faculty distances.
+        max_faculty_distance (Optional[float]): The largest distance within a faculty group, see faculty_groups.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The shard labels of the local and of the incoming students. Students
+        without a university share one shard.
+    """
+    if key == 'university':
+        return local['university'], incoming['university']
+    if key == 'faculty':
+        incoming_groups, local_groups = faculty_groups(faculties, max_faculty_distance)
+        return local_groups[local['faculty_code']], incoming_groups[incoming['faculty_code']]
+    raise ValueError(f"Unknown shard key '{key}'. Available keys: {', '.join(SHARD_KEYS)}")
+
+
+def _take(students: Dict[str, np.ndarray], positions: np.ndarray) -> Dict[str, np.ndarray]:
+    return {name: values[positions] for name, values in students.items()}
+
+
+def _solve_shard(
+    local: Dict[str, np.ndarray],
+    incoming: Dict[str, np.ndarray],
+    plan: ScoringPlan,
+    faculty_matrix: np.ndarray,
+    capacities: np.ndarray,
+    extra_capacities: Optional[np.ndarray],
+    extra_buddy_penalty: float,
+    solver: Union[str, student_matcher.Solver],
+    enabled_constraints: List[constraints.Constraint],
+    max_memory: Optional[int]) -> np.ndarray:
+    """Computes the distances of one shard and assigns its incoming students, with positions within the shard."""
+    shape = (len(local['age']), len(incoming['age']))
+    distances = distance_calculator.add_distances_blockwise(
+        local, incoming, plan, faculty_matrix, np.zeros(shape, dtype=np.float64 if max_memory is None else np.float32),
+        max_memory)
+    return student_matcher.solve_capacitated_assignment(
+        distances, capacities, extra_capacities, extra_buddy_penalty, solver,
+        constraints.infeasible_pairs(local, incoming, enabled_constraints))
+
+
+def solve_in_shards(
+    local: Dict[str, np.ndarray],
+    incoming: Dict[str, np.ndarray],
+    plan: ScoringPlan,
+    faculties: FacultyMatrix,
+    capacities: np.ndarray,
+    extra_capacities: np.ndarray,
+    key: str,
+    extra_buddy_penalty: float = student_matcher.DEFAULT_EXTRA_BUDDY_PENALTY,
+    solver: Union[str, student_matcher.Solver] = student_matcher.DEFAULT_SOLVER,
+    enabled_constraints: Optional[List[constraints.Constraint]] = None,
+    workers: int = 1,
+    max_memory: Optional[int] = None,
+    max_faculty_distance: Optional[float] = None) -> np.ndarray:
+    """Assigns incoming students to local students shard by shard, then places the leftovers across shards.
+
+    Every shard is solved over the regular capacity of its local students, in a pool of worker processes with the
+    largest shards first. The overflow capacity is kept for the global pass, which assigns the incoming students
+    no shard matched to the local students of any shard with regular or overflow capacity left. Pairs across
+    shards are only compared in that pass, so the result can be worse than solving the whole cohort at once.
+
+    Args:
+        local (Dict[str, np.ndarray]): The encoded local students, see distance_calculator.encode_students.
+        incoming (Dict[str, np.ndarray]): The encoded incoming students.
+        plan (ScoringPlan): The scoring plan of every distance component.
+        faculties (FacultyMatrix): The coded faculty distances.
+        capacities (np.ndarray): The regular capacity of each local student.
+        extra_capacities (np.ndarray): The overflow capacity of each local student.
+        key (str): The shard key, one of SHARD_KEYS.
+        extra_buddy_penalty (float): The extra cost of matching a student to a local student's overflow slot.
+        solver (Union[str, student_matcher.Solver]): The assignment solver or its name in student_matcher.SOLVERS.
+        enabled_constraints (Optional[List[constraints.Constraint]]): The constraints ruling out pairs.
+        workers (int): The number of shards solved at the same time, each in its own process.
+        max_memory (Optional[int]): The most bytes the intermediate distance arrays of all workers together may
+            take, the distances are float32 when it is set.
+        max_faculty_distance (Optional[float]): The largest distance within a faculty group, see faculty_groups.
+
+    Returns:
+        np.ndarray: The matched pairs as a student_matcher.ASSIGNMENT_DTYPE array, in incoming order.
+    """
+    enabled_constraints = enabled_constraints or []
+    local_labels, incoming_labels = shard_labels(local, incoming, key, faculties, max_faculty_distance)
+    shards = [
+        (np.flatnonzero(local_labels == label), np.flatnonzero(incoming_labels == label))
+        for label in np.unique(incoming_labels)]
+    shards = [(local_positions, incoming_positions) for local_positions, incoming_positions in shards
+              if capacities[local_positions].sum() > 0]
+    shards.sort(key=lambda shard: len(shard[0]) * len(shard[1]), reverse=True)
+
+    pool_size = max(1, min(workers, len(shards)))
+    shard_max_memory = None if max_memory is None else max_memory // pool_size
+    tasks = [
+        (_take(local, local_positions), _take(incoming, incoming_positions), plan, faculties.distances,
+         capacities[local_positions], None, extra_buddy_penalty, solver, enabled_constraints, shard_max_memory)
+        for local_positions, incoming_positions in shards]
+    logging.info("Solving %i shards by %s, the largest with %i local and %i incoming students",
+                 len(shards), key, len(shards[0][0]) if shards else 0, len(shards[0][1]) if shards else 0)
+    if pool_size > 1:
+        with ProcessPoolExecutor(max_workers=pool_size) as executor:
+            shard_assignments = list(executor.map(_solve_shard, *zip(*tasks)))
+    else:
+        shard_assignments = [_solve_shard(*task) for task in tasks]
+
+    assignments = [np.empty(0, dtype=student_matcher.ASSIGNMENT_DTYPE)]
+    for (local_positions, incoming_positions), assignment in zip(shards, shard_assignments):
+        assignment['local'] = local_positions[assignment['local']]
+        assignment['incoming'] = incoming_positions[assignment['incoming']]
+        assignments.append(assignment)
+    matched = np.concatenate(assignments)
+
+    # the global pass over the leftovers, against every local student with capacity left
+    leftover = np.setdiff1d(np.arange(len(incoming['age'])), matched['incoming'])
+    residual_capacities = capacities - np.bincount(matched['local'], minlength=len(capacities))
+    open_locals = np.flatnonzero(residual_capacities + extra_capacities > 0)
+    logging.info("Placing %i incoming students left unmatched by their shard with %i local students",
+                 len(leftover), len(open_locals))
+    if len(leftover) and len(open_locals):
+        placed = _solve_shard(
+            _take(local, open_locals), _take(incoming, leftover), plan, faculties.distances,
+            residual_capacities[open_locals], extra_capacities[open_locals], extra_buddy_penalty, solver,
+            enabled_constraints, max_memory)
+        placed['local'] = open_locals[placed['local']]
+        placed['incoming'] = leftover[placed['incoming']]
+        matched = np.concatenate([matched, placed])
+
+    return matched[np.argsort(matched['incoming'], kind='stable')]
@@ -0,0 +1,227 @@
+"""Content-addressed cache of the preparation stages between ingestion and the distance matrix.
+
+Every stage is a deterministic function of the state before it, such as the students frames, and of its
+dependencies, such as config files or the current day. The key of a stage hashes the key of the stage before it,
+its name, its dependencies and the source of the modules the stages run, so the keys of a whole run are known
+before any stage runs. The run then starts after the last stage whose output is cached: a repeated run on the
+same export loads the output of the last stage and goes straight to the distances.
+
+The state after every stage is kept in its own folder, frames as Parquet and values as npz. The least recently
+used folders are removed when the cache grows beyond its size cap.
+"""
+import configparser
+import functools
+import glob
+import hashlib
+import importlib
+import os
+import shutil
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import colorlog as logging
+
+STAGE_CACHE_DIR: str = 'stage_cache'
+
+DEFAULT_MAX_BYTES: int = 256 * 2 ** 20
+
+# The modules whose code the stages run, pipeline included for the stage functions of preparation_stages, a change
+# to any of them invalidates every cached stage
+CODE_MODULES: Tuple[str, ...] = (
+    'pipeline', 'formatter', 'student_filter', 'dates', 'normalization_calculator', 'stage_cache')
+
+# The state passed from stage to stage: frames by name, and dicts of numbers such as the normalization values
+StageState = Dict[str, Union[pd.DataFrame, Dict[str, float]]]
+
+
+@dataclass(frozen=True)
+class Stage:
+    """One deterministic preparation stage.
+
+    Attributes:
+        name (str): The name of the stage, in the cache folders and the hit/miss report.
+        function (Callable[[StageState], StageState]): Computes the state after the stage from the state before it.
+        dependencies (Tuple[Any, ...]): Everything else the output depends on, hashed into the key, see fingerprint.
+    """
+    name: str
+    function: Callable[[StageState], StageState]
+    dependencies: Tuple[Any, ...] = ()
+
+
+def fingerprint(value: Any) -> str:
+    """A hex digest of a stage dependency or state value.
+
+    Frames are hashed by their content, index, columns and dtypes, config parsers by their values and other
+    values by their repr.
+    """
+    digest = hashlib.sha256()
+    if isinstance(value, pd.DataFrame):
+        digest.update(repr([(str(name), str(dtype)) for name, dtype in value.dtypes.items()]).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        digest.update(repr(value.index.dtype).encode())
+    elif isinstance(value, configparser.ConfigParser):
+        digest.update(repr({section: dict(value.items(section)) for section in value.sections()}).encode())
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            digest.update(fingerprint(item).encode())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=str):
+            digest.update(repr(key).encode())
+            digest.update(fingerprint(value[key]).encode())
+    else:
+        digest.update(f'{type(value).__name__}:{value!r}'.encode())
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def code_version() -> str:
+    """A hex digest of the source files of CODE_MODULES."""
+    digest = hashlib.sha256()
+    for name in CODE_MODULES:
+        with open(importlib.import_module(name).__file__, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def stage_keys(stages: List[Stage], state: StageState) -> List[str]:
+    """The key of every stage, chained from the fingerprint of the initial state."""
+    keys = []
+    key = fingerprint(state)
+    for stage in stages:
+        digest = hashlib.sha256(f'{stage.name}:{key}:{code_version()}'.encode())
+        digest.update(fingerprint(stage.dependencies).encode())
+        key = digest.hexdigest()
+        keys.append(key)
+    return keys
+
+
+class StageCache:
+    """The cached states of the stages in one folder, evicted least recently used first.
+
+    Attributes:
+        directory (str): The folder holding one subfolder per cached stage output.
+        max_bytes (int): The most bytes the cache may take on disk.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def entry_path(self, stage: Stage, key: str) -> str:
+        return os.path.join(self.directory, f'{stage.name}_{key[:32]}')
+
+    def load(self, stage: Stage, key: str) -> Optional[StageState]:
+        """The cached state after stage, or None when it is not cached or cannot be read."""
+        path = self.entry_path(stage, key)
+        if not os.path.isdir(path):
+            return None
+
+        state: StageState = {}
+        try:
+            for file_name in sorted(os.listdir(path)):
+                name, extension = os.path.splitext(file_name)
+                if extension == '.parquet':
+                    state[name] = pd.read_parquet(os.path.join(path, file_name))
+                elif extension == '.npz':
+                    with np.load(os.path.join(path, file_name)) as values:
+                        state[name] = {value_name: values[value_name].item() for value_name in values.files}
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable stage cache %s: %s", path, e)
+            return None
+        # the modification time of a folder is when it was last used
+        os.utime(path)
+        return state
+
+    def store(self, stage: Stage, key: str, state: StageState) -> None:
+        """Caches the state after stage, leaving the stage uncached when a value cannot be written."""
+        path = self.entry_path(stage, key)
+        temporary_path = path + '.tmp'
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        os.makedirs(temporary_path)
+        try:
+            for name, value in state.items():
+                if isinstance(value, pd.DataFrame):
+                    value.to_parquet(os.path.join(temporary_path, f'{name}.parquet'))
+                else:
+                    np.savez(os.path.join(temporary_path, f'{name}.npz'), **value)
+        except (ImportError, ValueError, TypeError, OSError) as e:
+            # such as a column mixing numbers and text, which Parquet cannot store
+            logging.warning("Could not cache the output of stage %s: %s", stage.name, e)
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            return
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temporary_path, path)
+
+    def evict(self) -> None:
+        """Removes the least recently used stage outputs until the cache fits in max_bytes."""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*')):
+            if not os.path.isdir(path) or path.endswith('.tmp'):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, file_name)) for file_name in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logging.debug("Evicted stage cache %s", path)
+
+
+def run_stages(
+    stages: List[Stage],
+    state: StageState,
+    cache: Optional[StageCache] = None,
+    metrics=None) -> Tuple[StageState, Dict[str, str]]:
+    """Runs the stages from the last one whose output is cached.
+
+    Args:
+        stages (List[Stage]): The stages, in order.
+        state (StageState): The state before the first stage.
+        cache (Optional[StageCache]): The cache of the stage outputs, None runs every stage without caching.
+        metrics (Optional[instrumentation.Recorder]): Records a span for the cache lookup and every stage that runs.
+
+    Returns:
+        Tuple[StageState, Dict[str, str]]: The state after the last stage, and whether every stage was 'computed',
+        'reused' from the cache or 'skipped' because the output of a later stage was reused.
+    """
+    statuses = {stage.name: 'computed' for stage in stages}
+    start = 0
+    keys: List[str] = []
+    if cache is not None:
+        with _span(metrics, 'stage_cache'):
+            keys = stage_keys(stages, state)
+            for position in reversed(range(len(stages))):
+                cached_state = cache.load(stages[position], keys[position])
+                if cached_state is not None:
+                    state, start = cached_state, position + 1
+                    statuses.update({stage.name: 'skipped' for stage in stages[:position]})
+                    statuses[stages[position].name] = 'reused'
+                    break
+
+    for position in range(start, len(stages)):
+        stage = stages[position]
+        with _span(metrics, stage.name):
+            state = stage.function(state)
+        if cache is not None:
+            os.makedirs(cache.directory, exist_ok=True)
+            cache.store(stage, keys[position], state)
+
+    if cache is not None:
+        cache.evict()
+    return state, statuses
+
+
+def _span(metrics, name: str):
+    return nullcontext() if metrics is None else metrics.span(name)
+
+
+def format_report(statuses: Dict[str, str]) -> str:
+    """The hit/miss report of run_stages, one stage per line."""
+    width = max(len(name) for name in statuses)
+    return '\n'.join(f'{name:<{width}}  {status}' for name, status in statuses.items())
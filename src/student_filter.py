@@ -1,89 +1,136 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-from typing import Optional, Tuple
+from typing import Callable, List, Optional, Tuple
 
-def filter_incoming_student(row: pd.Series, current_date: Optional[datetime] = None) -> str | None:
+# Question in the incoming students form that the disability filter reads
+ACCESSIBILITY_COLUMN: str = 'Do you have any accessibility requirements you would like us to be aware of or need any sort of support?'
+
+# How far ahead of the current date students may arrive or become available
+MAXIMUM_DAYS_AHEAD: int = 90
+
+# A filter rule is the reason it removes students for and a function returning the mask of students to remove
+FilterRule = Tuple[str, Callable[[pd.DataFrame, datetime], np.ndarray]]
+
+
+def _latest_date(current_date: datetime) -> pd.Timestamp:
+    return pd.Timestamp(current_date) + timedelta(days=MAXIMUM_DAYS_AHEAD)
+
+
+def arriving_too_late(students: pd.DataFrame, current_date: datetime) -> np.ndarray:
     """
-    Filters incoming students based on their arrival date and accessibility requirements.
+    Marks incoming students arriving more than MAXIMUM_DAYS_AHEAD days after current_date, or without an arrival date.
 
     Args:
-        row (pd.Series): A row of the incoming students DataFrame.
-        current_date (Optional[datetime]): The current date to compare with. Defaults to None, in which case the current date is used.
+        students (pd.DataFrame): The incoming students DataFrame.
+        current_date (datetime): The current date to compare with.
 
     Returns:
-        str | None: A string indicating the reason for filtering out the student, or None if the student passes the filter.
+        np.ndarray: Boolean mask of the students to remove.
     """
-    date_arriving = pd.to_datetime(row['Arrival'], format='%d/%m/%Y')
+    arrival = pd.to_datetime(students['Arrival'], errors='coerce')
+    return ~(arrival <= _latest_date(current_date)).to_numpy(dtype=bool)
 
-    three_months_from_now = (current_date or datetime.now()) + timedelta(days=90)
 
-    if date_arriving < datetime.now():
-        row.loc['Arrival'] = datetime.today()
-        date_arriving = datetime.today()
+def needs_accessibility_support(students: pd.DataFrame, current_date: datetime) -> np.ndarray:
+    """
+    Marks incoming students that asked for accessibility support, they are matched by hand.
+
+    Args:
+        students (pd.DataFrame): The incoming students DataFrame.
+        current_date (datetime): Unused, part of the rule signature.
 
-    if not date_arriving <= three_months_from_now:
-        return 'Arriving too late'
+    Returns:
+        np.ndarray: Boolean mask of the students to remove.
+    """
+    if ACCESSIBILITY_COLUMN not in students.columns:
+        return np.zeros(len(students), dtype=bool)
+    return (students[ACCESSIBILITY_COLUMN] == 'Yes (please fill in below)').to_numpy(dtype=bool, na_value=False)
 
-    try:
-        disability_status = row[
-            'Do you have any accessibility requirements you would like us to be aware of or need any sort of support?']
 
-        if disability_status == 'Yes (please fill in below)':
-            return 'Incoming student disability'
-    except KeyError:
-        pass
+def availability_not_entered(students: pd.DataFrame, current_date: datetime) -> np.ndarray:
+    """
+    Marks local students whose availability date is missing or could not be parsed.
 
-    return None
+    Args:
+        students (pd.DataFrame): The local students DataFrame.
+        current_date (datetime): Unused, part of the rule signature.
 
+    Returns:
+        np.ndarray: Boolean mask of the students to remove.
+    """
+    return pd.to_datetime(students['Availability'], errors='coerce').isna().to_numpy(dtype=bool)
 
 
-def filter_local_student(row: pd.Series, current_date: Optional[datetime] = None) -> str | None:
+def available_too_late(students: pd.DataFrame, current_date: datetime) -> np.ndarray:
     """
-    Filters local students based on their availability date.
+    Marks local students available more than MAXIMUM_DAYS_AHEAD days after current_date.
 
     Args:
-        row (pd.Series): A row of the local students DataFrame.
-        current_date (Optional[datetime]): The current date to compare with. Defaults to None, in which case the current date is used.
+        students (pd.DataFrame): The local students DataFrame.
+        current_date (datetime): The current date to compare with.
 
     Returns:
-        str | None: A string indicating the reason for filtering out the student, or None if the student passes the filter.
+        np.ndarray: Boolean mask of the students to remove.
     """
+    availability = pd.to_datetime(students['Availability'], errors='coerce')
+    return (availability > _latest_date(current_date)).to_numpy(dtype=bool)
 
-    date_available = pd.to_datetime(
-        row['Availability'],
-        format='%d/%m/%Y')
 
-    three_months_from_now = (current_date or datetime.now()) + timedelta(days=90)
+# Rules in order of precedence, a student removed by several rules gets the reason of the first one
+INCOMING_FILTER_RULES: List[FilterRule] = [
+    ('Arriving too late', arriving_too_late),
+    ('Incoming student disability', needs_accessibility_support),
+]
 
-    if date_available is pd.NaT:
-        return 'Date not entered correctly - reformat and read to input'
+LOCAL_FILTER_RULES: List[FilterRule] = [
+    ('Date not entered correctly - reformat and read to input', availability_not_entered),
+    ('Available too late', available_too_late),
+]
 
-    if date_available < datetime.now():
-        row.loc[
-            'Availability'] = datetime.today()
-        date_available = datetime.today()
 
-    if not date_available <= three_months_from_now:
-        return 'Available too late'
+def filter_reasons(students: pd.DataFrame, rules: List[FilterRule], current_date: datetime) -> pd.Series:
+    """
+    Evaluates every rule as a mask over the whole DataFrame and stores the reason of the first matching rule.
 
-    return None
+    Args:
+        students (pd.DataFrame): The students to filter.
+        rules (List[FilterRule]): The rules in order of precedence.
+        current_date (datetime): The current date, shared by every rule.
 
+    Returns:
+        pd.Series: Categorical reasons indexed like students, missing for students that pass every rule.
+    """
+    codes = np.full(len(students), -1, dtype=np.int8)
+    for code, (_, rule) in enumerate(rules):
+        mask = np.asarray(rule(students, current_date), dtype=bool)
+        codes[(codes < 0) & mask] = code
+
+    reasons = pd.Categorical.from_codes(codes, categories=[reason for reason, _ in rules])
+    return pd.Series(reasons, index=students.index, name='reason')
 
 
-def apply_filters(local_students: pd.DataFrame, incoming_students: pd.DataFrame, current_date: Optional[datetime] = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+def apply_filters(
+    local_students: pd.DataFrame,
+    incoming_students: pd.DataFrame,
+    current_date: Optional[datetime] = None,
+    local_rules: Optional[List[FilterRule]] = None,
+    incoming_rules: Optional[List[FilterRule]] = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
     Applies filters to both local and incoming students DataFrames to separate out students based on certain criteria.
 
     This function performs the following operations:
-    1. Applies the filter_local_student function to each row of the local_students DataFrame.
-    2. Applies the filter_incoming_student function to each row of the incoming_students DataFrame.
-    3. Separates out the rows that do not meet the criteria (filtered out) into separate DataFrames.
-    4. Drops the 'reason' column used for filtering from the remaining DataFrames.
+    1. Evaluates the local rules as masks over the local_students DataFrame.
+    2. Evaluates the incoming rules as masks over the incoming_students DataFrame.
+    3. Separates out the rows that do not meet the criteria (filtered out) into separate DataFrames, with a
+       categorical 'reason' column.
 
     Args:
         local_students (pd.DataFrame): DataFrame containing local students' data.
         incoming_students (pd.DataFrame): DataFrame containing incoming students' data.
         current_date (Optional[datetime]): The current date to use for filtering. Defaults to None, in which case the current date is used.
+        local_rules (Optional[List[FilterRule]]): Rules for the local students. Defaults to LOCAL_FILTER_RULES.
+        incoming_rules (Optional[List[FilterRule]]): Rules for the incoming students. Defaults to INCOMING_FILTER_RULES.
 
     Returns:
         Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
@@ -92,23 +139,20 @@ def apply_filters(local_students: pd.DataFrame, incoming_students: pd.DataFrame,
         - DataFrame of removed local students with reasons.
         - DataFrame of removed incoming students with reasons.
     """
-
-    local_students = local_students.copy()
-    incoming_students = incoming_students.copy()
-
     if current_date is None:
         current_date = datetime.now()
 
-    local_students['reason'] = local_students.apply(lambda row: filter_local_student(row, current_date), axis=1)
-    incoming_students['reason'] = incoming_students.apply(lambda row: filter_incoming_student(row, current_date), axis=1)
+    local_reasons = filter_reasons(local_students, LOCAL_FILTER_RULES if local_rules is None else local_rules, current_date)
+    incoming_reasons = filter_reasons(incoming_students, INCOMING_FILTER_RULES if incoming_rules is None else incoming_rules, current_date)
 
-    removed_local_students: pd.DataFrame = local_students.loc[local_students['reason'].notna()]
-    removed_incoming_students: pd.DataFrame = incoming_students.loc[incoming_students['reason'].notna()]
+    local_removed = local_reasons.notna().to_numpy()
+    incoming_removed = incoming_reasons.notna().to_numpy()
 
-    local_students = local_students.loc[local_students['reason'].isna()]
-    incoming_students = incoming_students.loc[incoming_students['reason'].isna()]
+    removed_local_students: pd.DataFrame = local_students.loc[local_removed].assign(reason=local_reasons.array[local_removed])
+    removed_incoming_students: pd.DataFrame = incoming_students.loc[incoming_removed].assign(
+        reason=incoming_reasons.array[incoming_removed])
 
-    local_students = local_students.drop(columns=['reason'])
-    incoming_students = incoming_students.drop(columns=['reason'])
+    local_students = local_students.loc[~local_removed]
+    incoming_students = incoming_students.loc[~incoming_removed]
 
     return local_students, incoming_students, removed_local_students, removed_incoming_students
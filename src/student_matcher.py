@@ -1,70 +1,329 @@
 import munkres
 import pandas as pd
 import numpy as np
-from pandas.core.groupby.groupby import Union
 import colorlog as logging
-from tqdm import tqdm
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import student_matching_preparation
+import auction_solver
 
-def compute_optimal_pairs(distance_matrix: pd.DataFrame, local_students: pd.DataFrame, incoming_students: pd.DataFrame, base_local_capacity: int, base_incoming_necessity: int) -> pd.DataFrame:
+# A solver takes a (rows x columns) cost matrix and returns the (row, column) positions of a minimum-cost
+# assignment. Rectangular matrices are allowed: every row or every column, whichever is fewer, is assigned.
+Solver = Callable[[np.ndarray], List[Tuple[int, int]]]
+
+
+def solve_with_linear_sum_assignment(cost_matrix: np.ndarray) -> List[Tuple[int, int]]:
     """
-    Computes the optimal pairs of local and incoming students based on a distance matrix.
+    Solves the rectangular assignment problem with SciPy's compiled Jonker-Volgenant solver.
+
+    Parameters:
+    - cost_matrix (np.ndarray): A 2D array of assignment costs.
+
+    Returns:
+    - List[Tuple[int, int]]: The assigned (row, column) positions.
+    """
+    rows, columns = linear_sum_assignment(cost_matrix)
+    return list(zip(rows.tolist(), columns.tolist()))
+
+
+def solve_with_munkres(cost_matrix: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Solves the assignment problem with the pure-Python Munkres implementation.
 
-    This function uses the Munkres algorithm to find the best matches between local students and incoming students
-    while considering the capacity of local students and the necessity of incoming students. The function iteratively
-    adjusts the matching based on the capacities of local students, ensuring that only those who can accommodate the
-    current number of matches are considered.
+    Kept as a reference backend: it pads the matrix to a square and runs in interpreted code, so it is only
+    practical for small cohorts.
 
     Parameters:
-    - distance_matrix (pd.DataFrame): A DataFrame representing the distances between local and incoming students.
-    - local_students (pd.DataFrame): A DataFrame containing information about local students, including their capacities.
-    - incoming_students (pd.DataFrame): A DataFrame containing information about incoming students.
-    - base_local_capacity (int): The base capacity limit for local students.
-    - base_incoming_necessity (int): The base necessity limit for incoming students.
+    - cost_matrix (np.ndarray): A 2D array of assignment costs.
+
+    Returns:
+    - List[Tuple[int, int]]: The assigned (row, column) positions.
+    """
+    m = munkres.Munkres()
+    matrix: munkres.Matrix = cost_matrix.tolist()
+    return m.compute(matrix)
+
+
+SOLVERS: Dict[str, Solver] = {
+    'scipy': solve_with_linear_sum_assignment,
+    'munkres': solve_with_munkres,
+    'auction': auction_solver.solve_with_auction,
+}
+
+DEFAULT_SOLVER: str = 'scipy'
+
+# Added to the distance of a pair when the local student takes the incoming student as an extra buddy
+DEFAULT_EXTRA_BUDDY_PENALTY: float = 2.0
+
+# One matched pair: the row positions of both students and the pair's distance
+ASSIGNMENT_DTYPE: np.dtype = np.dtype([('local', np.int64), ('incoming', np.int64), ('cost', np.float64)])
+
+# Above this fraction of feasible pairs the assignment is solved on a dense matrix instead of a sparse graph
+SPARSE_DENSITY_THRESHOLD: float = 0.5
+
+
+def get_solver(name: Union[str, Solver]) -> Solver:
+    """Looks up an assignment solver by name, raising a ValueError that lists the available backends.
+
+    A Solver passed instead of a name, such as a configured auction_solver.make_auction_solver, is returned as is.
+    """
+    if callable(name):
+        return name
+    try:
+        return SOLVERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown solver '{name}'. Available solvers: {', '.join(SOLVERS)}") from None
+
+
+def expand_capacity_slots(capacities: np.ndarray, extra_capacities: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Expands the capacity of every local student into individual slots that can each hold one incoming student.
+
+    Only index arrays are created, no student rows are duplicated.
+
+    Parameters:
+    - capacities (np.ndarray): The regular capacity of each local student.
+    - extra_capacities (Optional[np.ndarray]): The optional overflow capacity of each local student.
+
+    Returns:
+    - Tuple[np.ndarray, np.ndarray]: The local student position owning each slot, and whether the slot is overflow capacity.
+    """
+    capacities = np.clip(np.asarray(capacities, dtype=np.int64), 0, None)
+    if extra_capacities is None:
+        extra_capacities = np.zeros_like(capacities)
+    extra_capacities = np.clip(np.asarray(extra_capacities, dtype=np.int64), 0, None)
+
+    local_positions = np.arange(len(capacities))
+    slot_owners = np.concatenate([np.repeat(local_positions, capacities), np.repeat(local_positions, extra_capacities)])
+    slot_is_extra = np.concatenate([np.zeros(capacities.sum(), dtype=bool), np.ones(extra_capacities.sum(), dtype=bool)])
+    return slot_owners, slot_is_extra
+
+
+def _unmatched_cost(slot_costs: np.ndarray, rows: int) -> float:
+    """
+    A cost above any assignment of real pairs, so leaving a student unmatched is only chosen when no feasible
+    assignment reaches them. slot_costs are the (shifted) costs of the feasible pairs.
+    """
+    largest = float(slot_costs.max()) if slot_costs.size else 0.0
+    return (abs(largest) + 1.0) * (rows + 1)
+
+
+def solve_sparse_slot_assignment(
+    cost_matrix: np.ndarray,
+    feasible: np.ndarray,
+    slot_owners: np.ndarray,
+    slot_is_extra: np.ndarray,
+    extra_buddy_penalty: float) -> np.ndarray:
+    """
+    Assigns incoming students to capacity slots over the feasible pairs only, with SciPy's sparse bipartite matcher.
+
+    The graph has one edge per feasible (incoming student, slot) pair, plus one dummy slot per incoming student
+    that stands for leaving the student unmatched. The dummy slots guarantee a full matching exists, and their
+    cost makes every student that can be matched get matched. All costs are shifted by 1 because the matcher does
+    not keep edges of weight 0, the shift is the same for every row and does not change the optimum.
+
+    Parameters:
+    - cost_matrix (np.ndarray): The (local x incoming) distance matrix.
+    - feasible (np.ndarray): The (local x incoming) boolean mask of the pairs that may be matched.
+    - slot_owners (np.ndarray): The local student position owning each slot.
+    - slot_is_extra (np.ndarray): Whether each slot is overflow capacity.
+    - extra_buddy_penalty (float): The extra cost of assigning a student to an overflow slot.
+
+    Returns:
+    - np.ndarray: The (incoming position, slot) pairs of the matched students, in incoming order.
+    """
+    incoming_count = cost_matrix.shape[1]
+    slot_count = len(slot_owners)
+
+    # slots grouped by owner, so the slots of local student l are slot_order[slot_starts[l]:slot_starts[l + 1]]
+    slot_order = np.argsort(slot_owners, kind='stable')
+    slot_counts = np.bincount(slot_owners, minlength=cost_matrix.shape[0])
+    slot_starts = np.concatenate([[0], np.cumsum(slot_counts)[:-1]])
+
+    pair_locals, pair_incomings = np.nonzero(feasible)
+    repeats = slot_counts[pair_locals]
+    edge_locals = np.repeat(pair_locals, repeats)
+    edge_rows = np.repeat(pair_incomings, repeats)
+    offsets = np.arange(len(edge_rows)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    edge_slots = slot_order[slot_starts[edge_locals] + offsets]
+    edge_costs = cost_matrix[edge_locals, edge_rows] + extra_buddy_penalty * slot_is_extra[edge_slots] + 1.0
+
+    unmatched_cost = _unmatched_cost(edge_costs, incoming_count)
+    rows = np.concatenate([edge_rows, np.arange(incoming_count)])
+    columns = np.concatenate([edge_slots, slot_count + np.arange(incoming_count)])
+    weights = np.concatenate([edge_costs, np.full(incoming_count, unmatched_cost)])
+    graph = csr_matrix((weights, (rows, columns)), shape=(incoming_count, slot_count + incoming_count))
+
+    logging.info("Solving a sparse assignment over %i of %i student pairs", len(pair_locals), feasible.size)
+    matched_rows, matched_slots = min_weight_full_bipartite_matching(graph)
+    pairs = np.column_stack([matched_rows, matched_slots]).astype(np.int64)
+    pairs = pairs[pairs[:, 1] < slot_count]
+    return pairs[np.argsort(pairs[:, 0], kind='stable')]
+
+
+def solve_capacitated_assignment(
+    cost_matrix: np.ndarray,
+    capacities: np.ndarray,
+    extra_capacities: Optional[np.ndarray] = None,
+    extra_buddy_penalty: float = 0.0,
+    solver: Union[str, Solver] = DEFAULT_SOLVER,
+    infeasible: Optional[np.ndarray] = None,
+    pinned: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Assigns incoming students to local students in a single solve, honouring every local student's capacity.
+
+    This is the min-cost flow in which every local student supplies its capacity, every incoming student demands
+    one match and every edge costs the pair's distance. Because all demands are 1, the flow decomposes into an
+    assignment of incoming students (rows) to capacity slots (columns), which is solved once with the selected
+    rectangular assignment solver. Overflow slots cost the pair's distance plus extra_buddy_penalty, so they are
+    only used where regular capacity runs out or is much worse.
+
+    Pairs marked infeasible are never matched, an incoming student without a feasible slot is left unmatched.
+    When at most SPARSE_DENSITY_THRESHOLD of the pairs are feasible, the assignment is solved by
+    solve_sparse_slot_assignment on the feasible pairs only; otherwise the infeasible pairs get a prohibitive cost
+    in the dense matrix and are dropped from the result.
+
+    Pinned pairs are kept as they are: they use up capacity of their local students (regular slots first) and
+    only the other incoming students are assigned.
+
+    Parameters:
+    - cost_matrix (np.ndarray): The (local x incoming) distance matrix, float32 or float64. The dense path gathers an
+      (incoming x slot) copy of it, which linear_sum_assignment converts to float64.
+    - capacities (np.ndarray): The regular capacity of each local student.
+    - extra_capacities (Optional[np.ndarray]): The optional overflow capacity of each local student.
+    - extra_buddy_penalty (float): The extra cost of assigning a student to an overflow slot.
+    - solver (Union[str, Solver]): The assignment solver or its name in SOLVERS, used for dense matrices. A
+      warning is logged when a non-default solver is bypassed by the sparse path.
+    - infeasible (Optional[np.ndarray]): The (local x incoming) boolean mask of the pairs that may not be matched.
+    - pinned (Optional[np.ndarray]): Pairs that must be kept, as an ASSIGNMENT_DTYPE array of positions.
 
     Returns:
-    - pd.DataFrame: A DataFrame indicating the matching between local and incoming students, where 1 indicates a match.
+    - np.ndarray: The matched pairs as an ASSIGNMENT_DTYPE array, in incoming order. The cost of a pair is its
+      distance, without the extra buddy penalty.
     """
+    cost_matrix = np.asarray(cost_matrix)
+    if cost_matrix.dtype not in (np.float32, np.float64):
+        cost_matrix = cost_matrix.astype(np.float64)
+    if pinned is not None and len(pinned):
+        return _solve_around_pinned_pairs(cost_matrix, capacities, extra_capacities, extra_buddy_penalty, solver, infeasible, pinned)
+
+    solve = get_solver(solver)
+    slot_owners, slot_is_extra = expand_capacity_slots(capacities, extra_capacities)
+
+    if len(slot_owners) == 0 or cost_matrix.shape[1] == 0:
+        return np.empty(0, dtype=ASSIGNMENT_DTYPE)
 
-    print(distance_matrix)
-    local_students = local_students.copy()
-    incoming_students = incoming_students.copy()
+    if infeasible is not None and not infeasible.any():
+        infeasible = None
 
-    matching_matrix: pd.DataFrame = pd.DataFrame(np.zeros((len(local_students), len(incoming_students))), index=local_students.index, columns=incoming_students.index)
-    # Get the highest capacity local student
-    highest_capacity: int = int(local_students['Capacity'].max())
-    print(highest_capacity)
+    if infeasible is not None and 1.0 - infeasible.mean() <= SPARSE_DENSITY_THRESHOLD:
+        if solve is not SOLVERS[DEFAULT_SOLVER]:
+            logging.warning("At most %.0f%% of the student pairs are feasible, the sparse solver is used instead of the "
+                            "selected solver", SPARSE_DENSITY_THRESHOLD * 100)
+        pairs = solve_sparse_slot_assignment(cost_matrix, ~infeasible, slot_owners, slot_is_extra, extra_buddy_penalty)
+    else:
+        slot_costs = cost_matrix.T[:, slot_owners]
+        slot_costs[:, slot_is_extra] += extra_buddy_penalty
+        if infeasible is not None:
+            slot_infeasible = infeasible.T[:, slot_owners]
+            slot_costs[slot_infeasible] = _unmatched_cost(slot_costs[~slot_infeasible], slot_costs.shape[0])
 
-    # Keep track of the matched incoming students
-    matched_incoming_students = set()
+        pairs = np.array(solve(slot_costs), dtype=np.int64).reshape(-1, 2)
+        pairs = pairs[np.argsort(pairs[:, 0], kind='stable')]
+        if infeasible is not None:
+            pairs = pairs[~infeasible[slot_owners[pairs[:, 1]], pairs[:, 0]]]
 
-    for i in range(highest_capacity):
-        # Remove local students who do not have enough capacity for i matches
-        # TODO: issue with the indexes because of drops prior to this
-        for index, row in local_students.iterrows():
-            if row['Capacity'] < i:
-                distance_matrix = distance_matrix.drop(index)
-                # Remove them from the local students dataframe (to keep indexes in sync)
-                local_students = local_students.drop(index)
+    assignment = np.empty(len(pairs), dtype=ASSIGNMENT_DTYPE)
+    assignment['local'] = slot_owners[pairs[:, 1]]
+    assignment['incoming'] = pairs[:, 0]
+    assignment['cost'] = cost_matrix[assignment['local'], assignment['incoming']]
+    return assignment
 
-        # Filter distance_matrix to exclude matched incoming students
-        distance_matrix_filtered = distance_matrix.loc[:, ~distance_matrix.columns.isin(matched_incoming_students)]
-        print(distance_matrix_filtered)
 
-        # Only proceed if there are local students and incoming students to match
-        if not local_students.empty and not distance_matrix_filtered.empty:
-            m = munkres.Munkres()
+def _solve_around_pinned_pairs(
+    cost_matrix: np.ndarray,
+    capacities: np.ndarray,
+    extra_capacities: Optional[np.ndarray],
+    extra_buddy_penalty: float,
+    solver: Union[str, Solver],
+    infeasible: Optional[np.ndarray],
+    pinned: np.ndarray) -> np.ndarray:
+    """Solves the incoming students outside pinned over the capacity the pinned pairs leave, see solve_capacitated_assignment."""
+    capacities = np.clip(np.asarray(capacities, dtype=np.int64), 0, None)
+    extra_capacities = np.zeros_like(capacities) if extra_capacities is None else np.clip(np.asarray(extra_capacities, dtype=np.int64), 0, None)
 
-            # Convert the filtered DataFrame to matrix format
-            matrix: munkres.Matrix = distance_matrix_filtered.values.tolist()
+    used = np.bincount(pinned['local'], minlength=len(capacities))
+    regular_used = np.minimum(used, capacities)
+    free = np.setdiff1d(np.arange(cost_matrix.shape[1]), pinned['incoming'])
 
-            # Apply the algorithm to the matrix
-            indexes = m.compute(matrix)
+    residual = solve_capacitated_assignment(
+        cost_matrix[:, free],
+        capacities - regular_used,
+        np.clip(extra_capacities - (used - regular_used), 0, None),
+        extra_buddy_penalty,
+        solver,
+        None if infeasible is None else infeasible[:, free])
+    residual['incoming'] = free[residual['incoming']]
+
+    kept = np.empty(len(pinned), dtype=ASSIGNMENT_DTYPE)
+    kept['local'] = pinned['local']
+    kept['incoming'] = pinned['incoming']
+    kept['cost'] = cost_matrix[pinned['local'], pinned['incoming']]
+
+    assignment = np.concatenate([kept, residual])
+    return assignment[np.argsort(assignment['incoming'], kind='stable')]
+
+
+def local_capacities(local_students: pd.DataFrame, base_local_capacity: int, base_incoming_necessity: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the regular capacity of every local student, from its 'Capacity' answer, and its overflow capacity.
+
+    Local students who answered 'Yes' to ExtraBuddy get one overflow slot when the base local capacity is below
+    the base incoming necessity, see student_matching_preparation.get_extra_capacities.
+    """
+    capacities = pd.to_numeric(local_students['Capacity'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+    extra_capacities = student_matching_preparation.get_extra_capacities(base_local_capacity, base_incoming_necessity, local_students)
+    return capacities, extra_capacities
+
+
+def compute_optimal_pairs(distance_matrix: Union[pd.DataFrame, np.ndarray], local_students: pd.DataFrame, incoming_students: pd.DataFrame, base_local_capacity: int, base_incoming_necessity: int, solver: Union[str, Solver] = DEFAULT_SOLVER, extra_buddy_penalty: float = DEFAULT_EXTRA_BUDDY_PENALTY, infeasible: Optional[np.ndarray] = None, pinned: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Computes the optimal pairs of local and incoming students based on a distance matrix.
+
+    The whole problem is solved in one pass by solve_capacitated_assignment: every local student can take up to
+    their 'Capacity' incoming students, and when the base local capacity is below the base incoming necessity the
+    local students who answered 'Yes' to ExtraBuddy get one extra, more expensive slot.
+
+    Parameters:
+    - distance_matrix (Union[pd.DataFrame, np.ndarray]): The distances between local and incoming students, in row order of the students.
+    - local_students (pd.DataFrame): A DataFrame containing information about local students, including their capacities.
+    - incoming_students (pd.DataFrame): A DataFrame containing information about incoming students.
+    - base_local_capacity (int): The base capacity limit for local students.
+    - base_incoming_necessity (int): The base necessity limit for incoming students.
+    - solver (Union[str, Solver]): The assignment solver or its name in SOLVERS. Defaults to the compiled SciPy solver.
+    - extra_buddy_penalty (float): The extra cost of matching a student to a local student's overflow slot.
+    - infeasible (Optional[np.ndarray]): The (local x incoming) boolean mask of the pairs ruled out by constraints.
+    - pinned (Optional[np.ndarray]): Confirmed pairs that are kept, as an ASSIGNMENT_DTYPE array of positions.
+
+    Returns:
+    - np.ndarray: The matched pairs as an ASSIGNMENT_DTYPE array of (local position, incoming position, distance),
+      so the result grows with the number of pairs rather than with L x I.
+    """
 
-            logging.info(indexes)
-            logging.info("Creating pair set %i", i)
+    capacities, extra_capacities = local_capacities(local_students, base_local_capacity, base_incoming_necessity)
 
-            for row, column in indexes:
-                matching_matrix.iloc[row, column] = 1
-                matched_incoming_students.add(distance_matrix_filtered.columns[column])  # Add matched incoming student to the set
-    return matching_matrix
+    assignment = solve_capacitated_assignment(
+        np.asarray(distance_matrix),
+        capacities,
+        extra_capacities,
+        extra_buddy_penalty,
+        solver,
+        infeasible,
+        pinned)
+    unmatched = len(incoming_students) - len(assignment)
+    if unmatched > 0:
+        logging.warning("%i incoming students could not be matched", unmatched)
+    logging.info("Matched %i incoming students using %i extra buddy slots", len(assignment), int(extra_capacities.sum()))
+    return assignment
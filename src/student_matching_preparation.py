@@ -82,6 +82,27 @@ def handle_extra_buddies(base_local_capacity: int, base_necessity: int, local_st
     return message, local_students_copy
 
 
+def get_extra_capacities(base_local_capacity: int, base_necessity: int, local_students: pd.DataFrame) -> np.ndarray:
+    """
+    Returns the optional overflow capacity of each local student, without duplicating any rows.
+
+    Mirrors handle_extra_buddies: when the base local capacity cannot cover the incoming students, every local
+    student who answered 'Yes' to ExtraBuddy can take one extra student, otherwise nobody gets extra capacity.
+
+    Parameters:
+    base_local_capacity (int): The summed capacity of the local students.
+    base_necessity (int): The number of incoming students.
+    local_students (pd.DataFrame): The local students, in the row order of the distance matrix.
+
+    Returns:
+    np.ndarray: The number of extra students each local student can take (0 or 1).
+    """
+    if base_local_capacity >= base_necessity or 'ExtraBuddy' not in local_students.columns:
+        return np.zeros(len(local_students), dtype=np.int64)
+
+    return (local_students['ExtraBuddy'] == 'Yes').to_numpy(dtype=np.int64)
+
+
 def _prepare_for_one_to_one_matching(self):
     self.add_matches_column()
     self.add_id_and_adjust_capacity()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""Generates synthetic local_students.csv and incoming_students.csv files for testing and benchmarking.
+
+The files use the raw column names of the registration forms, as listed in the column rename and irrelevant
+column files in the config folder, so they go through the whole pipeline like a real export. No real student
+data is involved.
+"""
+import argparse
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import colorlog as logging
+
+import formatter
+from scoring_plan import LOCAL_EXPECTATIONS, INCOMING_EXPECTATIONS
+from student_filter import ACCESSIBILITY_COLUMN
+
+FIRST_NAMES: Tuple[str, ...] = ('Anna', 'Bram', 'Chloe', 'Daan', 'Elena', 'Finn', 'Giulia', 'Hugo', 'Ines', 'Jonas',
+                                'Kasia', 'Lucas', 'Maria', 'Noah', 'Olga', 'Pablo', 'Sofia', 'Tim', 'Yara', 'Zoe')
+LAST_NAMES: Tuple[str, ...] = ('de Vries', 'Jansen', 'Bakker', 'Visser', 'Smit', 'Garcia', 'Rossi', 'Novak',
+                               'Kowalski', 'Schmidt', 'Dubois', 'Silva', 'Nielsen', 'Popescu', 'Horvath')
+INCOMING_COUNTRIES: Tuple[str, ...] = ('Germany', 'Spain', 'Italy', 'France', 'Poland', 'Greece', 'Portugal',
+                                       'Turkey', 'China', 'United States', 'Brazil', 'India')
+UNIVERSITIES: Tuple[str, ...] = ('University of Groningen', 'Hanze University of Applied Sciences')
+GENDERS: Tuple[str, ...] = ('Female', 'Male', 'Non-binary')
+HOBBY_OPTIONS: Tuple[str, ...] = ('Not interested', 'Interests me a little', 'Very interested')
+FREQUENCY_OPTIONS: Tuple[str, ...] = ('One time only', 'Once a month', 'Twice a month', 'Once a week or more')
+
+DATE_FORMAT: str = '%d/%m/%Y'
+TIMESTAMP_FORMAT: str = '%Y/%m/%d %H:%M:%S'
+
+
+def _choice(rng: np.random.Generator, options: Sequence[str], count: int, p: Optional[Sequence[float]] = None) -> np.ndarray:
+    return np.asarray(options, dtype=object)[rng.choice(len(options), size=count, p=p)]
+
+
+def _format_dates(current_date: datetime, offsets: np.ndarray) -> np.ndarray:
+    """The dates offsets days from current_date, formatted like the form exports."""
+    days = pd.to_timedelta(offsets, unit='D')
+    return (pd.Timestamp(current_date).normalize() + days).strftime(DATE_FORMAT).to_numpy(dtype=object)
+
+
+def _dates(rng: np.random.Generator, current_date: datetime, low: int, high: int, count: int) -> np.ndarray:
+    """Dates between low and high days from current_date, formatted like the form exports."""
+    return _format_dates(current_date, rng.integers(low, high + 1, size=count))
+
+
+def _expectations(rng: np.random.Generator, vocabulary: Sequence[str], count: int) -> np.ndarray:
+    """Comma separated answers to the expectations checkbox question, each with at least one option ticked."""
+    ticked = rng.random((count, len(vocabulary))) < 0.5
+    ticked[np.arange(count), rng.integers(0, len(vocabulary), size=count)] = True
+    return np.array([', '.join(option for option, tick in zip(vocabulary, row) if tick) for row in ticked], dtype=object)
+
+
+def _common_columns(
+    rng: np.random.Generator,
+    count: int,
+    faculties: Sequence[str],
+    hobbies: Sequence[str],
+    key_offset: int) -> Dict[str, np.ndarray]:
+    """The answers both forms share, under their renamed column names."""
+    first_names = _choice(rng, FIRST_NAMES, count)
+    last_names = _choice(rng, LAST_NAMES, count)
+    emails = [f"{first.lower()}.{last.replace(' ', '').lower()}.{key_offset + i}@example.com"
+              for i, (first, last) in enumerate(zip(first_names, last_names))]
+
+    columns = {
+        'FirstName': first_names,
+        'LastName': last_names,
+        'Email': np.array(emails, dtype=object),
+        'PhoneNumber': np.array([f'06{number:08d}' for number in rng.integers(0, 10 ** 8, size=count)], dtype=object),
+        'Gender': _choice(rng, GENDERS, count, p=[0.55, 0.42, 0.03]),
+        'University': _choice(rng, UNIVERSITIES, count, p=[0.7, 0.3]),
+        'Faculty': _choice(rng, faculties, count),
+        'MeetFrequency': _choice(rng, FREQUENCY_OPTIONS, count, p=[0.1, 0.3, 0.35, 0.25]),
+        'Remarks': np.where(rng.random(count) < 0.9, '', 'Looking forward to it!').astype(object),
+    }
+    # every student has a few strong interests, the rest mostly lukewarm
+    for hobby in hobbies:
+        columns[hobby] = _choice(rng, HOBBY_OPTIONS, count, p=[0.35, 0.4, 0.25])
+    return columns
+
+
+def generate_local_students(
+    rng: np.random.Generator,
+    count: int,
+    faculties: Sequence[str],
+    hobbies: Sequence[str],
+    current_date: datetime) -> Dict[str, np.ndarray]:
+    """The answers of count local students, under their renamed column names.
+
+    Args:
+        rng (np.random.Generator): The random generator.
+        count (int): The number of local students.
+        faculties (Sequence[str]): The faculties of faculty_distances.xlsx.
+        hobbies (Sequence[str]): The hobbies of hobbies.csv.
+        current_date (datetime): The date the availability dates are drawn around.
+
+    Returns:
+        Dict[str, np.ndarray]: The generated columns.
+    """
+    columns = _common_columns(rng, count, faculties, hobbies, key_offset=0)
+    # students can answer questions from home before they can meet in person
+    text_offsets = rng.integers(-30, 46, size=count)
+    meeting_offsets = text_offsets + rng.integers(0, 22, size=count)
+    columns.update({
+        'Age': np.clip(np.rint(rng.normal(22, 2, size=count)), 17, 35).astype(int),
+        'Country': _choice(rng, ('Netherlands', 'Germany', 'Belgium'), count, p=[0.85, 0.1, 0.05]),
+        'Capacity': rng.choice([1, 2, 3], size=count, p=[0.5, 0.35, 0.15]),
+        'AvailabilityText': _format_dates(current_date, text_offsets),
+        'Availability': _format_dates(current_date, meeting_offsets),
+        'Expectations': _expectations(rng, LOCAL_EXPECTATIONS, count),
+        'GenderPreference': _choice(rng, ('Mix/No preference', 'Female', 'Male'), count, p=[0.8, 0.12, 0.08]),
+        'ExtraBuddy': _choice(rng, ('Yes', 'No'), count, p=[0.4, 0.6]),
+    })
+    return columns
+
+
+def generate_incoming_students(
+    rng: np.random.Generator,
+    count: int,
+    faculties: Sequence[str],
+    hobbies: Sequence[str],
+    current_date: datetime) -> Dict[str, np.ndarray]:
+    """The answers of count incoming students, under their renamed column names.
+
+    About 2% are mature students, so the age outlier scenarios have something to find, and about 5% arrive
+    too late or ask for accessibility support, so the filters remove some students.
+
+    Args:
+        rng (np.random.Generator): The random generator.
+        count (int): The number of incoming students.
+        faculties (Sequence[str]): The faculties of faculty_distances.xlsx.
+        hobbies (Sequence[str]): The hobbies of hobbies.csv.
+        current_date (datetime): The date the arrival dates are drawn around.
+
+    Returns:
+        Dict[str, np.ndarray]: The generated columns.
+    """
+    columns = _common_columns(rng, count, faculties, hobbies, key_offset=10 ** 7)
+    ages = np.clip(np.rint(rng.normal(22, 2.5, size=count)), 17, 35)
+    mature = rng.random(count) < 0.02
+    ages[mature] = rng.integers(30, 46, size=int(mature.sum()))
+    columns.update({
+        'Age': ages.astype(int),
+        'Country': _choice(rng, INCOMING_COUNTRIES, count),
+        'Arrival': _dates(rng, current_date, -5, 95, count),
+        'Expectations': _expectations(rng, INCOMING_EXPECTATIONS, count),
+        'GenderPreference': _choice(rng, ('No preference', 'Female', 'Male'), count, p=[0.75, 0.17, 0.08]),
+        'Preferences': np.where(rng.random(count) < 0.8, '', 'Someone who likes hiking').astype(object),
+        ACCESSIBILITY_COLUMN: _choice(rng, ('No', 'Yes (please fill in below)'), count, p=[0.97, 0.03]),
+    })
+    return columns
+
+
+def to_form_export(
+    rng: np.random.Generator,
+    columns: Dict[str, np.ndarray],
+    column_mapping: Dict[str, str],
+    irrelevant_columns: List[str],
+    current_date: datetime) -> pd.DataFrame:
+    """Lays the generated answers out like a form export: timestamp, irrelevant questions, then the raw column names.
+
+    Args:
+        rng (np.random.Generator): The random generator.
+        columns (Dict[str, np.ndarray]): The generated columns under their renamed names.
+        column_mapping (Dict[str, str]): Mapping of old column names to new column names.
+        irrelevant_columns (List[str]): The questions listed in the irrelevant columns file.
+        current_date (datetime): Registrations are timestamped in the 60 days before current_date.
+
+    Returns:
+        pd.DataFrame: The export, with the raw column names.
+    """
+    count = len(next(iter(columns.values())))
+    seconds = rng.integers(0, 60 * 24 * 3600, size=count)
+    timestamps = pd.Timestamp(current_date) - pd.to_timedelta(np.sort(seconds)[::-1], unit='s')
+
+    export = {'Timestamp': timestamps.strftime(TIMESTAMP_FORMAT).to_numpy(dtype=object)}
+    for question in irrelevant_columns:
+        if question != 'Timestamp':
+            export[question] = np.full(count, 'Yes', dtype=object)
+    original_names = {new: old for old, new in column_mapping.items()}
+    for name, values in columns.items():
+        export[original_names.get(name, name)] = values
+    return pd.DataFrame(export)
+
+
+def generate_cohort(
+    local_count: int,
+    incoming_count: int,
+    config_dir: str = 'config',
+    seed: int = 0,
+    current_date: Optional[datetime] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Generates the form exports of a synthetic cohort.
+
+    Args:
+        local_count (int): The number of local students.
+        incoming_count (int): The number of incoming students.
+        config_dir (str): The config folder holding the rename, irrelevant column, hobby and faculty files.
+        seed (int): Seed of the random generator, the same seed gives the same cohort on the same date.
+        current_date (Optional[datetime]): The date the dates are drawn around. Defaults to now.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: The local and incoming students exports.
+    """
+    if current_date is None:
+        current_date = datetime.now()
+    rng = np.random.default_rng(seed)
+
+    hobbies: List[str] = pd.read_csv(os.path.join(config_dir, 'hobbies.csv'), quotechar="'").iloc[:, 0].tolist()
+    faculties: List[str] = pd.read_excel(os.path.join(config_dir, 'faculty_distances.xlsx'), index_col=0).index.astype(str).tolist()
+
+    exports = []
+    for side, count, generate in (('local', local_count, generate_local_students),
+                                  ('incoming', incoming_count, generate_incoming_students)):
+        column_mapping = formatter.read_column_mapping(os.path.join(config_dir, f'{side}_students_column_renames.csv'))
+        irrelevant_columns = pd.read_csv(
+            os.path.join(config_dir, f'{side}_students_irrelevant_columns.csv'), quotechar="'").iloc[:, 0].tolist()
+        columns = generate(rng, count, faculties, hobbies, current_date)
+        exports.append(to_form_export(rng, columns, column_mapping, irrelevant_columns, current_date))
+
+    local_students, incoming_students = exports
+    return local_students, incoming_students
+
+
+def write_cohort(local_students: pd.DataFrame, incoming_students: pd.DataFrame, directory: str) -> Tuple[str, str]:
+    """Writes the exports as local_students.csv and incoming_students.csv in directory and returns their paths."""
+    os.makedirs(directory, exist_ok=True)
+    local_path = os.path.join(directory, 'local_students.csv')
+    incoming_path = os.path.join(directory, 'incoming_students.csv')
+    local_students.to_csv(local_path, index=False)
+    incoming_students.to_csv(incoming_path, index=False)
+    return local_path, incoming_path
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Generate a synthetic cohort of local and incoming students.')
+    parser.add_argument('--local', type=int, default=400, help='number of local students (default: %(default)s)')
+    parser.add_argument('--incoming', type=int, default=500, help='number of incoming students (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random generator (default: %(default)s)')
+    parser.add_argument('--config-dir', default='config', help='folder holding the configuration files (default: %(default)s)')
+    parser.add_argument('--output-dir', default='input', help='folder the CSV files are written to (default: %(default)s)')
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    logging.basicConfig(level=logging.INFO)
+
+    local_students, incoming_students = generate_cohort(
+        arguments.local, arguments.incoming, arguments.config_dir, arguments.seed)
+    local_path, incoming_path = write_cohort(local_students, incoming_students, arguments.output_dir)
+    logging.info("Wrote %i local students to %s and %i incoming students to %s",
+                 len(local_students), local_path, len(incoming_students), incoming_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Checks the input and configuration files before a matching run.
+
+Only the standard library is used, so `main.py validate` starts without loading pandas, NumPy or SciPy.
+"""
+import configparser
+import csv
+import os
+from typing import Dict, List
+
+# Files main.py match reads from the config folder
+CONFIG_FILES: tuple = (
+    'config.ini',
+    'hobbies.csv',
+    'faculty_distances.xlsx',
+    'matching_columns.csv',
+    'local_students_column_renames.csv',
+    'incoming_students_column_renames.csv',
+    'local_students_irrelevant_columns.csv',
+    'incoming_students_irrelevant_columns.csv',
+)
+
+# Sections of config.ini whose values must all be numbers
+NUMERIC_SECTIONS: tuple = ('parameters', 'normalization', 'hobbies')
+
+
+def clean_column_name(name: str) -> str:
+    """Replaces double single quotes with double quotes and strips whitespace, like the headers are cleaned in main."""
+    return str(name).replace("''", '"').strip()
+
+
+def _read_quoted_rows(path: str) -> List[List[str]]:
+    """Reads one of the single-quoted config CSV files, without its header row."""
+    with open(path, newline='') as file:
+        rows = list(csv.reader(file, quotechar="'", skipinitialspace=True))
+    return [[value.strip() for value in row] for row in rows[1:] if any(value.strip() for value in row)]
+
+
+def read_column_renames(path: str) -> Dict[str, str]:
+    """Reads a column rename file as a mapping of old column names to new column names."""
+    return {row[0]: row[1] for row in _read_quoted_rows(path) if len(row) >= 2}
+
+
+def read_header(path: str) -> List[str]:
+    """Reads the cleaned column names of a CSV file, without reading its rows."""
+    with open(path, newline='') as file:
+        return [clean_column_name(name) for name in next(csv.reader(file), [])]
+
+
+def validate_config(config_dir: str) -> List[str]:
+    """Checks that every config file exists and that config.ini and hobbies.csv agree.
+
+    Args:
+        config_dir (str): The config folder.
+
+    Returns:
+        List[str]: A description of every problem found, empty when the configuration is usable.
+    """
+    problems = [f"Missing config file {os.path.join(config_dir, name)}"
+                for name in CONFIG_FILES if not os.path.exists(os.path.join(config_dir, name))]
+    config_path = os.path.join(config_dir, 'config.ini')
+    if not os.path.exists(config_path):
+        return problems
+
+    config = configparser.ConfigParser()
+    try:
+        config.read(config_path)
+    except configparser.Error as e:
+        return problems + [f"{config_path} cannot be parsed: {e}"]
+
+    for section in NUMERIC_SECTIONS:
+        if not config.has_section(section):
+            problems.append(f"{config_path} has no [{section}] section")
+            continue
+        for key, value in config.items(section):
+            try:
+                float(value)
+            except ValueError:
+                problems.append(f"{config_path} [{section}] {key} = {value!r} is not a number")
+
+    hobbies_path = os.path.join(config_dir, 'hobbies.csv')
+    if os.path.exists(hobbies_path) and config.has_section('hobbies'):
+        for row in _read_quoted_rows(hobbies_path):
+            if not config.has_option('hobbies', row[0]):
+                problems.append(f"Hobby {row[0]!r} from {hobbies_path} has no weight in the [hobbies] section of {config_path}")
+    return problems
+
+
+def validate_students_file(path: str, rename_path: str) -> List[str]:
+    """Checks that a students file exists and has every column its rename file maps.
+
+    Args:
+        path (str): The students CSV file.
+        rename_path (str): The column rename file of the same students.
+
+    Returns:
+        List[str]: A description of every problem found.
+    """
+    if not os.path.exists(path):
+        return [f"Missing input file {path}"]
+    if not os.path.exists(rename_path):
+        return []
+
+    header = set(read_header(path))
+    return [f"{path} has no column {old_name!r} (renamed to {new_name!r})"
+            for old_name, new_name in read_column_renames(rename_path).items()
+            if clean_column_name(old_name) not in header]
+
+
+def validate(input_dir: str, config_dir: str) -> List[str]:
+    """Checks the config folder and both students files.
+
+    Args:
+        input_dir (str): The folder holding local_students.csv and incoming_students.csv.
+        config_dir (str): The config folder.
+
+    Returns:
+        List[str]: A description of every problem found, empty when a matching run can start.
+    """
+    problems = validate_config(config_dir)
+    for side in ('local', 'incoming'):
+        problems += validate_students_file(
+            os.path.join(input_dir, f'{side}_students.csv'),
+            os.path.join(config_dir, f'{side}_students_column_renames.csv'))
+    return problems
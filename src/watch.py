@@ -0,0 +1,149 @@
+"""Watch mode of `main.py match --watch`: matches again whenever a file in the input or config folder is saved.
+
+Every change starts a full matching run, which the caches of the output folder keep short: the watcher keeps the
+parsed config folder and only parses the changed config files again, the ingestion cache skips parsing a students
+file that did not change, the stage cache reuses the preparation stages whose inputs did not change, and the
+component store recomputes only the distance components whose inputs changed. Files saved without a change, and
+config.ini saved without a changed value, do not start a run.
+"""
+import argparse
+import configparser
+import hashlib
+import os
+import time
+from typing import Dict, Optional, Set, Tuple
+
+import colorlog as logging
+
+import validation
+
+# Seconds between two scans of the watched folders
+WATCH_INTERVAL: float = 1.0
+
+# Seconds a changed file must stay unchanged before it is read, so exports still being written are not matched
+SETTLE_TIME: float = 0.5
+
+INPUT_FILES: Tuple[str, ...] = ('local_students.csv', 'incoming_students.csv')
+
+
+def watched_files(input_dir: str, config_dir: str) -> Dict[str, str]:
+    """The path of every watched file by its name."""
+    paths = {name: os.path.join(input_dir, name) for name in INPUT_FILES}
+    paths.update({name: os.path.join(config_dir, name) for name in validation.CONFIG_FILES})
+    return paths
+
+
+def scan(paths: Dict[str, str]) -> Dict[str, Optional[Tuple[int, int]]]:
+    """The modification time and size of every watched file, None for missing files."""
+    stats = {}
+    for name, path in paths.items():
+        try:
+            stat = os.stat(path)
+            stats[name] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stats[name] = None
+    return stats
+
+
+def file_digest(path: str) -> Optional[str]:
+    """The SHA-256 of a file, None when it is missing."""
+    try:
+        with open(path, 'rb') as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def read_config_sections(config_dir: str) -> Dict[str, Dict[str, str]]:
+    """The values of config.ini by section, empty when it cannot be parsed."""
+    config = configparser.ConfigParser()
+    try:
+        config.read(os.path.join(config_dir, 'config.ini'))
+    except configparser.Error:
+        return {}
+    return {section: dict(config.items(section)) for section in config.sections()}
+
+
+def _run(arguments: argparse.Namespace, configuration, changed_config_files: Optional[Set[str]]):
+    """Runs the matching with the configuration reloaded where needed, returning it, or None when the files are unusable."""
+    import pipeline
+
+    problems = validation.validate(arguments.input_dir, arguments.config_dir)
+    for problem in problems:
+        logging.error(problem)
+    if problems:
+        logging.warning("Waiting for the files to be fixed before matching again")
+        return None
+
+    started = time.perf_counter()
+    try:
+        configuration = pipeline.load_configuration(arguments.config_dir, configuration, changed_config_files)
+        report_files = pipeline.run_match(arguments, configuration)
+    except Exception:
+        logging.exception("Matching failed, waiting for the next change")
+        return None
+    logging.info("%i reports written in %.1f s", len(report_files), time.perf_counter() - started)
+    return configuration
+
+
+def watch(arguments: argparse.Namespace) -> int:
+    """Matches once, then again after every change to a watched file, until interrupted.
+
+    Args:
+        arguments (argparse.Namespace): The parsed arguments of `main.py match`.
+
+    Returns:
+        int: The exit code.
+    """
+    paths = watched_files(arguments.input_dir, arguments.config_dir)
+    state = scan(paths)
+    digests = {name: file_digest(path) for name, path in paths.items()}
+    sections = read_config_sections(arguments.config_dir)
+    configuration = _run(arguments, None, None)
+    # config files changed since the configuration was last loaded, all of them until a first run succeeds
+    pending_config_files: Set[str] = set() if configuration is not None else set(validation.CONFIG_FILES)
+
+    logging.info("Watching %s and %s for changes, press Ctrl+C to stop", arguments.input_dir, arguments.config_dir)
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            current = scan(paths)
+            if current == state:
+                continue
+            # wait until the files stop changing
+            settled = None
+            while settled != current:
+                settled = current
+                time.sleep(SETTLE_TIME)
+                current = scan(paths)
+
+            touched = [name for name in paths if current[name] != state[name]]
+            state = current
+            changed = set()
+            for name in touched:
+                digest = file_digest(paths[name])
+                if digest != digests[name]:
+                    changed.add(name)
+                    digests[name] = digest
+            if not changed:
+                continue
+
+            if 'config.ini' in changed:
+                # only comments or formatting of config.ini changed when its values are the same
+                new_sections = read_config_sections(arguments.config_dir)
+                if new_sections == sections:
+                    changed.discard('config.ini')
+                sections = new_sections
+            pending_config_files |= changed & set(validation.CONFIG_FILES)
+            if not changed:
+                logging.info("config.ini saved without changes to the matching")
+                continue
+
+            logging.info("%s changed, matching again", ', '.join(sorted(changed)))
+            new_configuration = _run(arguments, configuration, pending_config_files if configuration is not None else None)
+            if new_configuration is not None:
+                configuration = new_configuration
+                pending_config_files = set()
+    except KeyboardInterrupt:
+        logging.info("Stopped watching")
+    return 0
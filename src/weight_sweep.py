@@ -0,0 +1,337 @@
+"""Weight sweeps behind `main.py sweep`: compares many [normalization] and [hobbies] weightings of config.ini in one run.
+
+The students are prepared and the raw distance components computed once, through the component store. Every
+candidate weighting is then a tensordot of its factors with the component stack, and the assignments of the
+candidates are solved in parallel worker processes. [hobbies] weights change the interests component itself, so
+when a candidate changes them the interests component is weighed from a stack of per-hobby differences instead.
+
+All incoming students are matched, as in the 'with_outliers' report. The comparison table lists for every
+candidate the total distance of its pairs, the average of every raw distance component over its pairs and the
+number of incoming students whose buddy differs from the baseline, the weights of config.ini.
+"""
+import argparse
+import configparser
+import itertools
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import colorlog as logging
+
+import validation
+from scoring_plan import COMPONENT_FACTORS, DISTANCE_COMPONENTS
+
+SWEEP_PREFIX: str = 'sweep_'
+
+BASELINE: str = 'baseline'
+
+# State of a sweep worker process, set once by _attach_sweep
+_worker_state: dict = {}
+
+
+@dataclass(frozen=True)
+class Candidate:
+    """One weighting of the sweep.
+
+    Attributes:
+        name (str): The name of the candidate in the comparison table.
+        weights (Dict[Tuple[str, str], float]): The changed weights by config.ini section and option.
+    """
+    name: str
+    weights: Dict[Tuple[str, str], float] = field(default_factory=dict)
+
+    @property
+    def changes(self) -> str:
+        return '; '.join(f'{option}={value:g}' for (_, option), value in self.weights.items())
+
+
+def resolve_weight(key: str, hobbies: List[str]) -> Tuple[str, str]:
+    """The config.ini section and option of a weight, a [normalization] factor such as age_factor or a hobby."""
+    normalized = key.strip().lower()
+    for option in COMPONENT_FACTORS.values():
+        if option == normalized:
+            return 'normalization', option
+    for hobby in hobbies:
+        if hobby.lower() == normalized:
+            return 'hobbies', hobby
+    raise ValueError(f"Unknown weight '{key}', expected a [normalization] factor ({', '.join(COMPONENT_FACTORS.values())}) "
+                     f"or a hobby ({', '.join(hobbies)})")
+
+
+def _parse_weight(key: str, value: str) -> float:
+    try:
+        weight = float(value)
+    except ValueError:
+        raise ValueError(f"The weight {key} = '{value}' is not a number")
+    if weight < 0:
+        raise ValueError(f"The weight {key} = {value} is negative")
+    return weight
+
+
+def read_candidates(path: str, hobbies: List[str]) -> List[Candidate]:
+    """Reads the candidates of a CSV file with one weighting per row.
+
+    The columns are weights, see resolve_weight, and an optional name column. Empty cells keep the weight of
+    config.ini.
+    """
+    table = pd.read_csv(path, dtype=str, skipinitialspace=True)
+    weight_columns = [column for column in table.columns if column.strip().lower() != 'name']
+    keys = {column: resolve_weight(column, hobbies) for column in weight_columns}
+
+    candidates = []
+    for position, row in enumerate(table.itertuples(index=False)):
+        row = dict(zip(table.columns, row))
+        name = next((str(value) for column, value in row.items() if column.strip().lower() == 'name' and pd.notna(value)),
+                    f'candidate_{position + 1}')
+        weights = {keys[column]: _parse_weight(column, row[column]) for column in weight_columns if pd.notna(row[column])}
+        candidates.append(Candidate(name, weights))
+    return candidates
+
+
+def grid_candidates(grid: List[str], hobbies: List[str]) -> List[Candidate]:
+    """The candidates of every combination of the KEY=V1,V2,... values of grid."""
+    axes = []
+    for entry in grid:
+        key, separator, values = entry.partition('=')
+        if not separator or not values.strip():
+            raise ValueError(f"Malformed --grid '{entry}', expected KEY=V1,V2,...")
+        resolved = resolve_weight(key, hobbies)
+        axes.append([(resolved, _parse_weight(key, value)) for value in values.split(',')])
+
+    candidates = []
+    for combination in itertools.product(*axes):
+        candidate = Candidate('', dict(combination))
+        candidates.append(Candidate(candidate.changes, candidate.weights))
+    return candidates
+
+
+def candidate_config(config: configparser.ConfigParser, candidate: Candidate) -> configparser.ConfigParser:
+    """A copy of config.ini with the weights of the candidate."""
+    changed = configparser.ConfigParser()
+    changed.read_dict(config)
+    for (section, option), value in candidate.weights.items():
+        changed.set(section, option, repr(value))
+    return changed
+
+
+def candidate_weights(
+    config: configparser.ConfigParser,
+    normal_dict: Dict[str, float],
+    hobbies: List[str],
+    baseline_hobby_weights: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray], float]:
+    """The weights a candidate's distances are contracted with.
+
+    Returns:
+        Tuple[np.ndarray, Optional[np.ndarray], float]: The factor of every component in DISTANCE_COMPONENTS order.
+        When the hobby weights differ from baseline_hobby_weights, also the weights of the per-hobby stack (see
+        build_hobby_stack) and the constant whose sum is the candidate's interests component, otherwise None and 0.
+    """
+    import normalization_calculator
+    import scoring_plan
+
+    plan = scoring_plan.build_scoring_plan(
+        config, {**normal_dict, 'hobby_range': normalization_calculator.compute_hobby_range(config, hobbies)}, hobbies)
+    factors = plan.factor_vector
+    if np.array_equal(plan.hobby_weights, baseline_hobby_weights):
+        return factors, None, 0.0
+
+    # the interests distance is nan, and so 0.5, for pairs missing a hobby and for every pair when the range is 0
+    if plan.hobby_range == 0:
+        return factors, np.zeros(len(hobbies) + 1), 0.5
+    return factors, np.append(plan.hobby_weights / plan.hobby_range, 0.5), 0.0
+
+
+def build_hobby_stack(local: Dict[str, np.ndarray], incoming: Dict[str, np.ndarray], path: str) -> None:
+    """Writes the (hobbies + 1) x L x I stack the interests component of any hobby weights is a tensordot of.
+
+    Slice h holds the absolute difference in hobby h of every pair, the last slice marks the pairs missing any
+    hobby answer, whose interests distance is 0.5 whatever the weights. The differences of those pairs are 0.
+    """
+    local_hobbies, incoming_hobbies = local['hobbies'], incoming['hobbies']
+    missing = np.isnan(local_hobbies).any(axis=1)[:, None] | np.isnan(incoming_hobbies).any(axis=1)[None, :]
+    stack = np.lib.format.open_memmap(
+        path, mode='w+', dtype=np.float64, shape=(local_hobbies.shape[1] + 1, len(local_hobbies), len(incoming_hobbies)))
+    for hobby_index in range(local_hobbies.shape[1]):
+        difference = np.abs(local_hobbies[:, hobby_index, None] - incoming_hobbies[None, :, hobby_index])
+        difference[missing] = 0.0
+        stack[hobby_index] = difference
+    stack[-1] = missing
+    stack.flush()
+
+
+def _attach_sweep(
+    stack_path: str,
+    hobby_stack_path: Optional[str],
+    capacities: np.ndarray,
+    extra_capacities: np.ndarray,
+    extra_buddy_penalty: float,
+    solver,
+    infeasible: Optional[np.ndarray]) -> None:
+    """Process pool initializer: maps the component stacks into this worker and keeps the assignment problem."""
+    _worker_state.update({
+        'stack': np.load(stack_path, mmap_mode='r'),
+        'hobby_stack': None if hobby_stack_path is None else np.load(hobby_stack_path, mmap_mode='r'),
+        'capacities': capacities,
+        'extra_capacities': extra_capacities,
+        'extra_buddy_penalty': extra_buddy_penalty,
+        'solver': solver,
+        'infeasible': infeasible,
+    })
+
+
+def _solve_candidate(
+    factors: np.ndarray,
+    hobby_vector: Optional[np.ndarray],
+    constant: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Weighs the stacks and solves the assignment of one candidate in a worker.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The assignment, see student_matcher.ASSIGNMENT_DTYPE, and the average of
+        every raw distance component over its pairs.
+    """
+    import student_matcher
+
+    stack, hobby_stack = _worker_state['stack'], _worker_state['hobby_stack']
+    interests = DISTANCE_COMPONENTS.index('interests')
+    if hobby_vector is None:
+        distances = np.tensordot(factors, stack, axes=1)
+    else:
+        # the interests component of the stack is replaced by the one of the candidate's hobby weights
+        distances = np.tensordot(np.where(np.arange(len(factors)) == interests, 0.0, factors), stack, axes=1)
+        distances += factors[interests] * (np.tensordot(hobby_vector, hobby_stack, axes=1) + constant)
+
+    assignment = student_matcher.solve_capacitated_assignment(
+        distances, _worker_state['capacities'], _worker_state['extra_capacities'],
+        _worker_state['extra_buddy_penalty'], _worker_state['solver'], _worker_state['infeasible'])
+
+    local_positions, incoming_positions = assignment['local'], assignment['incoming']
+    with np.errstate(invalid='ignore'):
+        averages = stack[:, local_positions, incoming_positions].mean(axis=1)
+        if hobby_vector is not None:
+            averages[interests] = (hobby_vector @ hobby_stack[:, local_positions, incoming_positions] + constant).mean()
+    return assignment, averages
+
+
+def compare_candidates(
+    candidates: List[Candidate],
+    results: List[Tuple[np.ndarray, np.ndarray]],
+    incoming_count: int) -> pd.DataFrame:
+    """The comparison table of the candidates, the first of which is the baseline."""
+    def buddies(assignment: np.ndarray) -> np.ndarray:
+        local_positions = np.full(incoming_count, -1, dtype=np.int64)
+        local_positions[assignment['incoming']] = assignment['local']
+        return local_positions
+
+    baseline_buddies = buddies(results[0][0])
+    rows = []
+    for candidate, (assignment, averages) in zip(candidates, results):
+        row = {
+            'candidate': candidate.name,
+            'changes': candidate.changes,
+            'matched': len(assignment),
+            'total_distance': float(assignment['cost'].sum()),
+            'mean_distance': float(assignment['cost'].mean()) if len(assignment) else np.nan,
+            'pairs_changed': int((buddies(assignment) != baseline_buddies).sum()),
+        }
+        row.update({f'mean_{name}': float(average) for name, average in zip(DISTANCE_COMPONENTS, averages)})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def run_sweep(arguments: argparse.Namespace) -> int:
+    """Compares the candidate weightings of --candidates and --grid with the weights of config.ini.
+
+    Args:
+        arguments (argparse.Namespace): The parsed arguments of `main.py sweep`.
+
+    Returns:
+        int: The exit code, 1 when the files or the candidates cannot be used.
+    """
+    import component_store
+    import constraints
+    import distance_calculator
+    import formatter
+    import instrumentation
+    import pipeline
+    import scoring_plan
+    import student_matcher
+
+    problems = validation.validate(arguments.input_dir, arguments.config_dir)
+    for problem in problems:
+        logging.error(problem)
+    if problems:
+        return 1
+
+    configuration = pipeline.load_configuration(arguments.config_dir)
+    hobbies = configuration.hobbies
+    try:
+        candidates = [Candidate(BASELINE)]
+        if arguments.candidates:
+            candidates += read_candidates(arguments.candidates, hobbies)
+        candidates += grid_candidates(arguments.grid, hobbies) if arguments.grid else []
+    except (OSError, ValueError) as e:
+        logging.error("Cannot read the sweep candidates: %s", e)
+        return 1
+
+    output_dir = arguments.output_dir
+    local_students, incoming_students, normal_dict = pipeline.prepare_students(
+        arguments, configuration, instrumentation.Recorder())
+    plan = scoring_plan.build_scoring_plan(configuration.config, normal_dict, hobbies)
+    local, incoming = distance_calculator.encode_students(local_students, incoming_students, configuration.faculties, plan)
+    stack_path = component_store.store_component_stack(
+        local, incoming, plan, configuration.faculties.distances, output_dir, arguments.workers)
+
+    capacities, extra_capacities = student_matcher.local_capacities(
+        local_students, formatter.get_base_capacities(local_students), formatter.get_base_necessity(incoming_students))
+    infeasible = constraints.infeasible_pairs(local, incoming, constraints.build_constraints(configuration.config))
+    extra_buddy_penalty = configuration.config.getfloat(
+        'parameters', 'extra_buddy_penalty', fallback=student_matcher.DEFAULT_EXTRA_BUDDY_PENALTY)
+    solver = arguments.solver
+    if solver == 'auction':
+        import auction_solver
+
+        # the candidates already keep the workers busy
+        solver = auction_solver.make_auction_solver(arguments.auction_epsilon, 1)
+
+    # candidates with the same weights, such as rows repeating config.ini, are solved once
+    solved_keys = {}
+    solved_weights = []
+    solved_positions = []
+    for candidate in candidates:
+        factors, hobby_vector, constant = candidate_weights(
+            candidate_config(configuration.config, candidate), normal_dict, hobbies, plan.hobby_weights)
+        key = (factors.tobytes(), None if hobby_vector is None else hobby_vector.tobytes(), constant)
+        if key not in solved_keys:
+            solved_keys[key] = len(solved_weights)
+            solved_weights.append((factors, hobby_vector, constant))
+        solved_positions.append(solved_keys[key])
+    workers = max(1, min(arguments.workers, len(solved_weights)))
+    logging.info("Solving %i distinct weightings of %i candidates with %i workers", len(solved_weights), len(candidates), workers)
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as temporary_dir:
+        hobby_stack_path = None
+        if any(hobby_vector is not None for _, hobby_vector, _ in solved_weights):
+            hobby_stack_path = os.path.join(temporary_dir, 'hobby_components.npy')
+            build_hobby_stack(local, incoming, hobby_stack_path)
+
+        initargs = (stack_path, hobby_stack_path, capacities, extra_capacities, extra_buddy_penalty, solver, infeasible)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach_sweep, initargs=initargs) as executor:
+                solved = list(executor.map(_solve_candidate, *zip(*solved_weights)))
+        else:
+            _attach_sweep(*initargs)
+            solved = [_solve_candidate(*weighting) for weighting in solved_weights]
+            _worker_state.clear()
+
+    table = compare_candidates(candidates, [solved[position] for position in solved_positions], len(incoming_students))
+    path = os.path.join(output_dir, f"{SWEEP_PREFIX}{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv")
+    table.to_csv(path, index=False)
+    logging.info("Sweep comparison saved to %s", path)
+    print(table[['candidate', 'matched', 'total_distance', 'mean_distance', 'pairs_changed']].to_string(
+        index=False, float_format='{:.3f}'.format))
+    return 0